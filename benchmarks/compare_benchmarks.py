@@ -0,0 +1,75 @@
+"""
+Compare two benchmark result files written by run_benchmarks.py (e.g. two IsoGroup versions).
+
+For each (mode, size) case run in both files, the wall time of each stage and of the whole pipeline are compared.
+Stages slower than the threshold are flagged, and the exit status is 1 if any of them is found.
+
+Usage:
+    python benchmarks/compare_benchmarks.py results/base.json results/new.json --threshold 0.2
+"""
+import argparse
+import json
+import sys
+
+
+def load_cases(path:str) -> tuple[dict, dict]:
+    """
+    Read a result file.
+
+    :param path: Path of the result file.
+    :return: report and cases {(mode, n_features): result}.
+    """
+    with open(path) as f:
+        report = json.load(f)
+    return report, {(result["mode"], result["n_features"]): result for result in report["results"]}
+
+
+def compare(base:dict, new:dict, threshold:float, min_time:float) -> list:
+    """
+    Compare the wall times of the cases run in both result files.
+
+    :param base: Reference cases {(mode, n_features): result}.
+    :param new: Compared cases {(mode, n_features): result}.
+    :param threshold: Relative slowdown above which a stage is flagged as a regression (e.g. 0.2 for +20%).
+    :param min_time: Stages faster than this time (in seconds) in both files are not flagged, their timing being too noisy.
+    :return: list of (mode, n_features, stage, base time, new time, regression) rows.
+    """
+    rows = []
+    for key in sorted(base.keys() & new.keys()):
+        base_stages, new_stages = base[key]["stages"], new[key]["stages"]
+        timings = [(name, base_stages[name]["wall_time"], new_stages[name]["wall_time"])
+                   for name in base_stages if name in new_stages]
+        timings.append(("total", base[key]["total_wall_time"], new[key]["total_wall_time"]))
+        for name, base_time, new_time in timings:
+            regression = max(base_time, new_time) >= min_time and new_time > base_time * (1 + threshold)
+            rows.append((*key, name, base_time, new_time, regression))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two IsoGroup benchmark result files")
+    parser.add_argument("base", help="reference result file")
+    parser.add_argument("new", help="compared result file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown flagged as a regression (default: 0.2)")
+    parser.add_argument("--min_time", type=float, default=0.05,
+                        help="stages faster than this time (in seconds) are not flagged (default: 0.05)")
+    args = parser.parse_args()
+
+    base_report, base = load_cases(args.base)
+    new_report, new = load_cases(args.new)
+    print(f"base: {base_report['version']} ({base_report['commit']}, {base_report['date']})")
+    print(f"new:  {new_report['version']} ({new_report['commit']}, {new_report['date']})")
+    if base_report["params"] != new_report["params"]:
+        print("Warning: the benchmarks were run with different parameters.")
+
+    rows = compare(base, new, args.threshold, args.min_time)
+    print(f"{'mode':>10} {'features':>9} {'stage':<22} {'base (s)':>10} {'new (s)':>10} {'ratio':>7}")
+    for mode, n_features, name, base_time, new_time, regression in rows:
+        ratio = new_time / base_time if base_time else float("inf")
+        print(f"{mode:>10} {n_features:>9} {name:<22} {base_time:10.3f} {new_time:10.3f} {ratio:7.2f}{'  <- slower' if regression else ''}")
+    sys.exit(1 if any(row[-1] for row in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Benchmarks of the targeted and untargeted pipelines on synthetic datasets (see isogroup.base.synthetic).
+
+Each (mode, size) case runs in a fresh process, so that the peak resident memory of a case does not include the
+memory of the previous ones. The wall time, CPU time, peak memory and item counts of each stage are taken from the
+PipelineMetrics of the experiment, and the best of the repeats is kept. Results are written to a JSON file named
+after the IsoGroup version and git commit, to be compared between versions with compare_benchmarks.py.
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 100000 1000000
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import sys
+
+import isogroup
+from isogroup.base.synthetic import SyntheticDataset
+from isogroup.base.targeted_experiment import TargetedExperiment
+from isogroup.base.untargeted_experiment import UntargetedExperiment
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def run_case(mode:str, n_features:int, params:dict, repeat:int) -> dict:
+    """
+    Generate a synthetic dataset and run a pipeline on it, in the current process.
+
+    :param mode: "targeted" or "untargeted".
+    :param n_features: Number of features of the synthetic dataset.
+    :param params: Parameters of the generator and of the pipeline (see build_parser).
+    :param repeat: Number of runs; the best wall time of each stage is kept.
+    :return: dict {"mode", "n_features", "stages": {stage: measures}, "total_wall_time", "peak_rss"}.
+    """
+    logging.getLogger("IsoGroup").setLevel(logging.WARNING)
+    synthetic = SyntheticDataset(n_features, tracer=params["tracer"], n_samples=params["samples"],
+                                 atoms=tuple(params["atoms"]), rt_density=params["rt_density"],
+                                 noise_fraction=params["noise_fraction"], missing_fraction=params["missing_fraction"],
+                                 database_size=params["database_size"], seed=params["seed"]).generate()
+
+    stages = {}
+    max_rss = None
+    for _ in range(repeat):
+        if mode == "targeted":
+            experiment = TargetedExperiment(dataset=synthetic.dataset, tracer=params["tracer"], ppm_tol=params["ppm_tol"],
+                                            rt_tol=params["rt_tol"], database=synthetic.database)
+            experiment.run_targeted_pipeline()
+        else:
+            experiment = UntargetedExperiment(dataset=synthetic.dataset, tracer=params["tracer"], ppm_tol=params["ppm_tol"],
+                                              rt_tol=params["rt_tol"], keep=params["keep"], engine=params["engine"])
+            experiment.run_untargeted_pipeline()
+        for stage in experiment.metrics.stages:
+            best = stages.get(stage.name)
+            if best is None or stage.wall_time < best["wall_time"]:
+                stages[stage.name] = stage.as_dict()
+        if experiment.metrics.peak_rss is not None:
+            max_rss = max(max_rss or 0, experiment.metrics.peak_rss)
+
+    return {"mode": mode,
+            "n_features": n_features,
+            "stages": stages,
+            "total_wall_time": sum(stage["wall_time"] for stage in stages.values()),
+            "peak_rss": max_rss}
+
+
+def git_commit() -> str | None:
+    """
+    Returns the short hash of the current git commit, or None outside of a git repository.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmarks of IsoGroup on synthetic datasets")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000],
+                        help="numbers of features of the synthetic datasets (default: 10^3 to 10^6)")
+    parser.add_argument("--modes", type=str, nargs="+", default=["targeted", "untargeted"], choices=["targeted", "untargeted"],
+                        help="pipelines to benchmark")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="number of runs of each case, the best time of each stage is kept (default: 1)")
+    parser.add_argument("--tracer", type=str, default="13C")
+    parser.add_argument("--samples", type=int, default=3,
+                        help="number of samples of the synthetic datasets (default: 3)")
+    parser.add_argument("--atoms", type=int, nargs=2, default=[2, 20],
+                        help="range of the number of tracer atoms of the metabolites (default: 2 20)")
+    parser.add_argument("--rt_density", type=float, default=50,
+                        help="number of features per unit of retention time (default: 50)")
+    parser.add_argument("--noise_fraction", type=float, default=0.2,
+                        help="fraction of noise features (default: 0.2)")
+    parser.add_argument("--missing_fraction", type=float, default=0.05,
+                        help="fraction of null intensities (default: 0.05)")
+    parser.add_argument("--database_size", type=int, default=None,
+                        help="number of metabolites of the database (default: the planted metabolites)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-ppm", "--ppm_tol", type=float, default=5)
+    parser.add_argument("-rt", "--rt_tol", type=float, default=10)
+    parser.add_argument("-k", "--keep", type=str, default="both",
+                        help='deduplication strategy of the untargeted pipeline (default: "both")')
+    parser.add_argument("-e", "--engine", type=str, default="star", choices=["star", "graph"],
+                        help='clustering engine of the untargeted pipeline (default: "star")')
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="result file (default: results/<version>_<commit>.json next to this script)")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    params = {key: value for key, value in vars(args).items() if key not in ("sizes", "modes", "repeat", "output")}
+
+    results = []
+    for mode in args.modes:
+        for n_features in args.sizes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                result = pool.submit(run_case, mode, n_features, params, args.repeat).result()
+            results.append(result)
+            peak_rss = (result["peak_rss"] or 0) / 2**20
+            print(f"{mode:>10} {n_features:>9} features: {result['total_wall_time']:8.2f} s, peak RSS {peak_rss:.0f} MiB", flush=True)
+            for name, stage in result["stages"].items():
+                print(f"{'':>21} {name:<22} {stage['wall_time']:8.3f} s", flush=True)
+
+    commit = git_commit()
+    report = {"version": isogroup.__version__,
+              "commit": commit,
+              "date": datetime.now().isoformat(timespec="seconds"),
+              "python": sys.version.split()[0],
+              "platform": platform.platform(),
+              "params": params,
+              "repeat": args.repeat,
+              "results": results}
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{isogroup.__version__}_{commit or 'nogit'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
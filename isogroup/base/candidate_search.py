@@ -0,0 +1,404 @@
+from __future__ import annotations
+import bisect
+import numpy as np
+from isogroup.base.misc import Misc
+from isogroup.base.parallel import ParallelExecutor
+
+
+class CandidateSearch:
+    """
+    Search of isotopologue candidates between features sorted by retention time.
+    A candidate pair (base, candidate) is formed when the candidate is within the RT window of the base feature,
+    and its m/z matches (within the ppm tolerance) the m/z of the base shifted by a whole number of tracer atoms.
+    Features are referred to by their position in the arrays sorted by retention time.
+    """
+
+    parallel_block_size = 10000 # minimal number of base features searched by a process
+
+    def __init__(self, mzshift_tracer:float, tracer_element:str, rt_tol:float, ppm_tol:float, max_atoms:int=None, min_atoms:int=0, chunk_size:int=2048, n_jobs:int=1):
+        """
+        :param mzshift_tracer: m/z shift corresponding to the tracer.
+        :param tracer_element: Tracer element (e.g. "C").
+        :param rt_tol: Retention time window for clustering.
+        :param ppm_tol: m/z tolerance in parts per million for clustering.
+        :param max_atoms: Maximum number of tracer atoms to consider for isotopologues. If None, it is estimated from the m/z of the base feature.
+        :param min_atoms: Minimum number of tracer atoms between the base and the candidate. With 1, features at the same m/z are not paired.
+        :param chunk_size: Number of base features processed at once by the vectorized search, to bound memory usage.
+        :param n_jobs: Number of processes used by pairs(). Base features are split into contiguous blocks searched in parallel.
+        """
+        self.mzshift_tracer = mzshift_tracer
+        self.tracer_element = tracer_element
+        self.rt_tol = rt_tol
+        self.ppm_tol = ppm_tol
+        self.max_atoms = max_atoms
+        self.min_atoms = min_atoms
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+
+    def pairs_loop(self, rts:list, mzs:list) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Reference implementation of the candidate search, testing every feature of the RT window one at a time.
+
+        :param rts: Retention times, sorted in ascending order.
+        :param mzs: m/z of the features, in the same order as rts.
+        :return: positions of the base features and of their candidates.
+        """
+        rts = list(rts)
+        mzs = list(mzs)
+        bases, candidates = [], []
+        for base_idx, (base_rt, base_mz) in enumerate(zip(rts, mzs)):
+            left_bound = bisect.bisect_left(rts, base_rt - self.rt_tol)
+            right_bound = bisect.bisect_right(rts, base_rt + self.rt_tol)
+
+            for candidate_idx in range(left_bound, right_bound):
+                if candidate_idx == base_idx:
+                    continue
+                candidate_mz = mzs[candidate_idx]
+
+                iso_index = Misc.calculate_isotopologue_index(candidate_mz, base_mz, self.mzshift_tracer)
+                # Define a maximum number of tracer atoms if specified
+                max_iso = Misc.get_max_isotopologues_for_mz(base_mz, self.tracer_element) if self.max_atoms is None else self.max_atoms
+
+                if abs(iso_index) > max_iso or abs(iso_index) < self.min_atoms:
+                    continue
+
+                expected_mz = base_mz + iso_index * self.mzshift_tracer
+                delta_ppm = abs(expected_mz - candidate_mz) / expected_mz * 1e6
+
+                if delta_ppm <= self.ppm_tol:
+                    bases.append(base_idx)
+                    candidates.append(candidate_idx)
+        return np.array(bases, dtype=np.int64), np.array(candidates, dtype=np.int64)
+
+    def pairs(self, rts:np.ndarray, mzs:np.ndarray, start:int=0, stop:int=None, executor:ParallelExecutor=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Candidate search used for clustering.
+        Uses the ladder index, unless the m/z tolerance is too wide for the residues to discriminate between features.
+        With n_jobs > 1, contiguous blocks of base features are searched in parallel and their pairs concatenated in order.
+        Returns the same pairs as pairs_loop, sorted by base then candidate position.
+
+        :param rts: Retention times, sorted in ascending order.
+        :param mzs: m/z of the features, in the same order as rts.
+        :param start: Position of the first base feature to search.
+        :param stop: Position after the last base feature to search. If None, all features from start are searched.
+        :param executor: Executor running the blocks, e.g. shared by the partitions of partitioned_pairs. If None, a new one is used.
+        :return: positions of the base features and of their candidates.
+        """
+        rts = np.asarray(rts, dtype=np.float64)
+        mzs = np.asarray(mzs, dtype=np.float64)
+        stop = len(rts) if stop is None else stop
+        if not len(mzs) or self.residue_tol(mzs) * 4 >= self.mzshift_tracer:
+            method = "window_pairs"
+        else:
+            method = "ladder_pairs"
+
+        if executor is None:
+            executor = ParallelExecutor(self.n_jobs, self.parallel_block_size)
+        tasks = [(self, method, start + block_start, start + block_stop) for block_start, block_stop in executor.blocks(stop - start)]
+        results = executor.map(_search_block, tasks, {"rts": rts, "mzs": mzs})
+        if len(results) == 1:
+            return results[0]
+        return np.concatenate([bases for bases, _ in results]), np.concatenate([candidates for _, candidates in results])
+
+    def rt_partitions(self, rts:np.ndarray, partition_size:int, order:np.ndarray=None) -> list:
+        """
+        Split features sorted by retention time into partitions of contiguous base features (the core),
+        extended on each side by a halo of the features within rt_tol of the core.
+        The RT window of every base feature of the core is contained in the core and halo of its partition.
+
+        :param rts: Retention times, sorted in ascending order (or in any order if order is given).
+        :param partition_size: Number of base features in the core of each partition.
+        :param order: Positions sorting rts in ascending order. If None, rts are already sorted.
+        :return: list of (core_start, core_stop, halo_start, halo_stop) positions, in retention time order.
+        """
+        if partition_size < 1:
+            raise ValueError(f"partition_size must be a positive integer, got {partition_size}.")
+        partitions = []
+        for core_start in range(0, len(rts), partition_size):
+            core_stop = min(core_start + partition_size, len(rts))
+            first_rt, last_rt = (rts[core_start], rts[core_stop - 1]) if order is None else (rts[order[core_start]], rts[order[core_stop - 1]])
+            halo_start = int(np.searchsorted(rts, first_rt - self.rt_tol, side="left", sorter=order))
+            halo_stop = int(np.searchsorted(rts, last_rt + self.rt_tol, side="right", sorter=order))
+            partitions.append((core_start, core_stop, halo_start, halo_stop))
+        return partitions
+
+    def partitioned_pairs(self, rts:np.ndarray, mzs:np.ndarray, partition_size:int=None, order:np.ndarray=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Candidate search partition by partition along the retention time axis (see rt_partitions).
+        Only the core and halo of one partition are read from rts and mzs at a time, so that they can be memory-mapped
+        arrays larger than the available memory. Pairs are formed for the base features of the core, which sees all its
+        candidates through the halo, and are concatenated in partition order: they are the same as the pairs of a global search.
+        With order, the features of each partition are gathered from the unsorted arrays, so that no sorted copy of the
+        whole arrays is made. A global search (partition_size None) gathers all the features at once.
+        With n_jobs > 1, the partitions are searched one after the other by the same process pool.
+
+        :param rts: Retention times, sorted in ascending order (or in any order if order is given).
+        :param mzs: m/z of the features, in the same order as rts.
+        :param partition_size: Number of base features in the core of each partition. If None, the search is global.
+        :param order: Positions sorting rts in ascending order. If None, rts and mzs are already sorted.
+        :return: positions of the base features and of their candidates, in retention time order.
+        """
+        if partition_size is None:
+            if order is not None:
+                rts, mzs = rts[order], mzs[order]
+            return self.pairs(rts, mzs)
+
+        bases, candidates = [], []
+        with ParallelExecutor(self.n_jobs, self.parallel_block_size) as executor:
+            for core_start, core_stop, halo_start, halo_stop in self.rt_partitions(rts, partition_size, order):
+                if order is None:
+                    partition_rts, partition_mzs = rts[halo_start:halo_stop], mzs[halo_start:halo_stop]
+                else:
+                    rows = order[halo_start:halo_stop]
+                    partition_rts, partition_mzs = rts[rows], mzs[rows]
+                base_pos, candidate_pos = self.pairs(partition_rts, partition_mzs, core_start - halo_start, core_stop - halo_start,
+                                                     executor=executor)
+                bases.append(base_pos + halo_start)
+                candidates.append(candidate_pos + halo_start)
+
+        if not bases:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(bases), np.concatenate(candidates)
+
+    def residue_tol(self, mzs:np.ndarray) -> float:
+        """
+        Returns the maximal difference between the residues (m/z modulo the tracer shift) of two matching features.
+        A candidate matching the base within the ppm tolerance deviates from the expected m/z by at most
+        ppm_tol * expected_mz, which is bounded using the highest m/z of the dataset.
+
+        :param mzs: m/z of the features.
+        """
+        max_mz = float(np.max(mzs))
+        ppm = self.ppm_tol * 1e-6
+        # Margin for the rounding errors of the modulo
+        return ppm * max_mz / (1 - ppm) + 1e-9 * max(1.0, max_mz)
+
+    def window_pairs(self, rts:np.ndarray, mzs:np.ndarray, start:int=0, stop:int=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorized candidate search over the RT windows.
+        The RT windows of a chunk of base features are expanded into arrays of (base, candidate) pairs, for which
+        the isotopologue indexes, expected m/z and ppm deviations are computed at once.
+        Returns the same pairs as pairs_loop, sorted by base then candidate position.
+
+        :param rts: Retention times, sorted in ascending order.
+        :param mzs: m/z of the features, in the same order as rts.
+        :param start: Position of the first base feature to search.
+        :param stop: Position after the last base feature to search. If None, all features from start are searched.
+        :return: positions of the base features and of their candidates.
+        """
+        rts = np.asarray(rts, dtype=np.float64)
+        mzs = np.asarray(mzs, dtype=np.float64)
+        stop = len(rts) if stop is None else stop
+        left_bounds = np.searchsorted(rts, rts - self.rt_tol, side="left")
+        right_bounds = np.searchsorted(rts, rts + self.rt_tol, side="right")
+        if self.max_atoms is None:
+            max_iso = Misc.get_max_isotopologues_for_mz_array(mzs, self.tracer_element)
+        else:
+            max_iso = np.full(len(mzs), self.max_atoms, dtype=np.int64)
+
+        bases, candidates = [], []
+        for chunk_start in range(start, stop, self.chunk_size):
+            chunk_stop = min(chunk_start + self.chunk_size, stop)
+            base_pos, candidate_pos = self._expand_windows(chunk_start, left_bounds[chunk_start:chunk_stop], right_bounds[chunk_start:chunk_stop])
+            if not len(base_pos):
+                continue
+            keep = self.match(mzs[base_pos], mzs[candidate_pos], max_iso[base_pos]) & (base_pos != candidate_pos)
+            bases.append(base_pos[keep])
+            candidates.append(candidate_pos[keep])
+
+        if not bases:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(bases), np.concatenate(candidates)
+
+    def ladder_pairs(self, rts:np.ndarray, mzs:np.ndarray, start:int=0, stop:int=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Candidate search based on a LadderIndex.
+        Only features lying on the same isotopic ladder as the base feature (same residue within tolerance)
+        in the neighbouring RT bins are tested, instead of every feature of the RT window.
+        Returns the same pairs as pairs_loop, sorted by base then candidate position.
+
+        :param rts: Retention times, sorted in ascending order.
+        :param mzs: m/z of the features, in the same order as rts.
+        :param start: Position of the first base feature to search.
+        :param stop: Position after the last base feature to search. If None, all features from start are searched.
+        :return: positions of the base features and of their candidates.
+        """
+        rts = np.asarray(rts, dtype=np.float64)
+        mzs = np.asarray(mzs, dtype=np.float64)
+        stop = len(rts) if stop is None else stop
+        if start >= stop:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        
+        index = LadderIndex(rts, mzs, self.mzshift_tracer, self.rt_tol, self.residue_tol(mzs))
+        if self.max_atoms is None:
+            max_iso = Misc.get_max_isotopologues_for_mz_array(mzs, self.tracer_element)
+        else:
+            max_iso = np.full(len(mzs), self.max_atoms, dtype=np.int64)
+
+        bases, candidates = [], []
+        for chunk_start in range(start, stop, self.chunk_size):
+            base_pos, candidate_pos = index.query(np.arange(chunk_start, min(chunk_start + self.chunk_size, stop), dtype=np.int64))
+            base_rt = rts[base_pos]
+            candidate_rt = rts[candidate_pos]
+            # Same RT window as the bisection of the sorted retention times
+            keep = ((base_pos != candidate_pos) 
+                    & (candidate_rt >= base_rt - self.rt_tol) 
+                    & (candidate_rt <= base_rt + self.rt_tol))
+            base_pos, candidate_pos = base_pos[keep], candidate_pos[keep]
+            keep = self.match(mzs[base_pos], mzs[candidate_pos], max_iso[base_pos])
+            base_pos, candidate_pos = base_pos[keep], candidate_pos[keep]
+            order = np.lexsort((candidate_pos, base_pos))
+            bases.append(base_pos[order])
+            candidates.append(candidate_pos[order])
+
+        return np.concatenate(bases), np.concatenate(candidates)
+
+    def ladder_components(self, rts:np.ndarray, mzs:np.ndarray, partition_size:int=None, order:np.ndarray=None) -> np.ndarray:
+        """
+        Label the isotopic ladders of the features.
+        The isotopic-adjacency graph links features whose m/z differ by exactly one tracer shift (within the ppm tolerance) 
+        in the RT window. Each connected component of this graph is a ladder.
+        Components are not bounded by max_atoms nor by the RT window: features are chained edge by edge, so co-eluting
+        compounds whose m/z lie on the same ladder are merged, and a component may span more than rt_tol.
+        With RT partitions, the edges of all partitions are gathered before labelling the components, so that ladders
+        crossing a partition boundary are merged.
+
+        :param rts: Retention times, sorted in ascending order (or in any order if order is given).
+        :param mzs: m/z of the features, in the same order as rts.
+        :param partition_size: Number of base features in the core of each RT partition. If None, the search is global.
+        :param order: Positions sorting rts in ascending order. If None, rts and mzs are already sorted.
+        :return: component label of each feature in retention time order, the label being the smallest position in the component.
+        """
+        adjacency = CandidateSearch(mzshift_tracer=self.mzshift_tracer, 
+                                    tracer_element=self.tracer_element,
+                                    rt_tol=self.rt_tol,
+                                    ppm_tol=self.ppm_tol,
+                                    max_atoms=1,
+                                    min_atoms=1,
+                                    chunk_size=self.chunk_size,
+                                    n_jobs=self.n_jobs)
+        sources, targets = adjacency.partitioned_pairs(rts, mzs, partition_size, order)
+        return self.connected_components(len(rts), sources, targets)
+
+    @staticmethod
+    def connected_components(nb_nodes:int, sources:np.ndarray, targets:np.ndarray) -> np.ndarray:
+        """
+        Label the connected components of a graph by propagating the smallest node index along the edges.
+
+        :param nb_nodes: Number of nodes of the graph.
+        :param sources: Source node of each edge.
+        :param targets: Target node of each edge.
+        :return: component label of each node, the label being the smallest node of the component.
+        """
+        labels = np.arange(nb_nodes, dtype=np.int64)
+        while True:
+            new_labels = labels.copy()
+            np.minimum.at(new_labels, sources, labels[targets])
+            np.minimum.at(new_labels, targets, labels[sources])
+            # Pointer jumping: a label is a node whose own label is smaller or equal
+            new_labels = new_labels[new_labels]
+            if np.array_equal(new_labels, labels):
+                return labels
+            labels = new_labels
+
+    def match(self, base_mz:np.ndarray, candidate_mz:np.ndarray, max_iso:np.ndarray) -> np.ndarray:
+        """
+        Returns a boolean mask of the candidate pairs whose m/z difference matches a whole number of tracer atoms within tolerance.
+
+        :param base_mz: m/z of the base features.
+        :param candidate_mz: m/z of the candidates.
+        :param max_iso: Maximum number of isotopologues for each base feature.
+        """
+        iso_index = np.rint((candidate_mz - base_mz) / self.mzshift_tracer)
+        expected_mz = base_mz + iso_index * self.mzshift_tracer
+        delta_ppm = np.abs(expected_mz - candidate_mz) / expected_mz * 1e6
+        return (np.abs(iso_index) <= max_iso) & (np.abs(iso_index) >= self.min_atoms) & (delta_ppm <= self.ppm_tol)
+
+    @staticmethod
+    def _expand_windows(start:int, left_bounds:np.ndarray, right_bounds:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Expand the RT windows [left_bound, right_bound) of consecutive base features into flat arrays of pairs.
+
+        :param start: Position of the first base feature.
+        :param left_bounds: First candidate position of each base feature.
+        :param right_bounds: Position after the last candidate of each base feature.
+        """
+        counts = right_bounds - left_bounds
+        total = int(counts.sum())
+        base_pos = np.repeat(np.arange(start, start + len(counts), dtype=np.int64), counts)
+        offsets = np.arange(total, dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+        candidate_pos = np.repeat(left_bounds, counts) + offsets
+        return base_pos, candidate_pos
+
+
+def _search_block(arrays:dict, search:CandidateSearch, method:str, start:int, stop:int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Search the candidates of a block of base features (task of CandidateSearch.pairs).
+
+    :param arrays: Shared arrays {"rts": sorted retention times, "mzs": m/z}.
+    :param search: CandidateSearch holding the parameters of the search.
+    :param method: Name of the search method ("window_pairs" or "ladder_pairs").
+    :param start: Position of the first base feature of the block.
+    :param stop: Position after the last base feature of the block.
+    """
+    return getattr(search, method)(arrays["rts"], arrays["mzs"], start, stop)
+
+
+class LadderIndex:
+    """
+    Index of features keyed by retention time bin and residue of their m/z modulo the tracer shift.
+    Isotopologues of a compound differ by whole numbers of tracer shifts, so they lie on the same isotopic ladder:
+    their residues are equal within the m/z tolerance. 
+    Features are stored sorted by (RT bin, residue), so that the features of a given ladder in a given RT bin are found by bisection.
+    """
+
+    def __init__(self, rts:np.ndarray, mzs:np.ndarray, mzshift_tracer:float, rt_tol:float, residue_tol:float):
+        """
+        :param rts: Retention times of the features.
+        :param mzs: m/z of the features.
+        :param mzshift_tracer: m/z shift corresponding to the tracer.
+        :param rt_tol: Retention time window. RT bins are slightly wider, so that the RT window of a feature spans at most 3 bins.
+        :param residue_tol: Maximal difference between the residues of two features of the same ladder.
+        """
+        self.mzshift_tracer = mzshift_tracer
+        self.residue_tol = residue_tol
+        self.bin_width = rt_tol * (1 + 1e-6) if rt_tol > 0 else 1.0
+        self.bins = np.floor(np.asarray(rts, dtype=np.float64) / self.bin_width).astype(np.int64)
+        self.bins -= self.bins.min()
+        self.residues = np.mod(np.asarray(mzs, dtype=np.float64), mzshift_tracer)
+
+        # Residues are circular: features close to 0 or to the tracer shift are also indexed on the other side
+        low = np.flatnonzero(self.residues < residue_tol)
+        high = np.flatnonzero(self.residues > mzshift_tracer - residue_tol)
+        positions = np.concatenate((np.arange(len(self.residues), dtype=np.int64), low, high))
+        residues = np.concatenate((self.residues, self.residues[low] + mzshift_tracer, self.residues[high] - mzshift_tracer))
+
+        # Sort key combining the RT bin and the residue, bins being separated by more than a tracer shift
+        self._bin_span = 2 * mzshift_tracer
+        keys = self.bins[positions] * self._bin_span + residues
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.positions = positions[order]
+
+    def __len__(self) -> int:
+        return len(self.residues)
+
+    def query(self, base_pos:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the features on the same ladder as the base features, in their RT bin and the two neighbouring ones.
+
+        :param base_pos: Positions of the base features.
+        :return: positions of the base features and of their potential candidates, one pair per candidate.
+        """
+        base_pos = np.asarray(base_pos, dtype=np.int64)
+        lows, highs = [], []
+        for delta in (-1, 0, 1):
+            key = (self.bins[base_pos] + delta) * self._bin_span + self.residues[base_pos]
+            lows.append(np.searchsorted(self.keys, key - self.residue_tol, side="left"))
+            highs.append(np.searchsorted(self.keys, key + self.residue_tol, side="right"))
+        lows = np.concatenate(lows)
+        highs = np.concatenate(highs)
+        counts = highs - lows
+        offsets = np.arange(int(counts.sum()), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+        candidate_pos = self.positions[np.repeat(lows, counts) + offsets]
+        return np.repeat(np.tile(base_pos, 3), counts), candidate_pos
@@ -1,4 +1,5 @@
 from __future__ import annotations
+from collections import Counter
 import numpy as np
 from typing import List, Iterator
 from isogroup.base.feature import Feature
@@ -9,8 +10,14 @@ class Cluster:
     A cluster is a group of mass features originating from the same molecule, sharing the same elemental composition but different isotopic compositions.
     Clusters are used to group features related to the same metabolite or chemical compound.
 
+    The isotopologues of the cluster and the properties derived from them (completeness, missing and duplicated
+    isotopologues) are computed once and cached. The cache is cleared when the features or the name of the cluster
+    are replaced, and can be cleared explicitly with invalidate() after modifying the features in place.
     """
 
+    __slots__ = ("_features", "_name", "cluster_id", "tracer_element", "tracer",
+                 "_formula", "_isotopologues", "_completeness")
+
     def __init__(self, features: list, cluster_id :str, name :str=None):
         """ 
         :param features: List of features in the cluster.
@@ -18,12 +25,45 @@ class Cluster:
         :param name: Name of the cluster, usually corresponding to the annotated name of the metabolite or compound.
         
         """
-        self.features = features
+        self._features = features
+        self._name = name
         self.cluster_id = cluster_id
         self.tracer_element = features[0]._tracer_element if features is not None else None
         self.tracer = features[0].tracer if features is not None else None
-        self.name = name
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Clear the cached properties of the cluster.
+        To be called after modifying the features of the cluster (or their annotations) in place.
+        """
         self._formula = None
+        self._isotopologues = None # np.ndarray of the isotopologues of the features annotated with the cluster name
+        self._completeness = None # dict of the properties derived from the isotopologues and the formula
+
+    @property
+    def features(self) -> list:
+        """
+        Returns the features of the cluster.
+        """
+        return self._features
+
+    @features.setter
+    def features(self, value:list):
+        self._features = value
+        self.invalidate()
+
+    @property
+    def name(self) -> str:
+        """
+        Returns the name of the cluster.
+        """
+        return self._name
+
+    @name.setter
+    def name(self, value:str):
+        self._name = value
+        self.invalidate()
 
     def __repr__(self) -> str:
         return f"Cluster({self.cluster_id}, {self.features})"
@@ -119,13 +159,10 @@ class Cluster:
         Returns the list of isotopologues in the cluster.
         Based on the metabolite name matching to the cluster name.
         """
-        isotopologues = []
-        for feature in self.features:
-            if self.name in feature.metabolite:
-                isotopologues.append(feature.cluster_isotopologue[self.name])
-                # idx = feature.metabolite.index(self.name)
-                # isotopologues.append(feature.isotopologue[idx])
-        return isotopologues
+        if self._isotopologues is None:
+            self._isotopologues = np.array([feature.cluster_isotopologue[self.name] for feature in self.features 
+                                            if self.name in feature.metabolite], dtype=np.int64)
+        return self._isotopologues.tolist()
 
 
     @property
@@ -155,6 +192,26 @@ class Cluster:
         Based on the number of tracer element in its formula.
         """
         return list(range(self.element_number + 1))
+
+    def _get_completeness(self) -> dict:
+        """
+        Compute, in a single pass over the isotopologues, the completeness and duplication information of the cluster.
+        """
+        if self._completeness is None:
+            isotopologues = self.isotopologues
+            nb_expected = self.element_number + 1
+            counts = Counter(isotopologues)
+            unique = set(isotopologues)
+            is_incomplete = len(self) < nb_expected or len(unique) != nb_expected
+            is_duplicated = len(unique) != len(isotopologues)
+            self._completeness = {
+                "is_complete": len(self) == nb_expected and isotopologues == list(range(nb_expected)),
+                "is_incomplete": is_incomplete,
+                "is_duplicated": is_duplicated,
+                "missing": [i for i in range(nb_expected) if i not in counts] if is_incomplete else None,
+                "duplicated": [i for i in unique if counts[i] > 1] if is_duplicated else None,
+            }
+        return self._completeness
                            
 
     @property
@@ -162,21 +219,21 @@ class Cluster:
         """
         Returns True if the cluster is complete (i.e contains all isotopologues expected).
         """   
-        return len(self) == self.element_number + 1 and self.expected_isotopologues_in_cluster == self.isotopologues
+        return self._get_completeness()["is_complete"]
     
     @property
     def is_incomplete(self) -> bool:
         """
         Returns True if the cluster is incomplete (i.e contains less isotopologues than expected).
         """
-        return len(self) < self.element_number + 1 or len(set(self.isotopologues)) != len(self.expected_isotopologues_in_cluster)
+        return self._get_completeness()["is_incomplete"]
 
     @property
     def is_duplicated(self) -> bool:
         """
         Returns True if the cluster contains duplicated isotopologues.
         """
-        return len(set(self.isotopologues)) != len(self.isotopologues)
+        return self._get_completeness()["is_duplicated"]
 
     @property
     def is_corrupted(self) -> bool:
@@ -215,8 +272,8 @@ class Cluster:
         Returns a list of missing isotopologues in the annotated cluster.
         Based on the expected isotopologues in the cluster.
         """
-        if self.is_incomplete:
-            return [i for i in self.expected_isotopologues_in_cluster if i not in self.isotopologues]
+        missing = self._get_completeness()["missing"]
+        return list(missing) if missing is not None else None
         
 
     @property
@@ -224,8 +281,8 @@ class Cluster:
         """
         Returns a list of duplicated isotopologues in the cluster.
         """
-        if self.is_duplicated:
-            return [i for i in set(self.isotopologues) if self.isotopologues.count(i) > 1]
+        duplicated = self._get_completeness()["duplicated"]
+        return list(duplicated) if duplicated is not None else None
         
     
     @property
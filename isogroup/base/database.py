@@ -1,34 +1,72 @@
 from __future__ import annotations
 from isogroup.base.feature import Feature
+from isogroup.base.mass_engine import MassEngine
+from isogroup.base.parallel import ParallelExecutor
 from isocor.base import LabelledChemical
 # from isogroup.base.misc import Misc
+from pathlib import Path
+import hashlib
+import logging
+import os
+import tempfile
+import numpy as np
 import pandas as pd
 
+logger = logging.getLogger(f"IsoGroup")
+
 
 class Database:
     """
     Represents a database of theoretical features for a specific tracer.
 
+    The theoretical features are compiled into a columnar table (m/z, RT, metabolite, isotopologue, formula, charge),
+    which can be stored in an on-disk cache to skip the compilation in later runs.
+    The m/z are computed in bulk by a MassEngine, with isocor as fallback for the compounds it does not handle.
+    LabelledChemical objects and theoretical Feature objects are only created when they are needed.
     """
 
-    def __init__(self, dataset: pd.DataFrame, tracer: str, tracer_element: str):
+    # Bump when the layout or the content of the compiled table changes, to invalidate existing cache files
+    CACHE_VERSION = 1
+    COMPILED_COLUMNS = ("mz", "rt", "metabolite", "isotopologue", "formula", "charge", "compound")
+
+    def __init__(self, dataset: pd.DataFrame, tracer: str, tracer_element: str, cache_dir: str|Path = None, engine: str = "native",
+                 source: str|Path = None):
         """
         :param dataset: DataFrame containing theoretical features with columns retention time (RT), metabolite names, and formulas.
         :param tracer: Tracer code (e.g. "13C") used to initialize the database.
         :param tracer_element:  Tracer element (e.g. "C") used.
+        :param cache_dir: Directory of the compiled database cache. If None, the database is compiled at each run.
+        :param engine: Engine used to compute the m/z of the theoretical features: "native" (bulk computation with
+            MassEngine, default) or "isocor" (one LabelledChemical per compound).
+        :param source: Path of the file the dataset was read from, unmodified. If given, the cache key is computed from the
+            path, size and modification time of the file instead of the content of the dataset.
         """
+        if engine not in ("native", "isocor"):
+            raise ValueError(f"Unknown mass engine '{engine}'. Possible values are 'native' and 'isocor'.")
         self.dataset = dataset
-        self.theoretical_features = []
         self.tracer = tracer
         self._tracer_element = tracer_element
         # self._tracer_element, self._tracer_idx = Misc._parse_strtracer(tracer)
         self.clusters = []
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.source = Path(source) if source is not None else None
+
+        self.engine = engine
+        self.mass_engine = MassEngine()
 
         _isodata: dict = LabelledChemical.DEFAULT_ISODATA
+        self._isodata = _isodata
         self._delta_mz_tracer: float = _isodata[self._tracer_element]["mass"][1] - _isodata[
             self._tracer_element]["mass"][0]
         self._delta_mz_hydrogen: float = _isodata["H"]["mass"][0]
 
+        self.compiled: dict = None # {column: np.ndarray}, one entry per theoretical feature
+        self._chemicals = {} # {compound (row of dataset): LabelledChemical}
+        self._theoretical_features = None
+        self._mz_order = None # positions of the theoretical features sorted by m/z
+        self._sorted_mz = None
+        self.parallel_block_size = 10000 # minimal number of experimental features matched by a process
+
         self.initialize_theoretical_features()
         self.theoretical_database_df = None
         self.theoretical_database()
@@ -37,13 +75,140 @@ class Database:
     def __len__(self) -> int:
         return len(self.dataset)
 
+    @property
+    def cache_key(self) -> str:
+        """
+        Returns the key of the compiled database in the cache.
+        It is a hash of the database (path, size and modification time of the source file if known, hashes of the rows
+        of the dataset otherwise), the tracer, the mass engine and the isotopic data used to compute the masses.
+        """
+        content = hashlib.sha256()
+        content.update(f"{self.CACHE_VERSION}|{self.tracer}|{self._tracer_element}|{self.engine}|".encode())
+        content.update(repr(LabelledChemical.DEFAULT_ISODATA).encode())
+        if self.source is not None:
+            stat = self.source.stat()
+            content.update(f"{self.source.resolve()}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+        else:
+            content.update(repr([(str(column), str(dtype)) for column, dtype in self.dataset.dtypes.items()]).encode())
+            content.update(pd.util.hash_pandas_object(self.dataset, index=False).to_numpy().tobytes())
+        return content.hexdigest()
+
+    @property
+    def cache_path(self) -> Path | None:
+        """
+        Returns the path of the compiled database in the cache, or None if no cache directory is set.
+        """
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / f"theoretical_db_{self.cache_key}.npz"
+
     def initialize_theoretical_features(self):
         """
-        Creates chemical labelled objects from the dataset and initializes theoretical features.
-        For each chemical, it generates features with isotopologues based on the tracer.
+        Compile the theoretical features of the database, or load them from the cache if available.
+        For each chemical, one theoretical feature is generated per isotopologue, based on the tracer.
+        """
+        cache_path = self.cache_path
+        if cache_path is not None and cache_path.exists():
+            with np.load(cache_path, allow_pickle=False) as cached:
+                self.compiled = {column: cached[column] for column in self.COMPILED_COLUMNS}
+            logger.debug(f"Compiled database loaded from {cache_path}")
+            return
+
+        self.compile()
+        if cache_path is not None:
+            self.save_compiled(cache_path)
+            logger.debug(f"Compiled database saved to {cache_path}")
+
+    def compile(self):
         """
-        for _, line in self.dataset.iterrows():
-            chemical = LabelledChemical(
+        Compute the m/z of all the isotopologues of the compounds of the dataset.
+        With the native engine, formulas are parsed and masses computed in bulk by the MassEngine. Compounds it does not
+        handle (unparsable formula, unknown element, null charge...) fall back to isocor, as do all compounds with the
+        isocor engine. Missing or non-integer charges are rejected with both engines.
+        """
+        dataset = self.dataset
+        nb_compounds = len(dataset)
+        charges = pd.to_numeric(dataset["charge"], errors="coerce").to_numpy(dtype=np.float64)
+        invalid = ~(charges == np.round(charges))
+        if invalid.any():
+            raise ValueError(f"Charges must be integers, got {dataset['charge'][invalid].tolist()} "
+                             f"for {dataset['metabolite'][invalid].tolist()}.")
+
+        native = np.zeros(nb_compounds, dtype=bool)
+        # isocor only supports tracer elements with two isotopes here (tracer purity [1.0, 0.0])
+        if self.engine == "native" and len(self._isodata[self._tracer_element]["mass"]) == 2:
+            counts, native = self.mass_engine.parse_formulas(dataset["formula"])
+            native &= charges != 0
+            native &= counts[:, self.mass_engine.element_index[self._tracer_element]] > 0
+
+        compounds, isotopologues, mzs = [], [], []
+        if native.any():
+            native_pos = np.flatnonzero(native)
+            formula_pos, native_isotopologues, native_mzs = self.mass_engine.isotopologues_mz(
+                counts[native_pos], charges[native_pos].astype(np.int64), self._tracer_element)
+            compounds.append(native_pos[formula_pos])
+            isotopologues.append(native_isotopologues)
+            mzs.append(native_mzs)
+
+        for compound in np.flatnonzero(~native).tolist():
+            chemical = self.get_chemical(compound)
+            charge = int(charges[compound])
+            compound_isotopologues = range(chemical.formula[self._tracer_element] + 1)
+            compounds.append(np.full(len(compound_isotopologues), compound, dtype=np.int64))
+            isotopologues.append(np.array(compound_isotopologues, dtype=np.int64))
+            mzs.append(np.array([float(chemical.molecular_weight + isotopologue * self._delta_mz_tracer
+                                       + charge * self._delta_mz_hydrogen)
+                                 for isotopologue in compound_isotopologues], dtype=np.float64))
+
+        if compounds:
+            compound, isotopologue, mz = np.concatenate(compounds), np.concatenate(isotopologues), np.concatenate(mzs)
+        else:
+            compound, isotopologue, mz = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+        order = np.lexsort((isotopologue, compound))
+        compound, isotopologue, mz = compound[order], isotopologue[order], mz[order]
+
+        self.compiled = {
+            "mz": mz,
+            "rt": dataset["rt"].to_numpy(dtype=np.float64)[compound],
+            "metabolite": np.array(dataset["metabolite"].astype(str).tolist(), dtype=str)[compound],
+            "isotopologue": isotopologue,
+            "formula": np.array(dataset["formula"].astype(str).tolist(), dtype=str)[compound],
+            "charge": charges.astype(np.int64)[compound],
+            "compound": compound,
+        }
+
+    def save_compiled(self, path: Path):
+        """
+        Store the compiled table in a binary columnar file (NumPy .npz).
+        The file is written under a temporary name and then renamed, so that concurrent runs never read a partial file.
+        It is given the default permissions of new files (umask), so that a shared cache can be read by other users.
+
+        :param path: Path of the file.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **self.compiled)
+            # mkstemp creates the file readable by its owner only
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def get_chemical(self, compound: int) -> LabelledChemical:
+        """
+        Returns the LabelledChemical of a compound of the database, created on first access.
+
+        :param compound: Row of the compound in the database dataset.
+        """
+        chemical = self._chemicals.get(compound)
+        if chemical is None:
+            line = self.dataset.iloc[compound]
+            chemical = self._chemicals[compound] = LabelledChemical(
                 formula=line["formula"],
                 tracer=self.tracer,
                 derivative_formula="",
@@ -53,11 +218,22 @@ class Database:
                 charge=line["charge"],
                 label=line["metabolite"],
             )
-            for isotopologue in range(chemical.formula[self._tracer_element] + 1):
-                mz = (chemical.molecular_weight + isotopologue * self._delta_mz_tracer
-                      + line["charge"] * self._delta_mz_hydrogen)
-                feature = Feature(
-                    rt=line["rt"],
+        return chemical
+
+    @property
+    def theoretical_features(self) -> list:
+        """
+        Returns the theoretical features as Feature objects, built from the compiled table on first access.
+        """
+        if self._theoretical_features is None:
+            compiled = self.compiled
+            self._theoretical_features = []
+            for mz, rt, metabolite, isotopologue, formula, compound in zip(
+                    compiled["mz"].tolist(), compiled["rt"].tolist(), compiled["metabolite"].tolist(),
+                    compiled["isotopologue"].tolist(), compiled["formula"].tolist(), compiled["compound"].tolist()):
+                chemical = self.get_chemical(compound)
+                self._theoretical_features.append(Feature(
+                    rt=rt,
                     mz=mz,
                     tracer=self.tracer,
                     intensity=None,
@@ -65,32 +241,58 @@ class Database:
                     # isotopologue=[isotopologue],
                     cluster_isotopologue={chemical.label: isotopologue},
                     metabolite=[chemical.label],
-                    formula = line["formula"],
-                )
-                self.theoretical_features.append(feature)
+                    formula=formula,
+                ))
+        return self._theoretical_features
+
+    def build_index(self):
+        """
+        Index the theoretical features by m/z, for the window search of match().
+        """
+        self._mz_order = np.argsort(self.compiled["mz"], kind="stable")
+        self._sorted_mz = self.compiled["mz"][self._mz_order]
+
+    def match(self, mzs:np.ndarray, rts:np.ndarray, ppm_tol:float, rt_tol:float, n_jobs:int=1) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Find the theoretical features matching experimental features within the m/z and retention time tolerances.
+        For each experimental feature, only the theoretical features of its ppm window in the m/z-sorted index are tested.
+        Matches are returned sorted by experimental feature, then by position in theoretical_features.
+
+        :param mzs: m/z of the experimental features.
+        :param rts: Retention times of the experimental features.
+        :param ppm_tol: m/z tolerance (in ppm).
+        :param rt_tol: Retention time tolerance.
+        :param n_jobs: Number of processes. Experimental features are split into contiguous blocks matched in parallel.
+        :return: positions of the experimental features, positions of the matching theoretical features,
+            m/z errors (ppm) and retention time errors.
+        """
+        if self._mz_order is None:
+            self.build_index()
+        arrays = {"mzs": np.asarray(mzs, dtype=np.float64),
+                  "rts": np.asarray(rts, dtype=np.float64),
+                  "sorted_mz": self._sorted_mz,
+                  "mz_order": self._mz_order,
+                  "theoretical_rt": np.asarray(self.compiled["rt"], dtype=np.float64)}
 
+        executor = ParallelExecutor(n_jobs, self.parallel_block_size)
+        tasks = [(start, stop, ppm_tol, rt_tol) for start, stop in executor.blocks(len(arrays["mzs"]))]
+        results = executor.map(_match_block, tasks, arrays)
+        if len(results) == 1:
+            return results[0]
+        # Blocks are contiguous and sorted by experimental feature: concatenating them keeps the order
+        return tuple(np.concatenate(columns) for columns in zip(*results))
 
     def theoretical_database(self):
         """
         Summarize theoretical features into a DataFrame and export it to a tsv file.
         """
-        feature_data = {
-            "mz": [],
-            "rt": [],
-            "metabolite": [],
-            "isotopologue": [],
-            "formula": []
-        }
-        for feature in self.theoretical_features:
-            feature_data["mz"].append(feature.mz)
-            feature_data["rt"].append(feature.rt)
-            feature_data["metabolite"].append(', '.join(feature.metabolite))
-            # feature_data["isotopologue"].append(', '.join(map(str, feature.isotopologue)))
-            for metabolite in feature.metabolite:
-                feature_data["isotopologue"].append(feature.cluster_isotopologue[metabolite])
-            feature_data["formula"].append(feature.formula)
-        
-        self.theoretical_database_df = pd.DataFrame(feature_data)
+        self.theoretical_database_df = pd.DataFrame({
+            "mz": self.compiled["mz"],
+            "rt": self.compiled["rt"],
+            "metabolite": self.compiled["metabolite"].astype(object),
+            "isotopologue": self.compiled["isotopologue"],
+            "formula": self.compiled["formula"].astype(object),
+        })
 
     # def export_database(self, filename = None):
     #     """
@@ -129,4 +331,37 @@ class Database:
 #         print(feature.metabolite)
 #         print(feature.cluster_isotopologue)
         
-    
\ No newline at end of file
+    
+
+
+def _match_block(arrays:dict, start:int, stop:int, ppm_tol:float, rt_tol:float) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Match a block of experimental features against the m/z-sorted theoretical features (task of Database.match).
+
+    :param arrays: Shared arrays: experimental "mzs" and "rts", theoretical "sorted_mz", "mz_order" and "theoretical_rt".
+    :param start: Position of the first experimental feature of the block.
+    :param stop: Position after the last experimental feature of the block.
+    :param ppm_tol: m/z tolerance (in ppm).
+    :param rt_tol: Retention time tolerance.
+    """
+    mzs, rts = arrays["mzs"][start:stop], arrays["rts"][start:stop]
+    sorted_mz, mz_order = arrays["sorted_mz"], arrays["mz_order"]
+
+    # Slightly widened window, the exact tolerance is checked below
+    half_width = np.abs(mzs) * ppm_tol * 1e-6 * (1 + 1e-6)
+    left_bounds = np.searchsorted(sorted_mz, mzs - half_width, side="left")
+    right_bounds = np.searchsorted(sorted_mz, mzs + half_width, side="right")
+
+    counts = right_bounds - left_bounds
+    rows = np.repeat(np.arange(len(mzs), dtype=np.int64), counts)
+    offsets = np.arange(int(counts.sum()), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+    sorted_positions = np.repeat(left_bounds, counts) + offsets
+    positions = mz_order[sorted_positions]
+
+    mz_errors = (sorted_mz[sorted_positions] - mzs[rows]) / mzs[rows] * 1e6
+    rt_errors = arrays["theoretical_rt"][positions] - rts[rows]
+    keep = (np.abs(mz_errors) <= ppm_tol) & (np.abs(rt_errors) <= rt_tol)
+    rows, positions, mz_errors, rt_errors = rows[keep], positions[keep], mz_errors[keep], rt_errors[keep]
+
+    order = np.lexsort((positions, rows))
+    return rows[order] + start, positions[order], mz_errors[order], rt_errors[order]
@@ -1,5 +1,8 @@
-from isogroup.base.feature import Feature
+from isogroup.base.feature_table import FeatureTable, FeaturesBySample
+from isogroup.base.metrics import PipelineMetrics
 from isogroup.base.misc import Misc
+from isogroup.base.trace import DecisionTrace
+import numpy as np
 import pandas as pd
 import logging
 
@@ -10,14 +13,19 @@ class Experiment:
     Represents a mass spectrometry experiment with experimental features.
         
     """
-    def __init__(self, dataset : pd.DataFrame, tracer:str, ppm_tol:float, rt_tol:float, max_atoms:int=None, database:pd.DataFrame=None): 
+    def __init__(self, dataset : pd.DataFrame | FeatureTable, tracer:str, ppm_tol:float, rt_tol:float, max_atoms:int=None, database:pd.DataFrame=None, metrics:PipelineMetrics=None, trace:DecisionTrace=None): 
         """
-        :param dataset: DataFrame containing experimental data with columns for m/z, retention time (RT), feature ID, and sample intensities.
+        :param dataset: DataFrame containing experimental data with columns for m/z, retention time (RT), feature ID, and sample intensities,
+                        or FeatureTable already loaded (e.g. by IoHandler.read_feature_table).
         :param tracer: Tracer code used in the experiment (e.g. "13C").
         :param ppm_tol: m/z tolerance (in ppm).
         :param rt_tol: Retention time tolerance (in sec).
         :param max_atoms: Maximum number of tracer atoms to consider for isotopologues. If None, IsoGroup automatically estimates the maximum number of isotopologues based on the feature m/z and tracer element. 
         :param database: DataFrame containing theoretical features with columns retention time (RT), metabolite names, and formulas.
+        :param metrics: Metrics in which the stages of the pipeline are recorded (e.g. to add them to the stages measured before
+                        the experiment is created). If None, new metrics are created.
+        :param trace: Trace in which the per-item decisions of the pipeline are recorded (features annotated, clusters formed,
+                      removed...). If None, the decisions are not traced.
         """
         self.dataset = dataset 
         self._tracer = tracer
@@ -26,8 +34,33 @@ class Experiment:
         self._rt_tol = rt_tol
         self.max_atoms = max_atoms
         self.database = database
-        self.features = {} # {sample_name: {feature_id: Feature object}}
+        self.table: FeatureTable = None # Columnar store of the experimental features
         self.clusters = {} # {sample_name: {cluster_id: Cluster object}}
+        self.metrics = PipelineMetrics() if metrics is None else metrics # Time, memory and item counts of each stage of the pipeline
+        self.trace = DecisionTrace() if trace is None else trace # Per-item decisions, only recorded if tracing is enabled
+
+    @property
+    def features(self) -> FeaturesBySample | dict:
+        """
+        Returns the experimental features organized by sample, as a read-only mapping
+        {sample_name: {feature_id: Feature object}} over the feature table.
+        Feature objects are created on access.
+        """
+        if self.table is None:
+            return {}
+        return self.table.as_dict()
+
+    @features.setter
+    def features(self, value: dict):
+        """
+        Sets the experimental features from Feature objects organized by sample ({sample_name: {feature_id: Feature object}}).
+        """
+        if isinstance(value, FeaturesBySample):
+            self.table = value.table
+        elif value:
+            self.table = FeatureTable.from_features(value)
+        else:
+            self.table = None
         
     @property
     def rt_tol(self) -> float:
@@ -89,42 +122,59 @@ class Experiment:
 
     def initialize_experimental_features(self):
         """
-        Initialize Feature objects from the dataset and organize them by sample.
-        Each feature is created with its retention time, m/z, tracer, intensity, and sample name.
-        """
-        if not {"mz", "rt", "id"}.issubset(self.dataset.columns):
-            raise ValueError("Dataset must contain 'mz', 'rt', and 'id' columns.")
+        Initialize the feature table from the dataset.
+        The m/z, retention time and id of each feature are stored once, and the intensities of all samples in a single matrix.
+        Feature objects are then created on demand through `features`.
+        If the dataset is already a FeatureTable, its arrays are shared (no copy) by a table with no annotation,
+        so that the table of the caller is left unchanged and can be used by several experiments.
+        """
+        if isinstance(self.dataset, FeatureTable):
+            self.table = self.dataset.without_annotations()
+            self.table.tracer = self.tracer
+            self.table.tracer_element = self.tracer_element
+        else:
+            self.table = FeatureTable.from_dataframe(self.dataset, 
+                                                     tracer=self.tracer, 
+                                                     tracer_element=self.tracer_element)
+        self.metrics.count("features", len(self.table))
+        self.metrics.count("samples", len(self.table.samples))
         
-        if not any(col not in {"mz", "rt", "id"} for col in self.dataset.columns):
-            raise ValueError("Dataset must contain at least one sample column with intensity values.")
+        logger.info(f"{len(self.table)} features loaded per sample ({len(self.table.samples)} sample(s)).\n")
 
-        dataset = self.dataset.set_index(["mz", "rt", "id"])
-        
-        for idx, _ in dataset.iterrows():
-            mz = idx[0]
-            rt = idx[1]
-            id = idx[2]
-            
-            for sample in dataset.columns:
-                # Extract the intensity for each sample in the dataset
-                intensity = dataset.loc[idx, sample]
+    @staticmethod
+    def _object_column(values) -> np.ndarray:
+        """
+        Returns a 1-D object array holding the given values as they are (e.g. the lists of a list-valued column).
+        Their text representation is only written when the dataframe is exported.
 
-                # Initialize the experimental features for each sample
-                feature = Feature(
-                    rt=rt, mz=mz, tracer=self.tracer,
-                    feature_id=id, 
-                    intensity=intensity,
-                    sample=sample,
-                    tracer_element=self.tracer_element,
-                    )
-                
-                # Add the feature in the list corresponding to the sample
-                if sample not in self.features:
-                    self.features[sample] = {}
-                self.features[sample][id] = feature
-        
-        features_count = len(next(iter(self.features.values())))
-        logger.info(f"{features_count} features loaded per sample ({len(self.features)} sample(s)).\n")
+        :param values: Values of the column.
+        """
+        column = np.empty(len(values), dtype=object)
+        for position, value in enumerate(values):
+            column[position] = value
+        return column
+
+    @staticmethod
+    def _take_categorical(values, positions) -> pd.Categorical:
+        """
+        Returns a categorical column made of the given values taken at the given positions
+        (e.g. one value per cluster, taken for each feature of the cluster).
+
+        :param values: Distinct entries of the column (e.g. one per cluster).
+        :param positions: Position in values of each row of the column.
+        """
+        block = pd.Categorical(values)
+        return pd.Categorical.from_codes(block.codes[np.asarray(positions, dtype=np.int64)], dtype=block.dtype)
+
+    @staticmethod
+    def _sample_column(samples:list, block_size:int) -> pd.Categorical:
+        """
+        Returns the categorical sample column of a dataframe made of one block of block_size rows per sample.
+
+        :param samples: Sample names, in the order of the blocks.
+        :param block_size: Number of rows of each block.
+        """
+        return pd.Categorical.from_codes(np.repeat(np.arange(len(samples)), block_size), categories=samples)
 
 # if __name__ == "__main__":
 #     # from isogroup.base.io import IoHandler
@@ -1,13 +1,53 @@
 from __future__ import annotations
 from isogroup.base.misc import Misc
 
+class FeatureAnnotation:
+    """
+    Annotation state of a feature: chemicals, metabolites, errors and cluster memberships.
+    It is only created when the feature is annotated (or when one of these attributes is accessed).
+    """
+
+    __slots__ = ("chemical", "formula", "metabolite", "mz_error", "rt_error",
+                 "cluster_isotopologue", "in_cluster", "also_in", "is_adduct")
+
+    def __init__(self):
+        self.chemical = []
+        self.formula = []
+        self.metabolite = []
+        self.mz_error = []
+        self.rt_error = []
+        self.cluster_isotopologue = {} # {cluster_name: isotopologue_number}
+        self.in_cluster = []
+        self.also_in = {}
+        self.is_adduct: tuple[bool, str] = (False, "")
+
+
+def _annotation_property(name:str, doc:str) -> property:
+    """
+    Returns a property reading and writing an attribute of the annotation of a feature.
+
+    :param name: Name of the attribute in FeatureAnnotation.
+    :param doc: Docstring of the property.
+    """
+    def getter(self):
+        return getattr(self._get_annotation(), name)
+
+    def setter(self, value):
+        setattr(self._get_annotation(), name, value)
+
+    return property(getter, setter, doc=doc)
+
+
 class Feature:
     """
     Represents a mass spectrometry feature in the dataset.
     A feature is characterized by its retention time (RT), mass-to-charge ratio (m/z), intensity.
     It can also have associated chemical information, isotopologues, and other metadata.
+    The annotation containers are only created when they are first used, and extra dimensions are stored in a separate dict.
     """
 
+    __slots__ = ("rt", "mz", "tracer", "_tracer_element", "intensity", "feature_id", "sample", "_annotation", "_extra_dims")
+
     def __init__(self, rt:float, mz:float, tracer:str, intensity:float, feature_id:str=None, tracer_element = None, formula:list=None, sample:str=None,
                  chemical:list=None, metabolite:list=None, mz_error:list=None, rt_error: list|None=None, **extra_dims:dict):
         """
@@ -32,21 +72,80 @@ class Feature:
         # self._tracer_element, self._tracer_idx = Misc._parse_strtracer(tracer) 
         self.intensity = intensity
         self.feature_id = feature_id
-        self.chemical = chemical if chemical is not None else []
-        self.counter_formula = [i.formula for i in self.chemical] if self.chemical is not None else formula # Counter formula of the feature
-        self.formula = formula if formula is not None else []
         self.sample = sample
-        self.mz_error = mz_error if mz_error is not None else []
-        self.rt_error = rt_error if rt_error is not None else []
-        self.metabolite = [i.label for i in self.chemical] if self.chemical is not None else metabolite #metabolite ou [] ?
-        # self.isotopologue = isotopologue if isotopologue is not None else [] # Targeted version
-        # self.cluster_isotopologue = isotopologue if isotopologue is not None else {} # Test 10/09 for Untargeted, dict, iso associated to the cluster -> check impact on Targeted version
-        self.cluster_isotopologue = {} # Store the isotopologue number per cluster {cluster_name: isotopologue_number}
-        self.__dict__.update(extra_dims)
-        self.is_adduct: tuple[bool, str] = (False, "")
-        self.in_cluster = []
-        self.also_in = {}
+        self._annotation = None
+        self._extra_dims = None
+
+        if chemical or formula is not None or mz_error is not None or rt_error is not None:
+            annotation = self._get_annotation()
+            annotation.chemical = chemical if chemical is not None else []
+            annotation.formula = formula if formula is not None else []
+            annotation.mz_error = mz_error if mz_error is not None else []
+            annotation.rt_error = rt_error if rt_error is not None else []
+            # Metabolites are the labels of the chemicals
+            annotation.metabolite = [i.label for i in annotation.chemical]
+
+        for name, value in extra_dims.items():
+            # Known attributes given as keyword (e.g. cluster_isotopologue) are set, others are stored as extra dimensions
+            setattr(self, name, value)
+
+    def _get_annotation(self) -> FeatureAnnotation:
+        """
+        Returns the annotation of the feature, created on first access.
+        """
+        if self._annotation is None:
+            self._annotation = FeatureAnnotation()
+        return self._annotation
+
+    def __getattr__(self, name:str):
+        """
+        Returns the extra dimensions, given at initialization or set afterwards.
+        """
+        extra_dims = getattr(self, "_extra_dims", None) if name != "_extra_dims" else None
+        if extra_dims is not None and name in extra_dims:
+            return extra_dims[name]
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def __setattr__(self, name:str, value):
+        """
+        Sets an attribute of the feature. Attributes that are not declared are stored as extra dimensions.
+        """
+        if hasattr(type(self), name):
+            object.__setattr__(self, name, value)
+        else:
+            self._set_extra_dim(name, value)
+
+    def _set_extra_dim(self, name:str, value):
+        """
+        Stores an extra dimension of the feature, creating the dict of extra dimensions on first use.
+        """
+        if getattr(self, "_extra_dims", None) is None:
+            object.__setattr__(self, "_extra_dims", {})
+        self._extra_dims[name] = value
+
+    chemical = _annotation_property("chemical", "List of chemical objects (LabelledChemical) associated with the feature.")
+    formula = _annotation_property("formula", "Formula of the feature.")
+    metabolite = _annotation_property("metabolite", "List of metabolite names associated with the feature.")
+    mz_error = _annotation_property("mz_error", "List of m/z errors for the annotated feature.")
+    rt_error = _annotation_property("rt_error", "List of retention time errors for the annotated feature.")
+    cluster_isotopologue = _annotation_property("cluster_isotopologue", "Isotopologue number of the feature per cluster ({cluster_name: isotopologue_number}).")
+    in_cluster = _annotation_property("in_cluster", "Clusters containing the feature.")
+    also_in = _annotation_property("also_in", "Other clusters containing the feature, per cluster ({cluster_id: [cluster_id]}).")
+    is_adduct = _annotation_property("is_adduct", "Whether the feature is an adduct, and of which feature.")
+
+    @property
+    def counter_formula(self) -> list:
+        """
+        Counter formula of the feature, from its chemicals unless it was set explicitly.
+        """
+        extra_dims = getattr(self, "_extra_dims", None)
+        if extra_dims is not None and "counter_formula" in extra_dims:
+            return extra_dims["counter_formula"]
+        return [i.formula for i in self.chemical]
 
+    @counter_formula.setter
+    def counter_formula(self, value:list):
+        self._set_extra_dim("counter_formula", value)
 
     def __repr__(self) -> str:
         """
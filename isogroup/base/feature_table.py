@@ -0,0 +1,273 @@
+from __future__ import annotations
+from collections.abc import Mapping
+from isogroup.base.feature import Feature, FeatureAnnotation
+import numpy as np
+import pandas as pd
+
+
+class FeatureTable:
+    """
+    Columnar store of the experimental features.
+    The feature ids, m/z and retention times are stored once as NumPy arrays shared by all samples,
+    and the intensities are stored in a single 2-D matrix (features x samples).
+    Feature objects are only created on demand, as views on a (feature, sample) cell of the table.
+    """
+
+    def __init__(self, feature_id, mz, rt, intensities, samples:list, tracer:str=None, tracer_element:str=None):
+        """
+        :param feature_id: Array of feature identifiers.
+        :param mz: Array of feature m/z.
+        :param rt: Array of feature retention times.
+        :param intensities: 2-D array of intensities (features x samples).
+        :param samples: List of sample names, in the column order of the intensity matrix.
+        :param tracer: Tracer code (e.g. "13C").
+        :param tracer_element: Tracer element (e.g. "C").
+        """
+        self.feature_id = np.asarray(feature_id, dtype=object)
+        self.mz = np.asarray(mz, dtype=np.float64)
+        self.rt = np.asarray(rt, dtype=np.float64)
+        self.intensities = np.asarray(intensities)
+        self.samples = list(samples)
+        self.tracer = tracer
+        self.tracer_element = tracer_element
+
+        if self.intensities.shape != (len(self.feature_id), len(self.samples)):
+            raise ValueError(f"Intensity matrix shape {self.intensities.shape} does not match "
+                             f"{len(self.feature_id)} features x {len(self.samples)} samples.")
+
+        self.sample_index = {sample: col for col, sample in enumerate(self.samples)}
+        self._row_index = None
+        self._annotations = {} # {row: FeatureAnnotation}, only for annotated features
+
+    @classmethod
+    def from_dataframe(cls, dataset:pd.DataFrame, tracer:str=None, tracer_element:str=None) -> FeatureTable:
+        """
+        Build the table from a dataset with 'mz', 'rt' and 'id' columns, all other columns being sample intensities.
+
+        :param dataset: DataFrame containing experimental data with columns for m/z, retention time (RT), feature ID and sample intensities.
+        :param tracer: Tracer code (e.g. "13C").
+        :param tracer_element: Tracer element (e.g. "C").
+        """
+        if not {"mz", "rt", "id"}.issubset(dataset.columns):
+            raise ValueError("Dataset must contain 'mz', 'rt', and 'id' columns.")
+
+        samples = [col for col in dataset.columns if col not in {"mz", "rt", "id"}]
+        if not samples:
+            raise ValueError("Dataset must contain at least one sample column with intensity values.")
+
+        return cls(feature_id=dataset["id"].to_numpy(dtype=object),
+                   mz=dataset["mz"].to_numpy(dtype=np.float64),
+                   rt=dataset["rt"].to_numpy(dtype=np.float64),
+                   intensities=dataset[samples].to_numpy(dtype=np.float64),
+                   samples=samples,
+                   tracer=tracer,
+                   tracer_element=tracer_element)
+
+    @classmethod
+    def from_features(cls, features:dict) -> FeatureTable:
+        """
+        Build the table from Feature objects organized by sample ({sample_name: {feature_id: Feature}}).
+        Features are expected to share the same ids, m/z and retention times in every sample.
+        Annotations carried by the Feature objects are not imported.
+
+        :param features: dict of Feature objects by sample.
+        """
+        samples = list(features)
+        first = features[samples[0]]
+        ids = list(first)
+        reference = [first[feature_id] for feature_id in ids]
+        intensities = [[features[sample][feature_id].intensity for sample in samples] for feature_id in ids]
+        return cls(feature_id=ids,
+                   mz=[f.mz for f in reference],
+                   rt=[f.rt for f in reference],
+                   intensities=np.array(intensities, dtype=np.float64).reshape(len(ids), len(samples)),
+                   samples=samples,
+                   tracer=reference[0].tracer if reference else None,
+                   tracer_element=reference[0]._tracer_element if reference else None)
+
+    def __len__(self) -> int:
+        """
+        Returns the number of features in the table.
+        """
+        return len(self.feature_id)
+
+    def __repr__(self) -> str:
+        return f"FeatureTable({len(self)} features x {len(self.samples)} samples)"
+
+    @property
+    def row_index(self) -> dict:
+        """
+        Returns the mapping {feature_id: row} of the table.
+        """
+        if self._row_index is None:
+            self._row_index = {feature_id: row for row, feature_id in enumerate(self.feature_id.tolist())}
+        return self._row_index
+
+    def without_annotations(self) -> FeatureTable:
+        """
+        Returns a table sharing the arrays of this table (no copy), with no annotation.
+        Used to run several annotations of the same features independently.
+        """
+        return FeatureTable(feature_id=self.feature_id,
+                            mz=self.mz,
+                            rt=self.rt,
+                            intensities=self.intensities,
+                            samples=self.samples,
+                            tracer=self.tracer,
+                            tracer_element=self.tracer_element)
+
+    def annotation(self, row:int) -> FeatureAnnotation:
+        """
+        Returns the annotation of a feature, created on first access.
+
+        :param row: Row of the feature in the table.
+        """
+        annotation = self._annotations.get(row)
+        if annotation is None:
+            annotation = self._annotations[row] = FeatureAnnotation()
+        return annotation
+
+    def get_annotation(self, row:int) -> FeatureAnnotation | None:
+        """
+        Returns the annotation of a feature, or None if the feature has never been annotated.
+
+        :param row: Row of the feature in the table.
+        """
+        return self._annotations.get(row)
+
+    def feature(self, row:int, sample:str) -> FeatureView:
+        """
+        Returns a Feature view on a given feature and sample.
+
+        :param row: Row of the feature in the table.
+        :param sample: Name of the sample.
+        """
+        return FeatureView(self, row, self.sample_index[sample])
+
+    def sample_features(self, sample:str, rows=None) -> list:
+        """
+        Returns the Feature views of a sample, for all features or for the given rows only.
+
+        :param sample: Name of the sample.
+        :param rows: Rows of the features to return. If None, all features are returned.
+        """
+        col = self.sample_index[sample]
+        rows = range(len(self)) if rows is None else rows
+        return [FeatureView(self, row, col) for row in rows]
+
+    def as_dict(self) -> FeaturesBySample:
+        """
+        Returns a read-only mapping {sample_name: {feature_id: Feature}} over the table.
+        """
+        return FeaturesBySample(self)
+
+
+class FeatureView(Feature):
+    """
+    Feature of a FeatureTable in a given sample.
+    Its m/z, retention time and intensity are read from the table and its annotations are shared with the other samples.
+    """
+
+    __slots__ = ("_table", "_row", "_col")
+
+    def __init__(self, table:FeatureTable, row:int, col:int):
+        """
+        :param table: FeatureTable containing the feature.
+        :param row: Row of the feature in the table.
+        :param col: Column of the sample in the intensity matrix.
+        """
+        self._table = table
+        self._row = row
+        self._col = col
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, FeatureView):
+            return NotImplemented
+        return self._table is other._table and self._row == other._row and self._col == other._col
+
+    def __hash__(self) -> int:
+        return hash((id(self._table), self._row, self._col))
+
+    @property
+    def row(self) -> int:
+        """
+        Returns the row of the feature in the table.
+        """
+        return self._row
+
+    @property
+    def feature_id(self):
+        return self._table.feature_id[self._row]
+
+    @property
+    def mz(self) -> float:
+        return float(self._table.mz[self._row])
+
+    @property
+    def rt(self) -> float:
+        return float(self._table.rt[self._row])
+
+    @property
+    def intensity(self):
+        return self._table.intensities[self._row, self._col]
+
+    @property
+    def sample(self) -> str:
+        return self._table.samples[self._col]
+
+    @property
+    def tracer(self) -> str:
+        return self._table.tracer
+
+    @property
+    def _tracer_element(self) -> str:
+        return self._table.tracer_element
+
+    def _get_annotation(self) -> FeatureAnnotation:
+        """
+        Returns the annotation of the feature, shared with the other samples.
+        """
+        return self._table.annotation(self._row)
+
+
+class SampleFeatures(Mapping):
+    """
+    Read-only mapping {feature_id: Feature} over one sample of a FeatureTable.
+    Feature views are created on access.
+    """
+
+    def __init__(self, table:FeatureTable, sample:str):
+        self._table = table
+        self._col = table.sample_index[sample]
+
+    def __getitem__(self, feature_id) -> FeatureView:
+        return FeatureView(self._table, self._table.row_index[feature_id], self._col)
+
+    def __iter__(self):
+        return iter(self._table.row_index)
+
+    def __len__(self) -> int:
+        return len(self._table.row_index)
+
+    def __contains__(self, feature_id) -> bool:
+        return feature_id in self._table.row_index
+
+
+class FeaturesBySample(Mapping):
+    """
+    Read-only mapping {sample_name: {feature_id: Feature}} over a FeatureTable.
+    """
+
+    def __init__(self, table:FeatureTable):
+        self.table = table
+
+    def __getitem__(self, sample:str) -> SampleFeatures:
+        if sample not in self.table.sample_index:
+            raise KeyError(sample)
+        return SampleFeatures(self.table, sample)
+
+    def __iter__(self):
+        return iter(self.table.samples)
+
+    def __len__(self) -> int:
+        return len(self.table.samples)
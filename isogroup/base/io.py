@@ -1,19 +1,137 @@
+from isogroup.base.feature_table import FeatureTable
+import ast
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import shutil
+import tempfile
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
+logger = logging.getLogger(f"IsoGroup")
+
 
 class IoHandler:
     """
     Handles input and output operations.
- 
+    Input files are read as text (tab-separated datasets, semicolon-separated databases), Parquet (".parquet") or
+    Arrow IPC (".arrow", ".feather") according to their extension. Results are written in output_format.
     """
 
-    def __init__(self):
+    # Bump when the layout of the dataset cache changes, to invalidate existing cache entries
+    DATASET_CACHE_VERSION = 1
+    # Default directory of the dataset cache, next to the dataset file
+    DATASET_CACHE_DIR = ".isogroup_cache"
+    # Extension of the output files of each format
+    OUTPUT_FORMATS = {"tsv": "tsv", "parquet": "parquet", "arrow": "arrow"}
+    # Columns holding lists, written as their text representation in TSV files and as typed list columns otherwise
+    LIST_COLUMNS = {
+        "features": {"metabolite", "isotopologue", "mz_error", "rt_error", "InClusters", "Isotopologues"},
+        "clusters": {"feature_potential_metabolite", "missing_isotopologue", "duplicated_isotopologue", "in_another_cluster", "AlsoIn"},
+        "summary": {"Isotopologues", "Missing_isotopologues", "Duplicated_isotopologues"},
+    }
+
+    def __init__(self, output_format:str="tsv"):
+        """
+        :param output_format: Format of the result files: "tsv" (default), "parquet" or "arrow" (Arrow IPC).
+                              Parquet and Arrow require the optional dependency pyarrow.
+        """
+        if output_format not in self.OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format '{output_format}'. Options are {', '.join(self.OUTPUT_FORMATS)}.")
+        if output_format != "tsv":
+            self._require_pyarrow()
+        self.output_format = output_format
         self.dataset_path:Path = None
         self.dataset_name:str = None
         self.database_path:Path = None
         self.outputs_path:Path = None
 
+    @staticmethod
+    def _require_pyarrow():
+        """
+        Check that pyarrow, needed for Parquet and Arrow files, is installed.
+        """
+        if importlib.util.find_spec("pyarrow") is None:
+            raise ImportError("Parquet and Arrow files require pyarrow. Install it with 'pip install IsoGroup[arrow]'.")
+
+    @staticmethod
+    def _file_format(path:Path) -> str:
+        """
+        Returns the format of a file from its extension: "parquet", "arrow" or "text".
+
+        :param path: Path of the file.
+        """
+        suffix = path.suffix.lower()
+        if suffix == ".parquet":
+            return "parquet"
+        if suffix in (".arrow", ".feather"):
+            return "arrow"
+        return "text"
+
+    def _read_frame(self, path:Path, sep:str) -> pd.DataFrame:
+        """
+        Read a file into a DataFrame according to its format.
+
+        :param path: Path of the file.
+        :param sep: Column separator of text files.
+        """
+        file_format = self._file_format(path)
+        if file_format == "text":
+            return pd.read_csv(path, sep=sep)
+        self._require_pyarrow()
+        if file_format == "parquet":
+            return pd.read_parquet(path)
+        return pd.read_feather(path)
+
+    def _write_frame(self, dataframe:pd.DataFrame, name:str, kind:str=None):
+        """
+        Write a DataFrame to the output directory, as {dataset_name}.{name}.{extension} in output_format.
+
+        :param dataframe: DataFrame to write.
+        :param name: Name of the output (e.g. "features").
+        :param kind: Kind of output whose list-valued columns are typed (key of LIST_COLUMNS), if any.
+        """
+        path = Path(f"{self.outputs_path}/{self.dataset_name}.{name}.{self.OUTPUT_FORMATS[self.output_format]}")
+        if self.output_format == "tsv":
+            dataframe.to_csv(path, sep="\t", index=False)
+            return
+        if kind is not None:
+            dataframe = self.typed_lists(dataframe, self.LIST_COLUMNS[kind])
+        if self.output_format == "parquet":
+            dataframe.to_parquet(path, index=False)
+        else:
+            dataframe.reset_index(drop=True).to_feather(path)
+
+    @staticmethod
+    def typed_lists(dataframe:pd.DataFrame, columns) -> pd.DataFrame:
+        """
+        Returns a copy of a DataFrame where the list-valued columns hold lists instead of their text representation.
+        Each distinct text is parsed once. Missing values and empty texts are replaced by None.
+
+        :param dataframe: DataFrame to convert.
+        :param columns: Names of the list-valued columns. Columns missing from the DataFrame are ignored.
+        """
+        parsed = {}
+
+        def parse(value):
+            if not isinstance(value, str):
+                if value is None or (np.isscalar(value) and pd.isna(value)):
+                    return None
+                return np.asarray(value).tolist()
+            if value not in parsed:
+                parsed[value] = ast.literal_eval(value) if value else None
+            return parsed[value]
+
+        dataframe = dataframe.copy()
+        for column in columns:
+            if column in dataframe.columns:
+                dataframe[column] = pd.Series([parse(value) for value in dataframe[column].tolist()],
+                                              index=dataframe.index, dtype=object)
+        return dataframe
+
     def read_dataset(self, dataset):
         """
         Reads the dataset from the specified file path and loads it into a pandas DataFrame.
@@ -27,9 +145,195 @@ class IoHandler:
         
         self.dataset_name = self.dataset_path.stem
         
-        return pd.read_csv(self.dataset_path, sep="\t")
+        return self._read_frame(self.dataset_path, sep="\t")
          
         # logging.info(f"Dataset loaded from {inputdata} with shape {data.shape}")    
+
+    def read_feature_table(self, dataset, intensity_dtype="float64", chunksize:int=100000, cache_dir:str|Path=None) -> FeatureTable:
+        """
+        Reads the dataset from the specified file path directly into a FeatureTable, chunk by chunk.
+        Columns are parsed with an explicit schema (ids as strings, m/z and retention times as float64, intensities as
+        intensity_dtype) instead of inferring dtypes on the whole file. The numeric arrays of the table grow geometrically
+        as chunks are parsed, and are trimmed to the number of rows at the end, so that the file is read once. Growing a
+        buffer may copy it into one twice as large while it is still allocated: peak memory stays within about three times
+        the size of the numeric arrays of the final table. Gzip-compressed files (".gz") are read transparently. Parquet files are
+        read batch by batch, and Arrow IPC files are memory-mapped and read slice by slice.
+
+        With a cache directory, the parsed table is stored there as NumPy arrays on first read. Later reads of the same
+        file (same path, size and modification time) memory-map these arrays instead of parsing the file again.
+
+        :param dataset: Path to the dataset file.
+        :param intensity_dtype: dtype of the intensity matrix (e.g. "float32" to halve its memory footprint).
+        :param chunksize: Number of rows parsed at once.
+        :param cache_dir: Directory of the dataset cache. If None, the file is parsed at each read.
+        """
+        self.dataset_path = dataset
+
+        if not self.dataset_path.exists():
+            raise FileNotFoundError(f"File {self.dataset_path} does not exist.")
+
+        # "dataset.txt.gz" is named "dataset", as "dataset.txt"
+        self.dataset_name = Path(self.dataset_path.stem).stem if self.dataset_path.suffix == ".gz" else self.dataset_path.stem
+
+        cache_path = None if cache_dir is None else self.dataset_cache_path(cache_dir, intensity_dtype)
+        if cache_path is not None and cache_path.exists():
+            table = self.load_cached_table(cache_path)
+            logger.debug(f"Dataset loaded from the cache {cache_path}")
+            return table
+
+        table = self._parse_feature_table(intensity_dtype, chunksize)
+        if cache_path is not None:
+            self.save_cached_table(table, cache_path)
+            logger.debug(f"Dataset saved to the cache {cache_path}")
+        return table
+
+    def _parse_feature_table(self, intensity_dtype, chunksize:int) -> FeatureTable:
+        """
+        Parse the dataset file into a FeatureTable (see read_feature_table).
+
+        :param intensity_dtype: dtype of the intensity matrix.
+        :param chunksize: Number of rows parsed at once.
+        """
+        columns = self._dataset_columns()
+        if not {"mz", "rt", "id"}.issubset(columns):
+            raise ValueError("Dataset must contain 'mz', 'rt', and 'id' columns.")
+        samples = [col for col in columns if col not in {"mz", "rt", "id"}]
+        if not samples:
+            raise ValueError("Dataset must contain at least one sample column with intensity values.")
+
+        id_chunks = []
+        mz = np.empty(0, dtype=np.float64)
+        rt = np.empty(0, dtype=np.float64)
+        intensities = np.empty((0, len(samples)), dtype=intensity_dtype)
+        arrays = (mz, rt, intensities) # numeric buffers, only referenced here
+
+        schema = {"id": str, "mz": np.float64, "rt": np.float64} | {sample: intensity_dtype for sample in samples}
+        start = 0
+        for chunk in self._dataset_chunks(schema, chunksize):
+            stop = start + len(chunk)
+            if stop > len(mz):
+                # Buffers grow geometrically in place, so that rows are not counted in a first pass over the file
+                capacity = max(stop, 2 * len(mz))
+                for array in arrays:
+                    array.resize((capacity,) + array.shape[1:], refcheck=False)
+            id_chunks.append(chunk["id"].to_numpy(dtype=object))
+            mz[start:stop] = chunk["mz"].to_numpy()
+            rt[start:stop] = chunk["rt"].to_numpy()
+            intensities[start:stop] = chunk[samples].to_numpy()
+            start = stop
+
+        for array in arrays:
+            array.resize((start,) + array.shape[1:], refcheck=False)
+        feature_id = np.concatenate(id_chunks) if id_chunks else np.empty(0, dtype=object)
+        return FeatureTable(feature_id=feature_id, mz=mz, rt=rt, intensities=intensities, samples=samples)
+
+    def _dataset_columns(self) -> list:
+        """
+        Returns the column names of the dataset file, without reading its rows.
+        """
+        file_format = self._file_format(self.dataset_path)
+        if file_format == "text":
+            return pd.read_csv(self.dataset_path, sep="\t", nrows=0).columns.tolist()
+        self._require_pyarrow()
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if file_format == "parquet":
+            schema = pq.ParquetFile(self.dataset_path).schema_arrow
+        else:
+            with pa.memory_map(str(self.dataset_path)) as source:
+                schema = pa.ipc.open_file(source).schema
+        # Index columns stored by pandas are not dataset columns
+        index_columns = (schema.pandas_metadata or {}).get("index_columns", [])
+        return [name for name in schema.names if name not in index_columns]
+
+    def _dataset_chunks(self, schema:dict, chunksize:int):
+        """
+        Yields the rows of the dataset file as DataFrames of at most chunksize rows, cast to the schema.
+        Text files are parsed chunk by chunk, Parquet files are read batch by batch and Arrow IPC files are memory-mapped
+        and converted one slice of a record batch at a time.
+
+        :param schema: dtype of each column.
+        :param chunksize: Number of rows per chunk.
+        """
+        file_format = self._file_format(self.dataset_path)
+        if file_format == "text":
+            yield from pd.read_csv(self.dataset_path, sep="\t", dtype=schema, chunksize=chunksize)
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if file_format == "parquet":
+            for batch in pq.ParquetFile(self.dataset_path).iter_batches(batch_size=chunksize, columns=list(schema)):
+                yield batch.to_pandas().astype(schema)
+            return
+        with pa.memory_map(str(self.dataset_path)) as source:
+            reader = pa.ipc.open_file(source)
+            for index in range(reader.num_record_batches):
+                batch = reader.get_batch(index).select(list(schema))
+                for offset in range(0, batch.num_rows, chunksize):
+                    yield batch.slice(offset, chunksize).to_pandas().astype(schema)
+
+    def dataset_cache_path(self, cache_dir:str|Path, intensity_dtype="float64") -> Path:
+        """
+        Returns the directory of the cache entry of the dataset file.
+        Its key is a hash of the resolved path, size and modification time of the file, and of the intensity dtype:
+        the entry is invalidated as soon as the file is modified.
+
+        :param cache_dir: Directory of the dataset cache.
+        :param intensity_dtype: dtype of the intensity matrix.
+        """
+        stat = self.dataset_path.stat()
+        content = hashlib.sha256()
+        content.update(f"{self.DATASET_CACHE_VERSION}|{self.dataset_path.resolve()}|{stat.st_size}|{stat.st_mtime_ns}|"
+                       f"{np.dtype(intensity_dtype).str}".encode())
+        return Path(cache_dir) / f"{self.dataset_name}_{content.hexdigest()[:16]}"
+
+    @staticmethod
+    def save_cached_table(table:FeatureTable, path:Path):
+        """
+        Store a FeatureTable as a cache entry: one .npy file per array and an index file (index.json) with the sample names.
+        The entry is written in a temporary directory and then renamed, so that concurrent runs never read a partial entry.
+        It is given the default permissions of new directories (umask), so that a shared cache can be read by other users.
+
+        :param table: FeatureTable to store.
+        :param path: Directory of the cache entry.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(tempfile.mkdtemp(dir=path.parent, suffix=".tmp"))
+        try:
+            np.save(tmp_path / "feature_id.npy", table.feature_id.astype(str))
+            np.save(tmp_path / "mz.npy", table.mz)
+            np.save(tmp_path / "rt.npy", table.rt)
+            np.save(tmp_path / "intensities.npy", table.intensities)
+            with open(tmp_path / "index.json", "w") as f:
+                json.dump({"version": IoHandler.DATASET_CACHE_VERSION, "nb_features": len(table), "samples": table.samples}, f)
+            # mkdtemp creates the directory accessible by its owner only
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o777 & ~umask)
+            os.replace(tmp_path, path)
+        except OSError:
+            # Another run stored the same entry in the meantime
+            if not path.exists():
+                raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    @staticmethod
+    def load_cached_table(path:Path) -> FeatureTable:
+        """
+        Load a FeatureTable from a cache entry.
+        The m/z, retention times and intensities are memory-mapped read-only: they are not copied in memory, and their pages
+        are shared through the OS page cache by all the runs reading the same entry.
+
+        :param path: Directory of the cache entry.
+        """
+        with open(path / "index.json") as f:
+            index = json.load(f)
+        return FeatureTable(feature_id=np.load(path / "feature_id.npy").astype(object),
+                            mz=np.load(path / "mz.npy", mmap_mode="r"),
+                            rt=np.load(path / "rt.npy", mmap_mode="r"),
+                            intensities=np.load(path / "intensities.npy", mmap_mode="r"),
+                            samples=index["samples"])
     
     def read_database(self, database):
         """
@@ -42,7 +346,7 @@ class IoHandler:
         if not self.database_path.exists():
             raise FileNotFoundError(f"File {self.database_path} does not exist.")
         
-        return pd.read_csv(self.database_path, sep=";")
+        return self._read_frame(self.database_path, sep=";")
     
     def create_output_directory(self, outputs_path):
         """
@@ -80,9 +384,7 @@ class IoHandler:
         #         feature_data["isotopologue"].append(feature.cluster_isotopologue[metabolite])
         #     feature_data["formula"].append(feature.formula)
        
-        database.to_csv(Path(f"{self.outputs_path}/{self.dataset_name}.theoretical_db.tsv"), 
-                                          sep="\t", 
-                                          index=False)
+        self._write_frame(database, "theoretical_db")
 
     def clusters_summary(self, clusters_to_summarize:dict):
         """
@@ -91,31 +393,28 @@ class IoHandler:
         :param clusters_to_summarize: dict containing clusters to summarize
         :return: pd.DataFrame with the summary of the clusters
         """
-        # List to store the cluster summary data
-        cluster_summary = []
-        cluster_id_unique = set() # To store unique cluster_id
+        # Summary of each unique cluster, computed once, and number of samples in which each cluster is present
+        cluster_summary = {} # {cluster_id: summary}
+        sample_count = {} # {cluster_id: number of samples}
 
         for _, clusters in clusters_to_summarize.items():
+            # Count each cluster once per sample
+            for cluster_id in {cluster.cluster_id for cluster in clusters.values()}:
+                sample_count[cluster_id] = sample_count.get(cluster_id, 0) + 1
             for cluster in clusters.values():
+                if cluster.cluster_id not in cluster_summary:
+                    cluster_summary[cluster.cluster_id] = cluster.summary
 
-                # Check if the cluster_id is unique
-                if cluster.cluster_id not in cluster_id_unique:
-                    cluster_id_unique.add(cluster.cluster_id)
-
-                    summary = cluster.summary
-
-                    # Retrieve the samples in which the cluster is present
-                    samples_in_cluster = {sample for sample, clusters in clusters_to_summarize.items() if cluster.cluster_id in [c.summary["ClusterID"] for c in clusters.values()]}
-                    summary["number_of_samples"] = len(samples_in_cluster)
-
-                    cluster_summary.append(summary)
+        for cluster_id, summary in cluster_summary.items():
+            summary["number_of_samples"] = sample_count[cluster_id]
+        cluster_summary = list(cluster_summary.values())
 
         # Create a DataFrame with the collected information
         df = pd.DataFrame(cluster_summary)
 
         # Export the DataFrame to a tsv file if a filename is provided
         # if filename:
-        df.to_csv(f"{self.outputs_path}/{self.dataset_name}.summary.tsv", sep="\t", index=False)
+        self._write_frame(df, "summary", kind="summary")
 
         # return df
 
@@ -126,7 +425,15 @@ class IoHandler:
         :param features_to_export: dict containing features to export
         
         """
-        dataframe_to_export.to_csv(f"{self.outputs_path}/{self.dataset_name}.features.tsv", sep="\t", index=False)
+        self._write_frame(dataframe_to_export, "features", kind="features")
+
+    def export_sweep(self, dataframe_to_export:pd.DataFrame):
+        """
+        Export the metrics of a parameter sweep (one row per setting).
+
+        :param dataframe_to_export: DataFrame of metrics returned by ParameterSweep.run
+        """
+        self._write_frame(dataframe_to_export, "sweep")
 
     def export_clusters(self, dataframe_to_export:pd.DataFrame):
         """
@@ -134,7 +441,7 @@ class IoHandler:
 
         :param cluster_to_export: dict containing clusters to export
         """
-        dataframe_to_export.to_csv(f"{self.outputs_path}/{self.dataset_name}.clusters.tsv", sep="\t", index=False)
+        self._write_frame(dataframe_to_export, "clusters", kind="clusters")
         # return pd.DataFrame.from_records(records)
 
     # def targ_export_features(self, features_to_export:dict, sample_name:str = None):
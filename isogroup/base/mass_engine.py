@@ -0,0 +1,99 @@
+from __future__ import annotations
+from decimal import Decimal
+from isocor.base import LabelledChemical
+import numpy as np
+import pandas as pd
+
+
+class MassEngine:
+    """
+    Bulk computation of the monoisotopic masses and isotopologue m/z of elemental formulas.
+
+    Masses are taken from the isotopic data of isocor (LabelledChemical.DEFAULT_ISODATA by default) and converted to
+    integers in units of the smallest decimal place of the data, so that sums are exact. The m/z obtained are the same
+    as the ones computed by isocor with Decimal arithmetic, without creating one LabelledChemical per formula.
+    """
+
+    FORMULA_PATTERN = r"([A-Z][a-z]*)(\d*)"
+
+    def __init__(self, isodata:dict=None):
+        """
+        :param isodata: Isotopic data ({element: {"mass": [...], "abundance": [...]}}). Defaults to the isotopic data of isocor.
+        """
+        self.isodata = LabelledChemical.DEFAULT_ISODATA if isodata is None else isodata
+        self.elements = list(self.isodata)
+        self.element_index = {element: index for index, element in enumerate(self.elements)}
+
+        # Integer masses, in units of 10**-digits
+        self.digits = max(-Decimal(mass).as_tuple().exponent for data in self.isodata.values() for mass in data["mass"])
+        self.scale = 10 ** self.digits
+        self._int_masses = {element: [int(Decimal(mass) * self.scale) for mass in data["mass"]]
+                            for element, data in self.isodata.items()}
+        self.monoisotopic = np.array([self._int_masses[element][0] for element in self.elements], dtype=np.int64)
+
+    def parse_formulas(self, formulas) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Parse elemental formulas (e.g. "C3H4O3") in bulk.
+        Formulas that are not strings made only of element symbols and counts, or that contain elements missing from
+        the isotopic data, are flagged as invalid.
+
+        :param formulas: Sequence of formulas.
+        :return: matrix of the element counts (formulas x elements, in the order of self.elements) and boolean mask of the valid formulas.
+        """
+        formulas = pd.Series(formulas, dtype=object).reset_index(drop=True)
+        counts = np.zeros((len(formulas), len(self.elements)), dtype=np.int64)
+        is_str = formulas.map(lambda formula: isinstance(formula, str)).to_numpy(dtype=bool)
+        valid = is_str.copy()
+        if not valid.any():
+            return counts, valid
+        valid[is_str] = formulas[is_str].str.fullmatch(f"(?:{self.FORMULA_PATTERN})+").to_numpy(dtype=bool)
+
+        tokens = formulas[valid].str.extractall(self.FORMULA_PATTERN)
+        rows = tokens.index.get_level_values(0).to_numpy()
+        element_index = tokens[0].map(self.element_index)
+        known = element_index.notna().to_numpy()
+        # Formulas with unknown elements are invalid
+        valid[np.unique(rows[~known])] = False
+        keep = known & valid[rows]
+        # Element without count (e.g. "P" in "C3H7O6P") counts for one atom
+        numbers = pd.to_numeric(tokens[1], errors="coerce").fillna(1).to_numpy()[keep].astype(np.int64)
+        np.add.at(counts, (rows[keep], element_index.to_numpy()[keep].astype(np.int64)), numbers)
+        return counts, valid
+
+    def int_masses(self, counts:np.ndarray) -> np.ndarray:
+        """
+        Returns the monoisotopic masses of formulas, as integers in units of 10**-digits.
+
+        :param counts: matrix of the element counts (formulas x elements).
+        """
+        return counts @ self.monoisotopic
+
+    def masses(self, counts:np.ndarray) -> np.ndarray:
+        """
+        Returns the monoisotopic masses of formulas.
+
+        :param counts: matrix of the element counts (formulas x elements).
+        """
+        return self.int_masses(counts) / self.scale
+
+    def isotopologues_mz(self, counts:np.ndarray, charges, tracer_element:str, tracer_idx:int=1) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Compute the m/z of all the isotopologues of each formula (M0 to the number of tracer atoms of the formula),
+        as monoisotopic mass + isotopologue * tracer mass shift + charge * hydrogen mass.
+
+        :param counts: matrix of the element counts (formulas x elements).
+        :param charges: Charge of each formula.
+        :param tracer_element: Tracer element (e.g. "C").
+        :param tracer_idx: Index of the tracer isotope in the isotopic data of the tracer element.
+        :return: position of the formula, isotopologue number and m/z of each isotopologue, ordered by formula then isotopologue.
+        """
+        charges = np.asarray(charges, dtype=np.int64)
+        tracer_masses = self._int_masses[tracer_element]
+        mzshift = tracer_masses[tracer_idx] - tracer_masses[0]
+        hydrogen = self._int_masses["H"][0]
+
+        nb_isotopologues = counts[:, self.element_index[tracer_element]] + 1
+        formula_pos = np.repeat(np.arange(len(counts), dtype=np.int64), nb_isotopologues)
+        isotopologues = np.arange(len(formula_pos), dtype=np.int64) - np.repeat(np.cumsum(nb_isotopologues) - nb_isotopologues, nb_isotopologues)
+        int_mz = (self.int_masses(counts) + charges * hydrogen)[formula_pos] + isotopologues * mzshift
+        return formula_pos, isotopologues, int_mz / self.scale
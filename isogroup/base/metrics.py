@@ -0,0 +1,156 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from pathlib import Path
+import json
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+
+def peak_rss() -> int | None:
+    """
+    Returns the peak resident set size of the process (in bytes), or None if it is not available on the platform.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageMetrics:
+    """
+    Measures of one stage of a pipeline: wall time, CPU time, memory and item counters.
+    """
+
+    def __init__(self, name:str):
+        """
+        :param name: Name of the stage (e.g. "build_clusters").
+        """
+        self.name = name
+        self.wall_time: float = None # seconds
+        self.cpu_time: float = None # seconds, of the current process
+        self.peak_rss_increase: int = None # bytes, increase of the peak RSS of the process during the stage
+        self.peak_traced: int = None # bytes, peak of the memory traced by tracemalloc during the stage, if tracing
+        self.counters = {} # {counter name: count}
+
+    def as_dict(self) -> dict:
+        """
+        Returns the measures of the stage as a dict.
+        """
+        return {"name": self.name,
+                "wall_time": self.wall_time,
+                "cpu_time": self.cpu_time,
+                "peak_rss_increase": self.peak_rss_increase,
+                "peak_traced": self.peak_traced,
+                "counters": dict(self.counters)}
+
+    def __str__(self) -> str:
+        text = f"{self.name}: {self.wall_time:.3f} s wall, {self.cpu_time:.3f} s CPU"
+        if self.peak_rss_increase is not None:
+            text += f", peak RSS +{self.peak_rss_increase / 2**20:.1f} MiB"
+        if self.peak_traced is not None:
+            text += f", peak traced {self.peak_traced / 2**20:.1f} MiB"
+        if self.counters:
+            text += ", " + ", ".join(f"{name}={count}" for name, count in self.counters.items())
+        return text
+
+
+class PipelineMetrics:
+    """
+    Instrumentation of a pipeline, stage by stage.
+    Stages are measured with the stage() context manager, and counters recorded with count() are attached to the
+    innermost running stage (or to the pipeline if no stage is running).
+    The peak RSS is a high-water mark over the whole life of the process: it is reported once for the pipeline, and
+    each stage records by how much it raised it. A stage using less memory than an earlier one records no increase.
+    The peak of traced memory is only measured when tracemalloc is tracing (e.g. "python -X tracemalloc"),
+    as tracing slows down the pipeline. The tracemalloc peak is reset when a stage starts: the peak reached so far is
+    first recorded by the running stages, so that the peak of an outer stage includes its nested stages.
+    """
+
+    def __init__(self):
+        self.stages = [] # StageMetrics, in the order in which the stages ended
+        self.peak_rss: int = None # bytes, peak RSS of the process at the end of the last stage
+        self.counters = {} # {counter name: count}, recorded outside of any stage
+        self._running = [] # stack of the running stages
+
+    @contextmanager
+    def stage(self, name:str):
+        """
+        Measure a stage of the pipeline.
+
+        :param name: Name of the stage.
+        """
+        stage = StageMetrics(name)
+        if tracemalloc.is_tracing():
+            traced_peak = tracemalloc.get_traced_memory()[1]
+            for outer in self._running:
+                outer.peak_traced = max(outer.peak_traced or 0, traced_peak)
+            tracemalloc.reset_peak()
+        self._running.append(stage)
+        rss_start = peak_rss()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield stage
+        finally:
+            stage.wall_time = time.perf_counter() - wall_start
+            stage.cpu_time = time.process_time() - cpu_start
+            self.peak_rss = peak_rss()
+            if self.peak_rss is not None:
+                stage.peak_rss_increase = self.peak_rss - rss_start
+            if tracemalloc.is_tracing():
+                stage.peak_traced = max(stage.peak_traced or 0, tracemalloc.get_traced_memory()[1])
+            self._running.pop()
+            self.stages.append(stage)
+
+    def count(self, name:str, value:int=1):
+        """
+        Add to a counter of the running stage.
+
+        :param name: Name of the counter (e.g. "clusters_formed").
+        :param value: Value added to the counter.
+        """
+        counters = self._running[-1].counters if self._running else self.counters
+        counters[name] = counters.get(name, 0) + int(value)
+
+    def __getitem__(self, name:str) -> StageMetrics:
+        """
+        Returns the last measure of a stage.
+
+        :param name: Name of the stage.
+        """
+        for stage in reversed(self.stages):
+            if stage.name == name:
+                return stage
+        raise KeyError(name)
+
+    def as_dict(self) -> dict:
+        """
+        Returns the measures of all the stages as a dict, serializable in JSON.
+        """
+        return {"stages": [stage.as_dict() for stage in self.stages], "counters": dict(self.counters), "peak_rss": self.peak_rss}
+
+    def save(self, path:str | Path):
+        """
+        Write the measures to a JSON file.
+
+        :param path: Path of the JSON file.
+        """
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def log(self, logger):
+        """
+        Log the measures of each stage.
+
+        :param logger: Logger to write to.
+        """
+        for stage in self.stages:
+            logger.info(f"  {stage}")
+        if self.peak_rss is not None:
+            logger.info(f"  Peak RSS of the process: {self.peak_rss / 2**20:.1f} MiB")
@@ -1,5 +1,6 @@
 from __future__ import annotations
 import re
+import numpy as np
 from isocor.base import LabelledChemical
 
 class Misc:
@@ -69,6 +70,21 @@ class Misc:
         mz_shift = tracer_mass - natural_mass
         return mz_shift
     
+    @staticmethod
+    def _max_isotopologues_factor(tracer_element: str) -> float:
+        """
+        Returns the empiric fraction of tracer atoms in a molecule, used to estimate the maximum number of isotopologues.
+
+        :param tracer_element: Tracer element symbol (e.g. "C", "N").
+        """
+        if tracer_element == "C":
+            return 0.7 # Approximation, empiric fraction based on the Seven Golden Rules
+        elif tracer_element == "N":
+            return 0.2
+        elif tracer_element == "O":
+            return 0.3
+        raise NotImplementedError(f"Tracer {tracer_element} not implemented yet.")
+
     @staticmethod
     def get_max_isotopologues_for_mz(mz: float, tracer_element: str) -> int:
         """
@@ -81,16 +97,23 @@ class Misc:
         element_mass = float(Misc.get_atomic_mass(tracer_element))
         if element_mass is None:
             raise ValueError(f"Unknown tracer element: {tracer_element}")
-        if tracer_element == "C":
-            factor = 0.7 # Approximation, empiric fraction based on the Seven Golden Rules
-        elif tracer_element == "N":
-            factor = 0.2
-        elif tracer_element == "O":
-            factor = 0.3
-        else:
-            raise NotImplementedError(f"Tracer {tracer_element} not implemented yet.")
+        factor = Misc._max_isotopologues_factor(tracer_element)
         return max(1, int(factor * (mz / element_mass)))
 
+    @staticmethod
+    def get_max_isotopologues_for_mz_array(mz: np.ndarray, tracer_element: str) -> np.ndarray:
+        """
+        Vectorized version of get_max_isotopologues_for_mz, for an array of m/z values.
+
+        :param mz: Array of mass-to-charge ratios.
+        :param tracer_element: Tracer element symbol (e.g. "C", "N").
+        """
+        element_mass = Misc.get_atomic_mass(tracer_element)
+        if element_mass is None:
+            raise ValueError(f"Unknown tracer element: {tracer_element}")
+        factor = Misc._max_isotopologues_factor(tracer_element)
+        return np.maximum(1, np.trunc(factor * (np.asarray(mz, dtype=np.float64) / float(element_mass)))).astype(np.int64)
+
     def calculate_isotopologue_index(candidate_mz:float, base_mz:float, mzshift_tracer:float) -> int:
         """
         Calculate the theoretical isotopologue index based on m/z values.
@@ -0,0 +1,133 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import os
+import numpy as np
+
+# Arrays shared with a worker process, attached by the first task of each map ({key: read-only np.ndarray})
+_shared_arrays = {}
+_shared_blocks = []
+_shared_specs = None
+
+
+def _attach_shared_arrays(specs:dict):
+    """
+    Attach the shared memory blocks in a worker process and expose them as read-only arrays.
+    Blocks of a previous map of the same pool are detached first. Nothing is done if the blocks are already attached.
+
+    :param specs: Description of the shared arrays ({key: (shared memory name, shape, dtype)}).
+    """
+    global _shared_specs
+    if specs == _shared_specs:
+        return
+    _shared_arrays.clear()
+    for block in _shared_blocks:
+        block.close()
+    _shared_blocks.clear()
+    for key, (name, shape, dtype) in specs.items():
+        block = SharedMemory(name=name)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        _shared_blocks.append(block)
+        _shared_arrays[key] = array
+    _shared_specs = specs
+
+
+def _run_task(func, specs:dict, task:tuple):
+    """
+    Run a task in a worker process, on the shared arrays.
+
+    :param func: Function called as func(arrays, *task).
+    :param specs: Description of the shared arrays (see _attach_shared_arrays).
+    :param task: Arguments of the task.
+    """
+    _attach_shared_arrays(specs)
+    return func(_shared_arrays, *task)
+
+
+class ParallelExecutor:
+    """
+    Runs independent tasks over a process pool.
+    The NumPy arrays needed by the tasks are copied once into shared memory and attached read-only by every worker,
+    instead of being pickled with each task. Results are returned in the order of the tasks, so that merging them gives
+    the same output as a serial run.
+    Used as a context manager, the executor keeps its process pool open between calls to map(), so that successive
+    maps (e.g. one per RT partition) do not start new processes. Otherwise, each map() starts and stops its own pool.
+    """
+
+    def __init__(self, n_jobs:int=1, min_block_size:int=10000):
+        """
+        :param n_jobs: Number of worker processes. -1 uses all the CPUs. With 1, tasks are run in the current process.
+        :param min_block_size: Minimal number of items per task when splitting work with blocks().
+        """
+        if n_jobs == -1:
+            n_jobs = os.cpu_count() or 1
+        if not isinstance(n_jobs, int) or n_jobs < 1:
+            raise ValueError(f"n_jobs must be a positive integer or -1, got {n_jobs}.")
+        self.n_jobs = n_jobs
+        self.min_block_size = min_block_size
+        self._persistent = False
+        self._pool = None
+
+    def __enter__(self) -> ParallelExecutor:
+        self._persistent = True
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Stop the process pool kept open by the context manager, if any.
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        self._persistent = False
+
+    def blocks(self, nb_items:int) -> list:
+        """
+        Split a range of items into contiguous blocks, at most one per worker and of at least min_block_size items.
+
+        :param nb_items: Number of items.
+        :return: list of (start, stop) bounds.
+        """
+        nb_blocks = max(1, min(self.n_jobs, nb_items // max(1, self.min_block_size)))
+        bounds = np.linspace(0, nb_items, nb_blocks + 1).astype(np.int64).tolist()
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def map(self, func, tasks:list, arrays:dict) -> list:
+        """
+        Run func(arrays, *task) for each task and return the results in the order of the tasks.
+
+        :param func: Module-level function (it must be picklable) called on each task.
+        :param tasks: Arguments of each task.
+        :param arrays: Numeric arrays shared by all tasks ({key: np.ndarray}).
+        """
+        if self.n_jobs == 1 or len(tasks) <= 1:
+            return [func(arrays, *task) for task in tasks]
+
+        blocks = []
+        try:
+            specs = {}
+            for key, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                block = SharedMemory(create=True, size=max(array.nbytes, 1))
+                blocks.append(block)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+                specs[key] = (block.name, array.shape, array.dtype.str)
+
+            pool = self._pool
+            if pool is None:
+                pool = ProcessPoolExecutor(max_workers=self.n_jobs if self._persistent else min(self.n_jobs, len(tasks)))
+                if self._persistent:
+                    self._pool = pool
+            try:
+                return list(pool.map(_run_task, [func] * len(tasks), [specs] * len(tasks), tasks))
+            finally:
+                if not self._persistent:
+                    pool.shutdown()
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
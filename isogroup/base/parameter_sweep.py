@@ -0,0 +1,206 @@
+from __future__ import annotations
+from isogroup.base.candidate_search import CandidateSearch
+from isogroup.base.feature_table import FeatureTable
+from isogroup.base.misc import Misc
+from isogroup.base.untargeted_experiment import UntargetedExperiment
+import itertools
+import logging
+import time
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(f"IsoGroup")
+
+
+class ParameterSweep:
+    """
+    Untargeted clustering over a grid of tolerances (ppm_tol x rt_tol x max_atoms), to help choosing them.
+
+    The feature table is loaded once and the candidate pairs are searched once, at the widest setting of the grid.
+    The pairs of each setting are then derived by filtering the widest pairs with the same criteria as the candidate
+    search (RT window, ppm deviation and number of tracer atoms), so that each setting gives exactly the clusters of
+    a separate UntargetedExperiment run. Only clustering, deduplication and metrics are computed per setting.
+    """
+
+    def __init__(self, dataset:pd.DataFrame | FeatureTable, tracer:str, ppm_tols:list, rt_tols:list, max_atoms:list=None,
+                 keep:str=None, mask_missing:bool=False, engine:str="star", n_jobs:int=1):
+        """
+        :param dataset: DataFrame containing experimental data with columns for m/z, retention time (RT), feature ID and sample intensities,
+                        or FeatureTable already loaded.
+        :param tracer: Tracer code used in the experiment (e.g. "13C").
+        :param ppm_tols: m/z tolerances (in ppm) of the grid.
+        :param rt_tols: Retention time tolerances of the grid.
+        :param max_atoms: Maximum numbers of tracer atoms of the grid (None for the automatic estimate). Defaults to [None].
+                          Not used by the "graph" engine.
+        :param keep: Strategy to keep clusters during deduplication (see UntargetedExperiment).
+        :param mask_missing: If True, features with a null intensity in a sample are left out of the clusters of this sample.
+        :param engine: Clustering engine, "star" or "graph" (see UntargetedExperiment).
+        :param n_jobs: Number of processes used for the candidate search at the widest setting.
+        """
+        if not ppm_tols or not rt_tols:
+            raise ValueError("At least one ppm tolerance and one RT tolerance are required.")
+        self.tracer = tracer
+        self.ppm_tols = sorted(set(ppm_tols))
+        self.rt_tols = sorted(set(rt_tols))
+        self.max_atoms = [None] if not max_atoms or engine == "graph" else list(dict.fromkeys(max_atoms))
+        self.keep = keep
+        self.mask_missing = mask_missing
+        self.engine = engine
+        self.n_jobs = n_jobs
+
+        # Experiment holding the feature table, shared by the experiments of all settings
+        self.experiment = UntargetedExperiment(dataset=dataset, tracer=tracer, ppm_tol=max(self.ppm_tols),
+                                               rt_tol=max(self.rt_tols), keep=keep, mask_missing=mask_missing,
+                                               engine=engine, n_jobs=n_jobs)
+        self.rt_order = None # rows of the features sorted by retention time
+        self.pairs = None # {"base", "candidate", "iso_index", "delta_ppm"}: widest candidate pairs, in retention time positions
+        self.results = None
+
+    @property
+    def settings(self) -> list:
+        """
+        Returns the (ppm_tol, rt_tol, max_atoms) settings of the grid.
+        """
+        return list(itertools.product(self.ppm_tols, self.rt_tols, self.max_atoms))
+
+    def _widest_max_atoms(self, mzs:np.ndarray) -> int | None:
+        """
+        Returns the max_atoms value of the widest search: a number of tracer atoms at least as large as the one of
+        every setting of the grid, for every feature.
+
+        :param mzs: m/z of the features.
+        """
+        if self.engine == "graph":
+            return 1
+        if all(max_atoms is None for max_atoms in self.max_atoms):
+            return None
+        max_atoms = [value for value in self.max_atoms if value is not None]
+        if None in self.max_atoms and len(mzs):
+            max_atoms.append(int(Misc.get_max_isotopologues_for_mz_array(mzs, self.experiment.tracer_element).max()))
+        return max(max_atoms)
+
+    def search_pairs(self):
+        """
+        Load the feature table and search the candidate pairs at the widest setting of the grid.
+        The isotopologue index and ppm deviation of each pair are stored to filter them for each setting.
+        """
+        experiment = self.experiment
+        experiment.initialize_experimental_features()
+        table = experiment.table
+        self.rt_order = np.argsort(table.rt, kind="stable")
+        rts, mzs = table.rt[self.rt_order], table.mz[self.rt_order]
+
+        search = CandidateSearch(mzshift_tracer=experiment.mzshift_tracer,
+                                 tracer_element=experiment.tracer_element,
+                                 rt_tol=max(self.rt_tols),
+                                 ppm_tol=max(self.ppm_tols),
+                                 max_atoms=self._widest_max_atoms(mzs),
+                                 n_jobs=self.n_jobs)
+        base_pos, candidate_pos = search.pairs(rts, mzs)
+
+        # Same expressions as CandidateSearch.match
+        base_mz, candidate_mz = mzs[base_pos], mzs[candidate_pos]
+        iso_index = np.rint((candidate_mz - base_mz) / experiment.mzshift_tracer)
+        expected_mz = base_mz + iso_index * experiment.mzshift_tracer
+        self.pairs = {"base": base_pos,
+                      "candidate": candidate_pos,
+                      "iso_index": np.abs(iso_index),
+                      "delta_ppm": np.abs(expected_mz - candidate_mz) / expected_mz * 1e6}
+
+    def filter_pairs(self, ppm_tol:float, rt_tol:float, max_atoms:int=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the candidate pairs of a setting, among the pairs of the widest setting.
+        A pair is kept if the candidate is in the RT window of the base feature, with the same bounds as the window search,
+        and if it matches the base within the ppm tolerance and number of tracer atoms.
+
+        :param ppm_tol: m/z tolerance (in ppm).
+        :param rt_tol: Retention time tolerance.
+        :param max_atoms: Maximum number of tracer atoms. If None, it is estimated from the m/z of the base feature.
+        :return: positions (in retention time order) of the base features and of their candidates.
+        """
+        table = self.experiment.table
+        rts = table.rt[self.rt_order]
+        base_pos, candidate_pos = self.pairs["base"], self.pairs["candidate"]
+        if self.engine == "graph":
+            max_iso = 1
+        elif max_atoms is None:
+            max_iso = Misc.get_max_isotopologues_for_mz_array(table.mz[self.rt_order], self.experiment.tracer_element)[base_pos]
+        else:
+            max_iso = max_atoms
+
+        base_rt, candidate_rt = rts[base_pos], rts[candidate_pos]
+        keep = ((candidate_rt >= base_rt - rt_tol) & (candidate_rt <= base_rt + rt_tol)
+                & (self.pairs["iso_index"] <= max_iso) & (self.pairs["delta_ppm"] <= ppm_tol))
+        return base_pos[keep], candidate_pos[keep]
+
+    def run_setting(self, ppm_tol:float, rt_tol:float, max_atoms:int=None) -> UntargetedExperiment:
+        """
+        Build and deduplicate the clusters of a setting, from the filtered candidate pairs.
+        The experiment of the setting shares the arrays of the feature table, with its own annotations.
+
+        :param ppm_tol: m/z tolerance (in ppm).
+        :param rt_tol: Retention time tolerance.
+        :param max_atoms: Maximum number of tracer atoms. If None, it is estimated from the m/z of the base feature.
+        """
+        if self.pairs is None:
+            self.search_pairs()
+        table = self.experiment.table.without_annotations()
+        experiment = UntargetedExperiment(dataset=table, tracer=self.tracer, ppm_tol=ppm_tol, rt_tol=rt_tol,
+                                          max_atoms=max_atoms, keep=self.keep, mask_missing=self.mask_missing,
+                                          engine=self.engine)
+        experiment.table = table
+
+        base_pos, candidate_pos = self.filter_pairs(ppm_tol, rt_tol, max_atoms)
+        if self.engine == "graph":
+            labels = CandidateSearch.connected_components(len(table), base_pos, candidate_pos)
+            clusters = experiment._assemble_components(self.rt_order, labels)
+        else:
+            clusters = experiment._assemble_clusters(self.rt_order[base_pos], self.rt_order[candidate_pos])
+        experiment.set_clusters(clusters)
+        experiment.deduplicate_clusters(self.keep)
+        return experiment
+
+    @staticmethod
+    def metrics(experiment:UntargetedExperiment) -> dict:
+        """
+        Returns the metrics of a deduplicated experiment, counted in its first sample as in the pipeline logs:
+        number of clusters, number of complete clusters (one feature for each isotopologue from Mx to the heaviest one)
+        and number of unassigned features.
+
+        :param experiment: Deduplicated UntargetedExperiment.
+        """
+        table = experiment.table
+        clusters = next(iter(experiment.clusters.values()), {})
+        complete = 0
+        for cluster in clusters.values():
+            rows = [feature.row for feature in cluster.features]
+            min_mz = min(table.mz[row] for row in rows)
+            iso_indexes = sorted(Misc.calculate_isotopologue_index(table.mz[row], min_mz, experiment.mzshift_tracer) for row in rows)
+            complete += iso_indexes == list(range(len(rows)))
+        unclustered = next(iter(experiment.unclustered_features.values()), [])
+        return {"clusters": len(clusters), "complete_clusters": complete, "unassigned_features": len(unclustered)}
+
+    def run(self) -> pd.DataFrame:
+        """
+        Run all the settings of the grid and return a table of metrics, with one row per setting
+        (ppm_tol, rt_tol, max_atoms, clusters, complete_clusters, unassigned_features, runtime in seconds).
+        The runtime of a setting does not include the shared candidate search, which is logged.
+        """
+        start_time = time.perf_counter()
+        self.search_pairs()
+        logger.info(f"{len(self.pairs['base'])} candidate pairs found at the widest setting in {time.perf_counter() - start_time:.2f} seconds.")
+
+        rows = []
+        for ppm_tol, rt_tol, max_atoms in self.settings:
+            setting_start = time.perf_counter()
+            experiment = self.run_setting(ppm_tol, rt_tol, max_atoms)
+            rows.append({"ppm_tol": ppm_tol, "rt_tol": rt_tol, "max_atoms": max_atoms}
+                        | self.metrics(experiment)
+                        | {"runtime": time.perf_counter() - setting_start})
+            logger.info(f"ppm_tol={ppm_tol}, rt_tol={rt_tol}, max_atoms={max_atoms}: {rows[-1]['clusters']} clusters, "
+                        f"{rows[-1]['complete_clusters']} complete, {rows[-1]['unassigned_features']} unassigned features.")
+        self.results = pd.DataFrame(rows, columns=["ppm_tol", "rt_tol", "max_atoms", "clusters", "complete_clusters",
+                                                   "unassigned_features", "runtime"])
+        # Integer column, empty for the automatic estimate
+        self.results["max_atoms"] = self.results["max_atoms"].astype("Int64")
+        return self.results
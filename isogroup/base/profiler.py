@@ -0,0 +1,95 @@
+from __future__ import annotations
+from collections import Counter
+from contextlib import contextmanager
+from io import StringIO
+from pathlib import Path
+import cProfile
+import pstats
+import sys
+import threading
+
+
+class Profiler:
+    """
+    Profiling of a block of code, for the --profile option of the command line.
+
+    The block is run under cProfile, whose statistics are saved as a .pstats file (readable with pstats, snakeviz...).
+    As cProfile does not record complete call stacks, the stack of the profiled thread is also sampled at regular
+    intervals by a background thread, and saved in the collapsed-stack format ("frame;frame;frame count" lines)
+    read by flame graph tools (flamegraph.pl, speedscope...).
+    """
+
+    def __init__(self, interval:float=0.005):
+        """
+        :param interval: Sampling interval of the call stacks (in seconds).
+        """
+        self.interval = interval
+        self.profile = cProfile.Profile()
+        self.stacks = Counter() # {(root frame, ..., leaf frame): number of samples}
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        """
+        Returns the name of a frame in the collapsed stacks ("module:function").
+
+        :param frame: Frame of the call stack.
+        """
+        code = frame.f_code
+        return f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}"
+
+    def _sample(self, thread_id:int):
+        """
+        Sample the call stack of a thread until the profiling is stopped.
+
+        :param thread_id: Identifier of the profiled thread.
+        """
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    @contextmanager
+    def run(self):
+        """
+        Profile the block of code run in the context.
+        """
+        self._stop.clear()
+        sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),), daemon=True)
+        sampler.start()
+        self.profile.enable()
+        try:
+            yield self
+        finally:
+            self.profile.disable()
+            self._stop.set()
+            sampler.join()
+
+    def top_functions(self, n:int=20, sort:str="tottime") -> str:
+        """
+        Returns the table of the n functions taking the most time.
+
+        :param n: Number of functions.
+        :param sort: Sort key of pstats: "tottime" (time spent in the function itself) or "cumulative" (including its calls).
+        """
+        stream = StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats(sort).print_stats(n)
+        return stream.getvalue()
+
+    def save(self, prefix:str | Path) -> tuple[Path, Path]:
+        """
+        Write the cProfile statistics to "<prefix>.pstats" and the sampled stacks to "<prefix>.collapsed.txt".
+
+        :param prefix: Path of the files, without extension.
+        :return: paths of the two files.
+        """
+        pstats_path, collapsed_path = Path(f"{prefix}.pstats"), Path(f"{prefix}.collapsed.txt")
+        self.profile.dump_stats(pstats_path)
+        with open(collapsed_path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+        return pstats_path, collapsed_path
@@ -0,0 +1,205 @@
+from __future__ import annotations
+from isogroup.base.mass_engine import MassEngine
+from isogroup.base.misc import Misc
+from functools import reduce
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+
+class SyntheticDataset:
+    """
+    Generator of synthetic LC-MS datasets of isotopic labelling experiments, to test and benchmark IsoGroup at any size.
+
+    Metabolites are drawn with random elemental formulas, and the complete isotopologue ladder of each metabolite
+    (M0 to the number of tracer atoms) is planted in the feature table, at the m/z computed by the MassEngine (as in the
+    compiled Database) with a small ppm error, and around the retention time of the metabolite. Noise features with
+    random m/z and retention times are added. The database lists the planted metabolites, optionally with decoy
+    metabolites that are absent from the dataset.
+    The generation is fully determined by the seed.
+    """
+
+    # Ranges of the number of atoms of the non-tracer elements of the formulas
+    ELEMENT_RANGES = {"C": (2, 30), "H": (2, 50), "N": (0, 4), "O": (1, 10)}
+
+    def __init__(self, n_features:int, tracer:str="13C", n_samples:int=3, atoms:tuple | dict=(2, 20),
+                 rt_density:float=50, rt_spread:float=1.0, ppm_error:float=1.0, noise_fraction:float=0.2,
+                 missing_fraction:float=0.05, database_size:int=None, charge:int=-1, seed:int=0):
+        """
+        :param n_features: Number of features of the dataset (planted isotopologues and noise features).
+        :param tracer: Tracer code (e.g. "13C", "15N").
+        :param n_samples: Number of samples.
+        :param atoms: Distribution of the number of tracer atoms of the metabolites (i.e. the number of carbons for a 13C tracer),
+                      either a (min, max) range of equally likely values or a dict {number of atoms: weight}.
+        :param rt_density: Number of features per unit of retention time; the retention time range is n_features / rt_density.
+        :param rt_spread: Standard deviation of the retention times of the isotopologues of a metabolite around its retention time.
+        :param ppm_error: Standard deviation of the m/z error of the planted isotopologues (in ppm).
+        :param noise_fraction: Fraction of the features that are noise features, not part of any isotopologue ladder.
+        :param missing_fraction: Fraction of the intensities set to 0 (features not detected in a sample).
+        :param database_size: Number of metabolites of the database. Below the number of planted metabolites, the database
+                              lists a random subset of them; above, decoy metabolites are added. Defaults to the planted metabolites.
+        :param charge: Charge of the ions.
+        :param seed: Seed of the random generator.
+        """
+        if not 0 <= noise_fraction < 1:
+            raise ValueError("noise_fraction must be in [0, 1).")
+        if not 0 <= missing_fraction < 1:
+            raise ValueError("missing_fraction must be in [0, 1).")
+        self.n_features = n_features
+        self.tracer = tracer
+        self.tracer_element, self.tracer_idx = Misc._parse_strtracer(tracer)
+        self.n_samples = n_samples
+        self.atoms = atoms
+        self.rt_density = rt_density
+        self.rt_spread = rt_spread
+        self.ppm_error = ppm_error
+        self.noise_fraction = noise_fraction
+        self.missing_fraction = missing_fraction
+        self.database_size = database_size
+        self.charge = charge
+        self.seed = seed
+        self.mass_engine = MassEngine()
+
+        self.dataset = None # DataFrame with id, mz, rt and one intensity column per sample
+        self.database = None # DataFrame with metabolite, rt, formula and charge
+        self.truth = None # DataFrame with the metabolite and isotopologue planted for each feature (empty for noise features)
+
+    @property
+    def samples(self) -> list:
+        """
+        Returns the names of the samples.
+        """
+        return [f"Sample_{index + 1}" for index in range(self.n_samples)]
+
+    def _draw_atoms(self, rng:np.random.Generator, size:int) -> np.ndarray:
+        """
+        Draw the number of tracer atoms of metabolites.
+
+        :param rng: Random generator.
+        :param size: Number of metabolites.
+        """
+        if isinstance(self.atoms, dict):
+            values = np.array(list(self.atoms), dtype=np.int64)
+            weights = np.array(list(self.atoms.values()), dtype=np.float64)
+            return rng.choice(values, size=size, p=weights / weights.sum())
+        low, high = self.atoms
+        return rng.integers(low, high + 1, size=size)
+
+    def _draw_formulas(self, rng:np.random.Generator, n_atoms:np.ndarray) -> tuple[np.ndarray, list]:
+        """
+        Draw random elemental formulas with the given numbers of tracer atoms.
+
+        :param rng: Random generator.
+        :param n_atoms: Number of tracer atoms of each formula.
+        :return: matrix of the element counts (formulas x elements of the MassEngine) and formulas.
+        """
+        engine = self.mass_engine
+        counts = np.zeros((len(n_atoms), len(engine.elements)), dtype=np.int64)
+        for element, (low, high) in self.ELEMENT_RANGES.items():
+            counts[:, engine.element_index[element]] = rng.integers(low, high + 1, size=len(n_atoms))
+        counts[:, engine.element_index[self.tracer_element]] = n_atoms
+
+        elements = list(dict.fromkeys([*self.ELEMENT_RANGES, self.tracer_element]))
+        columns = [np.where(counts[:, engine.element_index[element]] > 0,
+                            element + counts[:, engine.element_index[element]].astype(str), "")
+                   for element in elements]
+        return counts, reduce(np.char.add, columns).tolist()
+
+    def generate(self) -> SyntheticDataset:
+        """
+        Generate the dataset, the database and the ground truth.
+        """
+        rng = np.random.default_rng(self.seed)
+        n_noise = int(round(self.n_features * self.noise_fraction))
+        n_planted = self.n_features - n_noise
+        rt_range = self.n_features / self.rt_density
+
+        # --- Metabolites, until their ladders cover the planted features ---
+        n_atoms = self._draw_atoms(rng, 0)
+        while (n_atoms + 1).sum() < n_planted:
+            missing = n_planted - (n_atoms + 1).sum()
+            n_atoms = np.concatenate([n_atoms, self._draw_atoms(rng, max(1, missing // 4))])
+        # Only keep the metabolites whose ladder starts before the end of the planted features
+        n_atoms = n_atoms[np.cumsum(n_atoms + 1) - (n_atoms + 1) < n_planted]
+        counts, formulas = self._draw_formulas(rng, n_atoms)
+        n_metabolites = len(n_atoms)
+        metabolite_rt = rng.uniform(0, rt_range, size=n_metabolites)
+
+        # --- Isotopologue ladders, the last one being truncated to the number of planted features ---
+        metabolite, isotopologue, mz = self.mass_engine.isotopologues_mz(counts, np.full(n_metabolites, self.charge),
+                                                                         self.tracer_element, self.tracer_idx)
+        metabolite, isotopologue, mz = metabolite[:n_planted], isotopologue[:n_planted], mz[:n_planted]
+        mz = mz * (1 + rng.normal(0, self.ppm_error, size=n_planted) * 1e-6)
+        rt = metabolite_rt[metabolite] + rng.normal(0, self.rt_spread, size=n_planted)
+
+        # --- Noise features, in the m/z range of the metabolites ---
+        mz_low, mz_high = (mz.min(), mz.max()) if n_planted else (50.0, 1000.0)
+        mz = np.concatenate([mz, rng.uniform(mz_low, mz_high, size=n_noise)])
+        rt = np.clip(np.concatenate([rt, rng.uniform(0, rt_range, size=n_noise)]), 0, None)
+        metabolite = np.concatenate([metabolite, np.full(n_noise, -1)])
+        isotopologue = np.concatenate([isotopologue, np.full(n_noise, -1)])
+
+        # --- Intensities: abundance of the metabolite x fraction of the isotopologue, per sample ---
+        # (the last row of abundances is the one of the noise features, indexed by -1)
+        abundance = rng.lognormal(mean=16, sigma=1.5, size=(n_metabolites + 1, self.n_samples))
+        fraction = rng.dirichlet(np.ones(2), size=(self.n_features, self.n_samples))[:, :, 0]
+        intensities = abundance[metabolite] * fraction
+        intensities[rng.random(intensities.shape) < self.missing_fraction] = 0.0
+
+        # --- Features in random order ---
+        order = rng.permutation(self.n_features)
+        ids = np.char.add("F", np.arange(1, self.n_features + 1).astype(str))
+        self.dataset = pd.DataFrame({"id": ids, "mz": mz[order], "rt": rt[order]})
+        for column, sample in enumerate(self.samples):
+            self.dataset[sample] = intensities[order, column]
+
+        labels = np.char.add("M", np.arange(n_metabolites).astype(str))
+        metabolite, isotopologue = metabolite[order], isotopologue[order]
+        isotopologue = pd.array(isotopologue, dtype="Int64")
+        isotopologue[metabolite < 0] = pd.NA
+        self.truth = pd.DataFrame({"id": ids,
+                                   "metabolite": np.where(metabolite >= 0, labels[metabolite], None),
+                                   "isotopologue": isotopologue})
+
+        self.database = self._build_database(rng, labels, formulas, metabolite_rt)
+        return self
+
+    def _build_database(self, rng:np.random.Generator, labels:np.ndarray, formulas:list, metabolite_rt:np.ndarray) -> pd.DataFrame:
+        """
+        Build the database from the planted metabolites, a subset of them or with additional decoy metabolites.
+
+        :param rng: Random generator.
+        :param labels: Names of the planted metabolites.
+        :param formulas: Formulas of the planted metabolites.
+        :param metabolite_rt: Retention times of the planted metabolites.
+        """
+        database = pd.DataFrame({"metabolite": labels, "rt": metabolite_rt, "formula": formulas, "charge": self.charge})
+        size = len(database) if self.database_size is None else self.database_size
+        if size <= len(database):
+            return database.iloc[np.sort(rng.choice(len(database), size=size, replace=False))].reset_index(drop=True)
+
+        n_decoys = size - len(database)
+        _, decoy_formulas = self._draw_formulas(rng, self._draw_atoms(rng, n_decoys))
+        decoys = pd.DataFrame({"metabolite": np.char.add("D", np.arange(n_decoys).astype(str)),
+                               "rt": rng.uniform(0, metabolite_rt.max(initial=1.0), size=n_decoys),
+                               "formula": decoy_formulas,
+                               "charge": self.charge})
+        return pd.concat([database, decoys], ignore_index=True)
+
+    def save(self, directory:str | Path, name:str=None) -> tuple[Path, Path]:
+        """
+        Write the dataset (tab-separated) and the database (semicolon-separated) in the formats read by IoHandler.
+
+        :param directory: Output directory.
+        :param name: Base name of the files. Defaults to "synthetic_<n_features>".
+        :return: paths of the dataset and database files.
+        """
+        if self.dataset is None:
+            self.generate()
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        name = name or f"synthetic_{self.n_features}"
+        dataset_path, database_path = directory / f"{name}.txt", directory / f"{name}_database.csv"
+        self.dataset.to_csv(dataset_path, sep="\t", index=False)
+        self.database.to_csv(database_path, sep=";", index=False)
+        return dataset_path, database_path
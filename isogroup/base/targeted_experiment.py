@@ -1,8 +1,11 @@
 from __future__ import annotations
+import numpy as np
 import pandas as pd
 from isogroup.base.experiment import Experiment
 from isogroup.base.cluster import Cluster
 from isogroup.base.database import Database
+from isogroup.base.metrics import PipelineMetrics
+from isogroup.base.trace import DecisionTrace
 import logging
 import time
 
@@ -14,21 +17,33 @@ class TargetedExperiment(Experiment):
     Used to group and annotate detected features from an experimental dataset using a reference database with isotopic tracer information.
     """
 
-    def __init__(self, dataset:pd.DataFrame, tracer:str, ppm_tol:float, rt_tol:float, database:pd.DataFrame):
+    def __init__(self, dataset:pd.DataFrame, tracer:str, ppm_tol:float, rt_tol:float, database:pd.DataFrame, database_cache=None, database_source=None, n_jobs:int=1, metrics:PipelineMetrics=None, trace:DecisionTrace=None):
         """
         :param dataset: DataFrame containing experimental data with columns for m/z, retention time (RT), feature ID and sample intensities.
+                        A FeatureTable already loaded (e.g. by IoHandler.read_feature_table) is also accepted.
         :param tracer: Tracer code used in the experiment (e.g. "13C").
         :param ppm_tol: m/z tolerance (in ppm).
         :param rt_tol: Retention time tolerance.
         :param database: DataFrame containing theoretical features with columns retention time (RT), metabolite names, and formulas.
+        :param database_cache: Directory of the compiled database cache. If None, the database is compiled at each run.
+        :param database_source: Path of the file the database was read from, used as cache key instead of the database content.
+        :param n_jobs: Number of processes used to match the features against the database (-1 uses all the CPUs). Results do not depend on it.
+        :param metrics: Metrics in which the stages of the pipeline are recorded. If None, new metrics are created.
+        :param trace: Trace in which the features annotated and the clusters identified are recorded. If None, they are not traced.
         """
-        super().__init__(dataset = dataset, tracer=tracer, ppm_tol=ppm_tol, rt_tol=rt_tol, database=database)
-        self.database = Database(dataset=database, 
-                                 tracer=self._tracer,
-                                 tracer_element=self.tracer_element)
+        super().__init__(dataset = dataset, tracer=tracer, ppm_tol=ppm_tol, rt_tol=rt_tol, database=database, metrics=metrics, trace=trace)
+        with self.metrics.stage("compile_database"):
+            self.database = Database(dataset=database, 
+                                     tracer=self._tracer,
+                                     tracer_element=self.tracer_element,
+                                     cache_dir=database_cache,
+                                     source=database_source)
         
+        self.n_jobs = n_jobs
         self.all_features_df = None
         self.all_clusters_df = None
+        self.metabolite_rows = {} # {metabolite_name: rows of the features annotated with it}, filled by annotate_features
+        self.row_clusters = {} # {row: ids of the clusters containing the feature}, filled by clusterize
         # self.ppm_tol = ppm_tol
         # self.rt_tol = rt_tol
 
@@ -44,51 +59,61 @@ class TargetedExperiment(Experiment):
         - Initializing Feature objects from the dataset.
         - Matching experimental features to the database within specified tolerances.
         - Clustering features by metabolite names.
+
+        The time, memory and item counts of each step are recorded in `self.metrics`.
         """
         start_time = time.time()
         
-        self.initialize_experimental_features()
-        self.annotate_features()
-        self.clusterize()
+        with self.metrics.stage("initialize_features"):
+            self.initialize_experimental_features()
+        with self.metrics.stage("annotate_features"):
+            self.annotate_features()
+        with self.metrics.stage("clusterize"):
+            self.clusterize()
         
-        self.create_features_df()
-        self.create_clusters_df()
+        with self.metrics.stage("create_dataframes"):
+            self.create_features_df()
+            self.create_clusters_df()
 
         total_time = time.time() - start_time
 
         logger.info(f"Targeted grouping completed in {total_time:.2f} seconds.")
+        self.metrics.log(logger)
 
     def annotate_features(self):
         """
         Annotate experimental features by matching them with the database 
         features within specified m/z and retention time tolerances.
-
+        Matching only depends on the m/z and retention time of the features, so it is done once per feature 
+        and shared by all samples. Only the database features of the ppm window of each feature are tested (see Database.match).
         """
         logger.info("Find matches between experimental features and database features...")
         
-        nb_features_annotated = 0 
-
-        for features_id in self.features.values():
-            for feature in features_id.values():    
-                for db_feature in self.database.theoretical_features:
-                    # Calculate the exact mz and rt errors
-                    mz_error = (db_feature.mz - feature.mz)
-                    rt_error = (db_feature.rt - feature.rt)
-                    # Covert mz_error to ppm 
-                    mz_error = (mz_error / feature.mz) * 1e6
-
-                    # Check if the experimental feature is within tolerance
-                    if abs(mz_error) <= self.ppm_tol and abs(rt_error) <= self.rt_tol:
-                        feature.chemical.append(db_feature.chemical[0])
-                        # feature.isotopologue.append(db_feature.isotopologue[0])
-                        feature.cluster_isotopologue[db_feature.chemical[0].label] = db_feature.cluster_isotopologue[db_feature.chemical[0].label]
-                        feature.metabolite.append(db_feature.chemical[0].label)
-                        feature.formula.append(db_feature.chemical[0].formula)
-                        feature.mz_error.append(mz_error)
-                        feature.rt_error.append(rt_error)
-                        nb_features_annotated += 1
-                        logger.debug(f"Feature {feature.feature_id} in sample {feature.sample} annotated with {db_feature.chemical[0].label} (isotopologue: {db_feature.cluster_isotopologue[db_feature.chemical[0].label]})")
-                        logger.debug(f" - mz error (ppm): {mz_error}, rt error: {rt_error}")
+        table = self.table
+        compiled = self.database.compiled
+        self.metabolite_rows = {}
+        rows, positions, mz_errors, rt_errors = self.database.match(table.mz, table.rt, self.ppm_tol, self.rt_tol, n_jobs=self.n_jobs)
+
+        for row, position, mz_error, rt_error in zip(rows.tolist(), positions.tolist(), mz_errors.tolist(), rt_errors.tolist()):
+            chemical = self.database.get_chemical(int(compiled["compound"][position]))
+            isotopologue = int(compiled["isotopologue"][position])
+            annotation = table.annotation(row)
+            annotation.chemical.append(chemical)
+            annotation.cluster_isotopologue[chemical.label] = isotopologue
+            annotation.metabolite.append(chemical.label)
+            annotation.formula.append(chemical.formula)
+            annotation.mz_error.append(mz_error)
+            annotation.rt_error.append(rt_error)
+            # Matches are sorted by row, so a row is already the last one of the list if it matched the metabolite before
+            metabolite_rows = self.metabolite_rows.setdefault(chemical.label, [])
+            if not metabolite_rows or metabolite_rows[-1] != row:
+                metabolite_rows.append(row)
+            if self.trace:
+                self.trace.record("feature_annotated", feature=table.feature_id[row], metabolite=chemical.label,
+                                  isotopologue=isotopologue, mz_error=mz_error, rt_error=rt_error)
+        nb_features_annotated = len(rows)
+        self.metrics.count("matches", nb_features_annotated)
+        self.metrics.count("features_annotated", len(np.unique(rows)))
         
         logger.info(f"    => {nb_features_annotated} experimental features matched with database features.\n")
         
@@ -96,49 +121,39 @@ class TargetedExperiment(Experiment):
     def clusterize(self):
         """
         Group features by metabolite names within each sample and assign a unique cluster ID to each group.
+        Clusters are read from the metabolite index (`self.metabolite_rows`) filled by annotate_features.
         Populates `self.clusters` as a dictionary of the form:
         {sample_name: {cluster_id: Cluster object}}
         """
-        # cluster_names = []
-        
-        # # Group features by metabolite
-        # for sample in self.features.values():
-        #     for feature in sample.values():
-        #         cluster_names += feature.metabolite
-        
-        # # cluster_names = set(cluster_names)
-
-         # Create unique clusters
-        # # # self.clusters = {}
         logger.info("Grouping features by metabolite names...")
         
-        cluster_names = []
-
-        for _, features in self.features.items():
-            for feature in features.values():
-                cluster_names += [metabolite_name for metabolite_name in feature.metabolite 
-                                  if metabolite_name not in cluster_names]
-
-        for sample in self.features.keys():
+        table = self.table
+        # Metabolites are indexed in the order in which they were first matched
+        cluster_names = list(self.metabolite_rows)
+
+        # Features of a cluster are the same in every sample, only their intensities change
+        cluster_rows = {}
+        self.row_clusters = {}
+        for index, clusters in enumerate(cluster_names):
+            # Sort features by isotopologues
+            rows = sorted(self.metabolite_rows[clusters], key=lambda row: table.annotation(row).cluster_isotopologue[clusters])
+            # Assign the cluster_id to the features in the cluster
+            for row in rows:
+                table.annotation(row).in_cluster.append(f"C{index}")
+                self.row_clusters.setdefault(row, []).append(f"C{index}")
+            cluster_rows[clusters] = rows
+            if self.trace:
+                self.trace.record("cluster_identified", cluster=f"C{index}", metabolite=clusters, features=table.feature_id[rows])
+
+        for sample in table.samples:
             self.clusters[sample] = {}
             for index, clusters in enumerate(cluster_names):
-                features = self.get_features_from_name(clusters, sample)
-                
-                # Sort features by isotopologues
-                # features.sort(key=lambda f: f.isotopologue)
-                features.sort(key=lambda f: f.cluster_isotopologue[clusters])
-                # Assign the cluster_id to the features in the cluster
-                for feature in features:
-                    if not hasattr(feature, "in_cluster") or feature.in_cluster is None:
-                        feature.in_cluster = [] 
-                    feature.in_cluster.append(f"C{index}")  
-
+                features = table.sample_features(sample, cluster_rows[clusters])
                 self.clusters[sample][clusters] = Cluster(features=features, cluster_id=f"C{index}", name=clusters)
-                logger.debug(f"Cluster C{index} ({clusters}) identified with {len(features)} features in sample {sample}.")
-                logger.debug(f"    {[features.feature_id for features in features]} ")
         
+        self.metrics.count("clusters_formed", len(cluster_names))
         logger.info(f"    => {len(cluster_names)} clusters identified.\n")
-    
+
     def get_features_from_name(self, name:str, sample_name:str):
         """
         Retrieve all features in a given sample that are annotated with a specific metabolite name.
@@ -148,11 +163,7 @@ class TargetedExperiment(Experiment):
 
         :return: List of Feature objects that match the metabolite name in the specified sample
         """
-        features = []
-        for feature in self.features[sample_name].values():
-            if name in feature.metabolite:
-                features.append(feature)
-        return features
+        return self.table.sample_features(sample_name, self.metabolite_rows.get(name, []))
 
     def get_clusters_from_name(self, name, sample_name:str):
         """
@@ -163,77 +174,107 @@ class TargetedExperiment(Experiment):
 
         :return: Cluster object if found, None otherwise
         """
-        for cluster in self.clusters[sample_name].values():
-            if cluster.name == name:
-                return cluster
-        return None
+        return self.clusters[sample_name].get(name)
     
     def create_clusters_df(self): #sample_name = None):
         """
         Create and store a dataframe containing all clusters.
+        The clusters containing each feature are read from the index filled by clusterize, and the dataframe is built column-wise.
         """
         # all_samples = list(self.features.keys())
         # if sample_name is not None:
         #     if sample_name not in all_samples:
         #         raise ValueError(f"Sample {sample_name} not found in annotated clusters. Available samples: {', '.join(all_samples)}")
         
-        cluster_data = []
-        for clusters in self.clusters.values():
-            # if sample_name is None or sample_name == sample: # Filter the DataFrame by sample name if provided
-                # print(clusters.name)
-            # for cname, cluster in clusters.items():
+        table = self.table
+        # Values shared by the features of a cluster are stored once per cluster
+        cluster_ids, names, statuses, missing, duplicated = [], [], [], [], []
+        rows, cols, cluster_pos = [], [], []
+        isotopologue, mz_error, rt_error, potential_metabolite, in_another_cluster = [], [], [], [], []
+
+        for sample, clusters in self.clusters.items():
+            col = table.sample_index[sample]
             for cluster in clusters.values():
-                # print(cluster.name)
-                for feature in cluster.features:
-                    idx = [index for index,metabolite in enumerate(feature.metabolite) if metabolite == cluster.name][0]
-                        # Get the cluster_id of the features in another cluster
-                    # other_clusters = [c.cluster_id for cluster_name, c in clusters.items() if feature in c.features and c.cluster_id != cluster.cluster_id]
-                    # print(other_clusters)
-                    cluster_data.append({
-                        "cluster_id": cluster.cluster_id,
-                        "metabolite": cluster.name,
-                        "feature_id": feature.feature_id,
-                        "mz": feature.mz,
-                        "rt": feature.rt,
-                        "feature_potential_metabolite": feature.metabolite,
-                        # "isotopologue": feature.isotopologue[idx],
-                        "isotopologue": feature.cluster_isotopologue[cluster.name],
-                        "mz_error": feature.mz_error[idx],
-                        "rt_error": feature.rt_error[idx],
-                        "sample": feature.sample,
-                        "intensity": feature.intensity,
-                        "status": cluster.status,
-                        "missing_isotopologue": cluster.missing_isotopologues,
-                        "duplicated_isotopologue": cluster.duplicated_isotopologues,
-                        # "in_cluster": feature.in_cluster,
-                        "in_another_cluster": [c.cluster_id for c in clusters.values() if feature in c.features and c.cluster_id != cluster.cluster_id]
-                    })
-
+                cluster_rows = [feature.row for feature in cluster.features]
+                cluster_pos += [len(cluster_ids)] * len(cluster_rows)
+                cluster_ids.append(cluster.cluster_id)
+                names.append(cluster.name)
+                statuses.append(cluster.status)
+                missing.append(cluster.missing_isotopologues)
+                duplicated.append(cluster.duplicated_isotopologues)
+                rows += cluster_rows
+                cols += [col] * len(cluster_rows)
+                for row in cluster_rows:
+                    annotation = table.annotation(row)
+                    # Errors of the annotation matching the cluster metabolite
+                    idx = annotation.metabolite.index(cluster.name)
+                    isotopologue.append(annotation.cluster_isotopologue[cluster.name])
+                    mz_error.append(annotation.mz_error[idx])
+                    rt_error.append(annotation.rt_error[idx])
+                    potential_metabolite.append(annotation.metabolite)
+                    # Get the cluster_id of the features in another cluster
+                    in_another_cluster.append([c for c in self.row_clusters.get(row, []) if c != cluster.cluster_id])
+
+        if not rows:
+            self.all_clusters_df = pd.DataFrame()
+            return
+
+        rows = np.array(rows, dtype=np.int64)
+        cols = np.array(cols, dtype=np.int64)
         # Create a DataFrame to summarize the annotated clusters
-        self.all_clusters_df= pd.DataFrame(cluster_data)
+        self.all_clusters_df = pd.DataFrame({
+            "cluster_id": self._take_categorical(cluster_ids, cluster_pos),
+            "metabolite": self._take_categorical(names, cluster_pos),
+            "feature_id": table.feature_id[rows],
+            "mz": table.mz[rows],
+            "rt": table.rt[rows],
+            "feature_potential_metabolite": self._object_column(potential_metabolite),
+            "isotopologue": np.array(isotopologue, dtype=np.int64),
+            "mz_error": np.array(mz_error, dtype=np.float64),
+            "rt_error": np.array(rt_error, dtype=np.float64),
+            "sample": pd.Categorical.from_codes(cols, categories=table.samples),
+            "intensity": table.intensities[rows, cols],
+            "status": self._take_categorical(statuses, cluster_pos),
+            "missing_isotopologue": self._object_column(missing)[cluster_pos],
+            "duplicated_isotopologue": self._object_column(duplicated)[cluster_pos],
+            "in_another_cluster": self._object_column(in_another_cluster),
+        })
     
     def create_features_df(self):  #sample_name = None):
         """
         Create and store a dataframe containing all features.
+        Columns are built once from the feature table and repeated for each sample. List-valued columns hold the lists
+        of the annotations, shared by the rows of the same feature.
         """
-        feature_data = []
-        for all_features in self.features.values():
-            for feature in all_features.values():
-                feature_data.append({
-                    "feature_id": feature.feature_id,
-                    "mz": feature.mz,
-                    "rt": feature.rt,
-                    "metabolite": feature.metabolite,
-                    # "isotopologue": feature.isotopologue,
-                    "isotopologue": [feature.cluster_isotopologue[met] for met in feature.metabolite],
-                    "mz_error": feature.mz_error,
-                    "rt_error": feature.rt_error,
-                    "sample": feature.sample,
-                    "intensity": feature.intensity
-                })
-
-        # Create a DataFrame to summarize the annotated data
-        self.all_features_df = pd.DataFrame(feature_data)
+        table = self.table
+        nb_samples = len(table.samples)
+
+        metabolite, isotopologue, mz_error, rt_error = [], [], [], []
+        for row in range(len(table)):
+            annotation = table.get_annotation(row)
+            if annotation is None:
+                metabolite.append([])
+                isotopologue.append([])
+                mz_error.append([])
+                rt_error.append([])
+                continue
+            metabolite.append(annotation.metabolite)
+            isotopologue.append([annotation.cluster_isotopologue[met] for met in annotation.metabolite])
+            mz_error.append(annotation.mz_error)
+            rt_error.append(annotation.rt_error)
+
+        # Create a DataFrame to summarize the annotated data (one block of rows per sample)
+        self.all_features_df = pd.DataFrame({
+            "feature_id": np.tile(table.feature_id, nb_samples),
+            "mz": np.tile(table.mz, nb_samples),
+            "rt": np.tile(table.rt, nb_samples),
+            "metabolite": np.tile(self._object_column(metabolite), nb_samples),
+            "isotopologue": np.tile(self._object_column(isotopologue), nb_samples),
+            "mz_error": np.tile(self._object_column(mz_error), nb_samples),
+            "rt_error": np.tile(self._object_column(rt_error), nb_samples),
+            "sample": self._sample_column(table.samples, len(table)),
+            "intensity": table.intensities.T.ravel()
+        })
         
     
         # # Export the Dataframe of only one sample if a sample name is provided
@@ -0,0 +1,81 @@
+from __future__ import annotations
+from pathlib import Path
+import json
+import numpy as np
+
+
+def _to_json(value):
+    """
+    Conversion of the NumPy values and sets found in trace records to JSON types.
+
+    :param value: Value not serializable by the json module.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class DecisionTrace:
+    """
+    Optional structured trace of the per-item decisions of the pipelines (feature annotated, cluster formed, removed,
+    renamed...), written as JSON Lines ({"event": ..., fields...} per line) through a buffered file.
+
+    A trace without path is disabled and evaluates to False, so that the records of a hot loop are only built when
+    tracing is enabled:
+
+        if self.trace:
+            for row in rows:
+                self.trace.record("feature_annotated", feature=table.feature_id[row], ...)
+    """
+
+    def __init__(self, path:str | Path=None, buffer_size:int=2**20):
+        """
+        :param path: Path of the JSON Lines file. If None, tracing is disabled.
+        :param buffer_size: Size of the write buffer (in bytes).
+        """
+        self.path = None if path is None else Path(path)
+        self._file = None if path is None else open(path, "w", buffering=buffer_size)
+        self._encode = json.JSONEncoder(separators=(",", ":"), default=_to_json).encode
+
+    def __bool__(self) -> bool:
+        return self._file is not None
+
+    def __enter__(self) -> DecisionTrace:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, event:str, **fields):
+        """
+        Write a record to the trace (nothing is done if tracing is disabled).
+
+        :param event: Name of the event (e.g. "cluster_formed").
+        :param fields: Fields of the record; NumPy values and sets are converted to JSON types.
+        """
+        if self._file is not None:
+            self._file.write(self._encode({"event": event, **fields}))
+            self._file.write("\n")
+
+    def close(self):
+        """
+        Flush and close the trace file. The trace is disabled afterwards.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @staticmethod
+    def read(path:str | Path) -> list:
+        """
+        Read the records of a trace file.
+
+        :param path: Path of the JSON Lines file.
+        :return: list of records (dicts).
+        """
+        with open(path) as f:
+            return [json.loads(line) for line in f]
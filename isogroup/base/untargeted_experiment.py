@@ -2,12 +2,15 @@ from __future__ import annotations
 from isogroup.base.experiment import Experiment
 import isogroup.enhancer.unlabeled_enhancer as unlabeled_enhancer 
 import isogroup.enhancer.labeled_enhancer as labeled_enhancer
-import bisect
 from collections import defaultdict
+from isogroup.base.candidate_search import CandidateSearch
 from isogroup.base.cluster import Cluster
+from isogroup.base.metrics import PipelineMetrics
 from isogroup.base.misc import Misc
+from isogroup.base.trace import DecisionTrace
 import logging
 import time
+import numpy as np
 import pandas as pd
 
 logger = logging.getLogger(f"IsoGroup")
@@ -20,17 +23,32 @@ class UntargetedExperiment(Experiment):
 
     """
 
-    def __init__(self, dataset:pd.DataFrame, tracer:str, ppm_tol:float, rt_tol:float, max_atoms:int = None, keep:str=None) : #  keep_best_candidate: bool = False, #  keep_richest: bool = False,
+    def __init__(self, dataset:pd.DataFrame, tracer:str, ppm_tol:float, rt_tol:float, max_atoms:int = None, keep:str=None, mask_missing:bool=False, engine:str="star", n_jobs:int=1, partition_size:int=None, metrics:PipelineMetrics=None, trace:DecisionTrace=None) : #  keep_best_candidate: bool = False, #  keep_richest: bool = False,
         """
         :param dataset: DataFrame containing experimental data with columns for m/z, retention time (RT), feature ID and sample intensities.
+                        A FeatureTable already loaded (e.g. by IoHandler.read_feature_table) is also accepted.
         :param tracer: Tracer code used in the experiment (e.g. "13C").
         :param ppm_tol: m/z tolerance in ppm.
         :param rt_tol: Retention time tolerance in seconds.
         :param max_atoms: Maximum number of tracer atoms to consider for isotopologues. If None, IsoGroup automatically estimates the maximum number of isotopologues based on the feature m/z and tracer element.
         :param keep: Strategy to keep clusters during deduplication. Options are "longest", "closest_mz", "both". By default, "all" (all clusters are kept).
+        :param mask_missing: If True, features with a null intensity in a sample are left out of the clusters of this sample, and the clusters
+                             listed for each feature in the dataframes are those of the sample. By default, clusters are identical in all samples.
+        :param engine: Clustering engine. "star" (default) builds one cluster around each feature from its candidate isotopologues, 
+                       and relies on deduplication to merge overlapping clusters. "graph" links features one tracer shift apart and 
+                       extracts each isotopic ladder (connected component) once, so clusters never overlap; `max_atoms` is not used.
+                       Ladders are chained without size or RT span limit, so co-eluting compounds on the same ladder form one cluster.
+        :param n_jobs: Number of processes used for the candidate search (-1 uses all the CPUs). Results do not depend on it.
+        :param partition_size: Number of features per retention time partition of the candidate search. Partitions are searched
+                               one at a time, with a halo of rt_tol on each side, and give the same clusters as a global search.
+                               If None (default), the search is global.
+        :param metrics: Metrics in which the stages of the pipeline are recorded. If None, new metrics are created.
+        :param trace: Trace in which the clusters formed, removed and renamed are recorded. If None, they are not traced.
         """
+        if engine not in ("star", "graph"):
+            raise ValueError(f"Unknown clustering engine '{engine}'. Options are 'star' and 'graph'.")
 
-        super().__init__(dataset= dataset, tracer=tracer, ppm_tol=ppm_tol, rt_tol=rt_tol, max_atoms=max_atoms)
+        super().__init__(dataset= dataset, tracer=tracer, ppm_tol=ppm_tol, rt_tol=rt_tol, max_atoms=max_atoms, metrics=metrics, trace=trace)
         self.mode = "untargeted"
         # self.dataset = dataset
         # self.features = features
@@ -45,7 +63,12 @@ class UntargetedExperiment(Experiment):
         self.keep = keep # Keep strategy: "longest", "closest_mz", "both". By default, "All" (all clusters are kept).
         # self.keep_best_candidate = keep_best_candidate
         # self.keep_richest = keep_richest
+        self.mask_missing = mask_missing
+        self.engine = engine
+        self.n_jobs = n_jobs
+        self.partition_size = partition_size
 
+        self.cluster_rows = {} # {cluster_id: rows of the features in the feature table}, shared by all samples
         self.unclustered_features = {}  # {sample_name: [Feature objects]}
         self.subsets_removed = None 
         
@@ -61,6 +84,7 @@ class UntargetedExperiment(Experiment):
     def run_untargeted_pipeline(self, unlabaled_sample=None, fully_labeled_sample=None):
         """
         Complete pipeline to build and deduplicate clusters from the dataset with logging and timing.
+        The time, memory and item counts of each step are recorded in `self.metrics`.
 
         :param enhancing_mode: Mode used to enhance the dataset. Accepted values are "unlabeled" 
                                 or "fully labeled". If None, no enhancement is applied. Defaults to None.
@@ -72,7 +96,8 @@ class UntargetedExperiment(Experiment):
         # logger.info(f"Starting untargeted clustering pipeline at {start_dt}")
 
         # --- Initialization of features ---
-        self.initialize_experimental_features()
+        with self.metrics.stage("initialize_features"):
+            self.initialize_experimental_features()
     
         # print(" Initializing features...", end=" ", flush=True)
         # t0 = time.time()
@@ -88,22 +113,27 @@ class UntargetedExperiment(Experiment):
         # t0 = time.time()
         # logger.info(f"Built clusters with RT window: {self.rt_tol} sec, m/z tolerance: {self.mz_tol} ppm, max atoms: {self.max_atoms}")
         logger.info("Building clusters...")
-        self.build_clusters(self.rt_tol, self.ppm_tol, self.max_atoms)
+        with self.metrics.stage("build_clusters"):
+            self.build_clusters(self.rt_tol, self.ppm_tol, self.max_atoms)
         logger.info(f"  => {len(next(iter(self.clusters.values())))} clusters formed per sample.\n")
 
         # clusters_count = len(next(iter(self.clusters.values())))  
         # print(f" done ({clusters_count} clusters per sample)")
         # --- Deduplication and cleaning of clusters ---
-        self.deduplicate_clusters(self.keep)
-        self.create_features_df()
-        self.create_clusters_df()
+        with self.metrics.stage("deduplicate_clusters"):
+            self.deduplicate_clusters(self.keep)
+        with self.metrics.stage("create_dataframes"):
+            self.create_features_df()
+            self.create_clusters_df()
 
         # if enhancing_mode == "unlabeled":
         if unlabaled_sample:
-           self.unlabeled_enhancer(self.all_clusters_df, unlabaled_sample)
+            with self.metrics.stage("unlabeled_enhancer"):
+                self.unlabeled_enhancer(self.all_clusters_df, unlabaled_sample)
         # if enhancing_mode == "fully_labeled":
         if fully_labeled_sample:
-            self.fully_labeled_enhancer(self.all_clusters_df, fully_labeled_sample)
+            with self.metrics.stage("fully_labeled_enhancer"):
+                self.fully_labeled_enhancer(self.all_clusters_df, fully_labeled_sample)
         # print(" Cleaning clusters...", end=" ", flush=True)
         # t0 = time.time()
         # merged, subset_removed, final, unclustered = self.deduplicate_clusters(keep_best_candidate=keep_best_candidate, keep_richest=keep_richest)
@@ -121,6 +151,7 @@ class UntargetedExperiment(Experiment):
         # self.logger.info(f"Pipeline completed in {total_time:.2f} seconds.")
 
         logger.info(f"Untargeted grouping completed in {total_time:.2f} seconds.")
+        self.metrics.log(logger)
 
         # --- Verbose logging to file ---
         # if verbose:
@@ -146,6 +177,8 @@ class UntargetedExperiment(Experiment):
     def build_clusters(self, rt_tol: float, ppm_tol: float, max_atoms: int = None):
         """
         Group features into potential isotopologue clusters based on retention time proximity and m/z differences.
+        The m/z and retention times are shared by all samples, so the clusters are built once from the feature table
+        and then projected onto every sample.
         :param rt_tol: Retention time window for clustering.
         :param ppm_tol: m/z tolerance in parts per million for clustering.
         :param max_atoms: Maximum number of tracer atoms to consider for isotopologues. If None, IsoGroup automatically estimates 
@@ -158,148 +191,166 @@ class UntargetedExperiment(Experiment):
             logger.error("Features must be initialized before building clusters.")
             raise ValueError("Features must be initialized before building clusters.")
             
+        table = self.table
+        # Features sorted by retention time. With RT partitions, m/z and retention times are gathered one partition at a time
+        rt_order = np.argsort(table.rt, kind="stable")
         
-        # self.clusters = {}
-        for sample_name, features in self.features.items():
-            all_features = sorted(features.values(), key=lambda f: f.rt)
-            rts = [f.rt for f in all_features]
-            
-            clusters = {}
-            
-            cluster_id_local = 0
+        search = CandidateSearch(mzshift_tracer=self.mzshift_tracer, 
+                                 tracer_element=self.tracer_element,
+                                 rt_tol=rt_tol, 
+                                 ppm_tol=ppm_tol, 
+                                 max_atoms=max_atoms,
+                                 n_jobs=self.n_jobs)
+        if self.engine == "graph":
+            # --- Extract each isotopic ladder once from the isotopic-adjacency graph ---
+            labels = search.ladder_components(table.rt, table.mz, self.partition_size, order=rt_order)
+            clusters = self._assemble_components(rt_order, labels)
+            self.metrics.count("components", len(np.unique(labels)))
+        else:
+            # --- Find candidate isotopologues of every feature within its RT window ---
+            base_pos, candidate_pos = search.partitioned_pairs(table.rt, table.mz, self.partition_size, order=rt_order)
+            clusters = self._assemble_clusters(rt_order[base_pos], rt_order[candidate_pos])
+            self.metrics.count("candidate_pairs", len(base_pos))
+        self.metrics.count("clusters_formed", len(clusters))
+        self.set_clusters(clusters)
+
+    def set_clusters(self, clusters:dict):
+        """
+        Set the sample-independent clusters of the experiment (before deduplication) and project them onto every sample.
+
+        :param clusters: dict {cluster_id: rows of the features sorted by m/z}
+        """
+        table = self.table
+        self.cluster_rows = clusters
+        self.clusters = self._project_clusters(clusters)
         
-            # For each feature, find potential isotopologues within the RT window
-            for base_feature in all_features:
-                # logger.debug(f" => Feature {base_feature.feature_id} (m/z: {base_feature.mz}, rt: {base_feature.rt})")
-                
-                # --- Find candidates within the RT window ---
-                left_bound = bisect.bisect_left(rts, base_feature.rt - rt_tol)
-                right_bound = bisect.bisect_right(rts, base_feature.rt + rt_tol)
-                # logger.debug(f" ---- Candidates within RT window: {base_feature.rt - rt_tol} - {base_feature.rt + rt_tol} sec ----")
-                candidates = all_features[left_bound:right_bound]
-                
-                potential_group = {base_feature}
-                # logger.debug(f" {[candidate.feature_id for candidate in candidates]} \n")
-
-                # --- Identification of candidates for isotopologues ---
-                for candidate in candidates:
-                    if candidate == base_feature:
-                        continue
-                    
-                    # iso_index = round((candidate.mz - base_feature.mz) / self.mzshift_tracer)
-                    iso_index = Misc.calculate_isotopologue_index(candidate.mz, base_feature.mz, self.mzshift_tracer)
-                    # Define a maximum number of tracer atoms if specified
-                    max_iso = Misc.get_max_isotopologues_for_mz(base_feature.mz, self.tracer_element) if max_atoms is None else max_atoms
-                    
-                    if abs(iso_index) > max_iso:
-                        continue
-                    
-                    expected_mz = base_feature.mz + iso_index * self.mzshift_tracer
-                    delta_ppm = abs(expected_mz - candidate.mz) / expected_mz * 1e6
-
-                    if delta_ppm <= ppm_tol:
-                        potential_group.add(candidate)         
-                    # logger.debug(f"    => Candidate {candidate.feature_id} matched as potential isotopologue M+{abs(iso_index)} (m/z: {candidate.mz}, rt: {candidate.rt}, delta ppm: {delta_ppm:.2f})")
-
-                # --- If a group of isotopologues is found, create a cluster ---
-                if len(potential_group) > 1:
-                    cluster_id = f"C{cluster_id_local}"
-                    group_sorted = sorted(list(potential_group), key=lambda f: f.mz)
-                
-                    # for f in group_sorted:
-                    #     # iso_index = round((f.mz - group_sorted[0].mz) / self.mzshift_tracer) 
-                    #     iso_index = Misc.calculate_isotopologue_index(f.mz, group_sorted[0].mz, self.mzshift_tracer) # Theoretical isotopologue index
-                    #     iso_label_tmp = "Mx" if iso_index == 0 else f"M+{iso_index}"
-                
-                    #     f.cluster_isotopologue[cluster_id] = iso_label_tmp # Specific to clusters
-                    #     # if cluster_id not in f.in_cluster:
-                    #     #     f.in_cluster.append(cluster_id)
-
-                    clusters[cluster_id] = Cluster(cluster_id=cluster_id, features=group_sorted)
-                    cluster_id_local += 1
-
-                self.clusters[sample_name] = clusters  
+        if self.trace:
+            for cluster_id, cluster_rows in clusters.items():
+                self.trace.record("cluster_formed", cluster=cluster_id, features=table.feature_id[cluster_rows],
+                                  mz=table.mz[cluster_rows], rt=table.rt[cluster_rows])
+
+    def _assemble_clusters(self, base_rows:np.ndarray, candidate_rows:np.ndarray) -> dict:
+        """
+        Create one cluster per base feature from its candidate isotopologues.
+        Pairs are expected to be grouped by base feature, in the order of increasing retention time of the base features.
+
+        :param base_rows: Rows of the base features of each candidate pair.
+        :param candidate_rows: Rows of the candidates of each candidate pair.
+        :return: dict {cluster_id: rows of the features sorted by m/z}
+        """
+        mzs = self.table.mz
+        clusters = {}
+        if not len(base_rows):
+            return clusters
         
-        for cluster_id, cluster in clusters.items():  
-            logger.debug(f" Cluster {cluster_id} formed with {len(cluster.features)} feature(s):")
-            # feature's id and retentions times in the same line 
-            for feature in cluster.features:
-                logger.debug(f"     => Feature {feature.feature_id} : m/z={feature.mz}, rt={feature.rt}")
+        # Boundaries of the groups of pairs sharing the same base feature
+        bounds = np.flatnonzero(base_rows[1:] != base_rows[:-1]) + 1
+        starts = np.concatenate(([0], bounds)).tolist()
+        stops = np.concatenate((bounds, [len(base_rows)])).tolist()
+        base_rows = base_rows.tolist()
+        candidate_rows = candidate_rows.tolist()
+
+        for cluster_id_local, (start, stop) in enumerate(zip(starts, stops)):
+            potential_group = [base_rows[start]] + candidate_rows[start:stop]
+            clusters[f"C{cluster_id_local}"] = sorted(potential_group, key=lambda row: mzs[row])
+        return clusters
+
+    def _assemble_components(self, rt_order:np.ndarray, labels:np.ndarray) -> dict:
+        """
+        Create one cluster per connected component of the isotopic-adjacency graph containing at least two features.
+        Clusters are numbered in the order of increasing retention time of their first feature.
+
+        :param rt_order: Rows of the features sorted by retention time.
+        :param labels: Component label of each feature, in retention time order (smallest position in the component).
+        :return: dict {cluster_id: rows of the features sorted by m/z}
+        """
+        mzs = self.table.mz
+        sizes = np.bincount(labels, minlength=len(labels))
+        in_ladder = np.flatnonzero(sizes[labels] > 1)
+        # Group the positions by label, labels being the positions of the first features of the components
+        order = in_ladder[np.argsort(labels[in_ladder], kind="stable")]
+        bounds = np.flatnonzero(np.diff(labels[order])) + 1
+        clusters = {}
+        for cluster_id_local, positions in enumerate(np.split(order, bounds) if len(order) else []):
+            clusters[f"C{cluster_id_local}"] = sorted(rt_order[positions].tolist(), key=lambda row: mzs[row])
+        return clusters
+
+    def _project_clusters(self, cluster_rows:dict) -> dict:
+        """
+        Build the Cluster objects of every sample from the sample-independent clusters.
+        If `mask_missing` is set, features with a null intensity in a sample are left out of the clusters of this sample,
+        and clusters left with less than two features are dropped for this sample.
+
+        :param cluster_rows: dict {cluster_id: rows of the features in the cluster}.
+        :return: dict {sample_name: {cluster_id: Cluster object}}
+        """
+        table = self.table
+        projected = {}
+        for sample in table.samples:
+            projected[sample] = {}
+            if self.mask_missing:
+                detected = table.intensities[:, table.sample_index[sample]] > 0
+            for cluster_id, rows in cluster_rows.items():
+                if self.mask_missing:
+                    rows = [row for row in rows if detected[row]]
+                    if len(rows) < 2:
+                        continue
+                projected[sample][cluster_id] = Cluster(cluster_id=cluster_id, features=table.sample_features(sample, rows))
+        return projected
 
     def _keep_longest_cluster(self, cluster:dict):
         """
         Retain only the longest cluster.
+        Clusters are processed from the largest to the smallest, and a cluster is removed if it is a strict subset of a
+        cluster already kept. Using an inverted index {row: kept clusters containing the row}, each cluster is only
+        compared with the kept clusters that contain its rarest feature.
 
-        :param cluster: cluster dictionary to process.
+        :param cluster: cluster dictionary to process ({cluster_id: rows of the features in the cluster}).
         """
-        self.subsets_removed = []
-        signatures = {cid: set(f.feature_id for f in c.features) for cid, c in cluster.items()}
+        self.subsets_removed = [] # [(removed rows, superset rows)]
+        signatures = {cid: frozenset(rows) for cid, rows in cluster.items()}
         sorted_clusters = sorted(signatures.items(), key=lambda x: len(x[1]), reverse=True)
         kept = []
-        # Compare from largest to smallest cluster to identify subsets
-        # If a smaller cluster is a subset of any kept larger cluster, mark it for removal
-        # logger.debug("      Clusters sorted by size:")
-        
+        kept_by_row = defaultdict(list) # {row: indices in kept of the clusters containing the row}, in kept order
+
         for cid, sig1 in sorted_clusters:
-            # logger.debug(f"         Cluster {cid} : {sig1}")
-            is_subset = False
-            for _, sig2 in kept:
-                if sig1 < sig2:
-                    is_subset = True
-                    self.subsets_removed.append(f"{sig1} removed (subset of {sig2})")
-                    del cluster[cid]
-                    break
-
-            if not is_subset:
-                kept.append((cid, sig1))
-
-        # logger.info(f"  => {len(self.subsets_removed)} subsets removed.")
-        
-        # for subset in self.subsets_removed:
-        #     logger.debug(f"        => {subset}")
-            
+            # Every superset of sig1 contains its rarest feature, so its posting list holds all the candidates
+            rarest = min(sig1, key=lambda row: len(kept_by_row.get(row, ())))
+            superset = next((kept[index] for index in kept_by_row.get(rarest, ()) if sig1 < kept[index]), None)
+            if superset is not None:
+                self.subsets_removed.append((sig1, superset))
+                del cluster[cid]
+                continue
+
+            for row in sig1:
+                kept_by_row[row].append(len(kept))
+            kept.append(sig1)
 
     def _keep_closest_mz_candidate(self, cluster:dict):
         """
         Keep only the feature closest to the expected m/z for each isotopologue in the cluster.
 
-        :param cluster: cluster dictionary to process.
+        :param cluster: cluster dictionary to process ({cluster_id: rows of the features in the cluster}).
         """
-        # logger.info("   Keeping closest m/z feature candidate for each isotopologues...\n")
-
         self.subsets_removed = {}
+        table = self.table
 
-        for cluster in cluster.values():
+        for cluster_id, rows in cluster.items():
             iso_to_candidate  = defaultdict(list)
-            base_mz = cluster.lowest_mz
-            # logger.debug(f"      Lowest mz in cluster {cluster.cluster_id} : {base_mz}")
-
-            for feature in cluster.features:
-                iso_index = Misc.calculate_isotopologue_index(feature.mz, base_mz, self.mzshift_tracer)
-                iso_to_candidate[iso_index].append(feature)
-                # logger.debug(f"         Isotopologue {iso_index} candidates: {(feature.feature_id, f'mz: {feature.mz}')}")
-
-                # cluster.features = [min(candidates, key=lambda f: abs(f.mz - (base_mz + index * self.mzshift_tracer))) for index, candidates in iso_to_candidate.items()]
-                
-                cluster_features = []
-                for index, candidates in iso_to_candidate.items():
-                    best_candidate = min(candidates, key=lambda f: abs(f.mz - (base_mz + index * self.mzshift_tracer)))
-                    cluster_features.append(best_candidate)
-                    # logger.debug(f"      => Keeping candidate {best_candidate.feature_id} for isotopologue {index} in cluster {cluster.cluster_id}")
-                    for f in candidates:
-                        if f not in cluster.features:
-                            self.subsets_removed[cluster.cluster_id] = {index: [f.feature_id]}
-                        else:
-                            continue    
-                cluster.features = cluster_features   
-                # for f in candidates:
-                #     if f not in cluster.features:
-                #        self.subsets_removed[cluster.cluster_id] = {index: [f.feature_id]}
-                #     else:
-                #         continue    
-                    
-        #             print(f"         => Removing candidate {f.feature_id} for isotopologue {index} in cluster {cluster.cluster_id}") 
-        # print(f"      => {len(f.feature_id)} candidate(s) removed in {len(cluster.cluster_id)} cluster(s).")        
+            base_mz = min(table.mz[row] for row in rows)
+
+            for row in rows:
+                iso_index = Misc.calculate_isotopologue_index(table.mz[row], base_mz, self.mzshift_tracer)
+                iso_to_candidate[iso_index].append(row)
+
+            cluster_rows = []
+            for index, candidates in iso_to_candidate.items():
+                best_candidate = min(candidates, key=lambda row: abs(table.mz[row] - (base_mz + index * self.mzshift_tracer)))
+                cluster_rows.append(best_candidate)
+                removed = [table.feature_id[row] for row in candidates if row != best_candidate]
+                if removed:
+                    self.subsets_removed.setdefault(cluster_id, {})[index] = removed
+            cluster[cluster_id] = cluster_rows
         
     def deduplicate_clusters(self, keep:str=None):
         """
@@ -308,43 +359,40 @@ class UntargetedExperiment(Experiment):
         - Removing clusters that are subsets of larger clusters (if keep is "longest").
         - Keeping only the best candidate feature for each isotopologue (if keep is "closest_mz").
         - Updating each feature's cluster memberships, isotopologue numbers, and also_in lists.
+        Deduplication is done once on the sample-independent clusters, which are then projected onto every sample.
 
         :param keep: Strategy for deduplication. Options are "longest" to keep the largest cluster,
                         "closest_mz" to retain only the feature with the highest intensity for each isotopologue within a cluster,
                         or "both" to apply both strategies. By default, all clusters are kept ("all").
         """
-    
+        table = self.table
         final_clusters = {}
         
         logger.info("Merging clusters...")
-        for sample, clusters in self.clusters.items():
-            merged = 0
-            final_clusters[sample] = {}
-            seen_signatures = {}
-
-            for cluster in clusters.values():
-                signature = frozenset(f.feature_id for f in cluster.features)
-                if signature not in seen_signatures:
-                    seen_signatures[signature] = cluster.cluster_id
-                    final_clusters[sample][cluster.cluster_id] = cluster
-                else:
-                    merged += 1
+        merged = 0
+        seen_signatures = {}
+
+        for cluster_id, rows in self.cluster_rows.items():
+            signature = frozenset(rows)
+            if signature not in seen_signatures:
+                seen_signatures[signature] = cluster_id
+                final_clusters[cluster_id] = rows
+            else:
+                merged += 1
             
+        self.metrics.count("clusters_merged", merged)
         logger.info(f"  => {merged} clusters deleted (merged) per sample.\n") 
         
-        new = {}
         if keep:
             logger.info(f"Deduplicating clusters based on specified strategy (keep '{keep}')...")
-        for sample, clusters in final_clusters.items():
-            new[sample] = {}
-            # --- Remove subset clusters ---
-            if keep == "longest":
-                self._keep_longest_cluster(final_clusters[sample])
-            elif keep =="closest_mz":
-                self._keep_closest_mz_candidate(final_clusters[sample])
-            elif keep == "both":
-                self._keep_longest_cluster(final_clusters[sample])
-                self._keep_closest_mz_candidate(final_clusters[sample])
+        # --- Remove subset clusters ---
+        if keep == "longest":
+            self._keep_longest_cluster(final_clusters)
+        elif keep =="closest_mz":
+            self._keep_closest_mz_candidate(final_clusters)
+        elif keep == "both":
+            self._keep_longest_cluster(final_clusters)
+            self._keep_closest_mz_candidate(final_clusters)
         
         if self.subsets_removed:
             if isinstance(self.subsets_removed, dict):
@@ -352,86 +400,153 @@ class UntargetedExperiment(Experiment):
                 for cluster_id, removed in self.subsets_removed.items():
                     for iso_index, features in removed.items():
                         feature_count += len(features)
-                        logger.debug(f"  => In cluster {cluster_id}, removed candidates for isotopologue {iso_index}: {features}")
+                        if self.trace:
+                            self.trace.record("candidates_removed", cluster=cluster_id, isotopologue=iso_index, features=features)
+                self.metrics.count("candidates_removed", feature_count)
                 logger.info(f"  => {feature_count} candidate(s) removed in {len(self.subsets_removed)} cluster(s).\n")
             else:
+                self.metrics.count("subsets_removed", len(self.subsets_removed))
                 logger.info(f"  => {len(self.subsets_removed)} subsets removed per sample.\n")
-                logger.debug("  Removed subsets:")
-                logger.debug(self.subsets_removed)
+                if self.trace:
+                    feature_id = self.table.feature_id
+                    for removed, superset in self.subsets_removed:
+                        self.trace.record("subset_removed", features=feature_id[list(removed)], superset=feature_id[list(superset)])
             
-        for sample, clusters in final_clusters.items():
-            # --- Assign final cluster_id, isotopologues label, in_cluster and also_in to features ---
-            features_to_clusters = defaultdict(set)       
-            for new_index, cluster in enumerate(final_clusters[sample].values()):
-                logger.debug(f" Cluster_id: {cluster.cluster_id}")
-                cluster.cluster_id = f"C{new_index}"
-                logger.debug(f" New index assigned: {cluster.cluster_id}")
-                new[sample][cluster.cluster_id] = cluster
-                for f in cluster.features:
-                    features_to_clusters[f.feature_id].add(cluster.cluster_id)
-        
-            for cluster in final_clusters[sample].values():
-                cluster.features.sort(key=lambda f: f.mz)
-                min_mz=cluster.lowest_mz
-                for f in cluster.features:
-                    iso_index = Misc.calculate_isotopologue_index(f.mz, min_mz, self.mzshift_tracer)
-                    iso_label = "Mx" if iso_index == 0 else f"Mx+{iso_index}"
-                    f.cluster_isotopologue[cluster.cluster_id] = iso_label
-                    f.in_cluster = list(features_to_clusters[f.feature_id])
-                    f.also_in[cluster.cluster_id] = [c for c in f.in_cluster if c != cluster.cluster_id]
+        # --- Assign final cluster_id, isotopologues label, in_cluster and also_in to features ---
+        new = {}
+        features_to_clusters = defaultdict(dict) # {feature_id: {cluster_id: None}}, in cluster order
+        for new_index, (cluster_id, rows) in enumerate(final_clusters.items()):
+            if self.trace:
+                self.trace.record("cluster_renamed", cluster=cluster_id, new_cluster=f"C{new_index}")
+            cluster_id = f"C{new_index}"
+            new[cluster_id] = sorted(rows, key=lambda row: table.mz[row])
+            for row in rows:
+                features_to_clusters[table.feature_id[row]][cluster_id] = None
+    
+        for cluster_id, rows in new.items():
+            min_mz = table.mz[rows[0]]
+            for row in rows:
+                iso_index = Misc.calculate_isotopologue_index(table.mz[row], min_mz, self.mzshift_tracer)
+                iso_label = "Mx" if iso_index == 0 else f"Mx+{iso_index}"
+                annotation = table.annotation(row)
+                annotation.cluster_isotopologue[cluster_id] = iso_label
+                annotation.in_cluster = list(features_to_clusters[table.feature_id[row]])
+                annotation.also_in[cluster_id] = [c for c in annotation.in_cluster if c != cluster_id]
     
-        self.clusters = new
+        self.cluster_rows = new
+        self.clusters = self._project_clusters(new)
         # Keep unclustered features for reference
-        for sample, features in self.features.items():
-            self.unclustered_features[sample] = [f for f in features.values() if not f.in_cluster]
-        # final = len(next(iter(self.clusters.values()))) if self.clusters else 0
-        # unclustered = sum(1 for f in next(iter(self.features.values())).values() if not f.in_cluster) if self.features else 0
+        unclustered_rows = [row for row in range(len(table)) 
+                            if table.get_annotation(row) is None or not table.get_annotation(row).in_cluster]
+        for sample in table.samples:
+            self.unclustered_features[sample] = table.sample_features(sample, unclustered_rows)
+        self.metrics.count("final_clusters", len(new))
+        self.metrics.count("unassigned_features", len(unclustered_rows))
 
 
     def create_features_df(self):
         """
         Create and store a dataframe containing all features.
+        Columns are built once from the feature table and repeated for each sample. List-valued columns hold the lists
+        of the annotations, shared by the rows of the same feature.
+        With `mask_missing`, the clusters of the features are taken from the clusters of each sample instead.
         """
-        all_features = []
-        for features in self.features.values():
-            for f in features.values():
-
-                all_features.append({
-                    "FeatureID": f.feature_id,
-                    "RT": f.rt,
-                    "m/z": f.mz,
-                    "sample": f.sample,
-                    "Intensity": f.intensity,
-                    "InClusters": f.in_cluster if f.in_cluster else ["None"],
-                    "Isotopologues": [f.cluster_isotopologue.get(cid, "N/A") for cid in f.in_cluster] if f.in_cluster else ["N/A"],
-                })
-
-        self.all_features_df = pd.DataFrame(all_features)      
+        table = self.table
+        nb_samples = len(table.samples)
+
+        # Clusters of the features in each sample, or once for all samples
+        memberships = [self._sample_memberships(sample) for sample in table.samples] if self.mask_missing else [None]
+        in_clusters, isotopologues = [], []
+        for membership in memberships:
+            for row in range(len(table)):
+                annotation = table.get_annotation(row)
+                if annotation is None:
+                    row_clusters = []
+                else:
+                    row_clusters = annotation.in_cluster if membership is None else membership.get(row, [])
+                if not row_clusters:
+                    in_clusters.append(["None"])
+                    isotopologues.append(["N/A"])
+                    continue
+                in_clusters.append(row_clusters)
+                isotopologues.append([annotation.cluster_isotopologue.get(cid, "N/A") for cid in row_clusters])
+        nb_repeats = 1 if self.mask_missing else nb_samples
+
+        self.all_features_df = pd.DataFrame({
+            "FeatureID": np.tile(table.feature_id, nb_samples),
+            "RT": np.tile(table.rt, nb_samples),
+            "m/z": np.tile(table.mz, nb_samples),
+            "sample": self._sample_column(table.samples, len(table)),
+            "Intensity": table.intensities.T.ravel(),
+            "InClusters": np.tile(self._object_column(in_clusters), nb_repeats),
+            "Isotopologues": np.tile(self._object_column(isotopologues), nb_repeats),
+        })
 
     def create_clusters_df(self):
         """
         Create and store a dataframe containing all clusters.
+        The dataframe is built column-wise, with categorical cluster ids, samples, isotopologue labels and text representations
+        of the also_in lists. With `mask_missing`, the other clusters of a feature are those of the sample.
         """
-        all_clusters = []
-        for clusters in self.clusters.values():
+        table = self.table
+        cluster_ids, cluster_pos = [], []
+        rows, cols, isotopologues, also_in = [], [], [], []
+        also_in_text = {} # {(cluster_id, row): text representation of the other clusters of the feature}
+
+        for sample, clusters in self.clusters.items():
+            col = table.sample_index[sample]
+            membership = self._sample_memberships(sample) if self.mask_missing else None
             for cluster in clusters.values():
                 sorted_features = sorted(cluster.features, key=lambda f: f.mz)
+                cols += [col] * len(sorted_features)
+                cluster_pos += [len(cluster_ids)] * len(sorted_features)
+                cluster_ids.append(cluster.cluster_id)
 
                 for f in sorted_features:
+                    row = f.row
+                    rows.append(row)
+                    annotation = table.annotation(row)
                     # iso_label = f.cluster_isotopologue.get(cluster.cluster_id, "Mx")
-                    all_clusters.append({
-                        "ClusterID": cluster.cluster_id,
-                        "FeatureID": f.feature_id,
-                        "RT": f.rt,
-                        "m/z": f.mz,
-                        "sample": f.sample,
-                        "Intensity": f.intensity,
-                        "Isotopologue": f.cluster_isotopologue[cluster.cluster_id],
-                        # "InClusters": f.in_cluster,
-                        "AlsoIn": str(f.also_in[cluster.cluster_id])
-                    })
-
-        self.all_clusters_df = pd.DataFrame(all_clusters)
+                    isotopologues.append(annotation.cluster_isotopologue[cluster.cluster_id])
+                    if membership is not None:
+                        also_in.append(str([c for c in membership[row] if c != cluster.cluster_id]))
+                        continue
+                    key = (cluster.cluster_id, row)
+                    if key not in also_in_text:
+                        also_in_text[key] = str(annotation.also_in[cluster.cluster_id])
+                    also_in.append(also_in_text[key])
+
+        if not rows:
+            self.all_clusters_df = pd.DataFrame()
+            return
+
+        rows = np.array(rows, dtype=np.int64)
+        cols = np.array(cols, dtype=np.int64)
+        self.all_clusters_df = pd.DataFrame({
+            "ClusterID": self._take_categorical(cluster_ids, cluster_pos),
+            "FeatureID": table.feature_id[rows],
+            "RT": table.rt[rows],
+            "m/z": table.mz[rows],
+            "sample": pd.Categorical.from_codes(cols, categories=table.samples),
+            "Intensity": table.intensities[rows, cols],
+            "Isotopologue": pd.Categorical(isotopologues),
+            # "InClusters": f.in_cluster,
+            "AlsoIn": pd.Categorical(also_in)
+        })
+
+    def _sample_memberships(self, sample:str) -> dict:
+        """
+        Returns the clusters containing each feature in a sample, in cluster order.
+        They differ from the clusters of the annotations, shared by all samples, when features are masked (`mask_missing`).
+
+        :param sample: Name of the sample.
+        :return: dict {row: [cluster_id]}
+        """
+        memberships = defaultdict(list)
+        for cluster_id, cluster in self.clusters[sample].items():
+            for feature in cluster.features:
+                memberships[feature.row].append(cluster_id)
+        return memberships
 
     def unlabeled_enhancer(self, clusters_df, sample_name):
         """
@@ -4,6 +4,8 @@ Variable configuration for testing
 
 import pytest
 from isogroup.base.feature import Feature
+from isogroup.base.misc import Misc
+import numpy as np
 import pandas as pd
 
 @pytest.fixture
@@ -66,3 +68,20 @@ def dataset_df_duplicates():
          'Sample_1': [1571414706.0, 1059554882.0, 31398195.78, 0.0, 529223407.9, 2090662547.0, 529223407.9, 2090662547.0, 3105587268.0, 2077278842.0, 543216118.8], 
          'Sample_2': [266171108.6, 129533534.2, 5324316.124, 0.0, 28994270.58, 97127965.25, 28994270.58, 97127965.25, 154077393.8, 218743897.0, 155940888.7]}
     )
+
+@pytest.fixture
+def dense_dataset_df():
+    """
+    Random dataset with many co-eluting features and planted isotopologue ladders.
+    """
+    rng = np.random.default_rng(0)
+    mzshift = float(Misc.calculate_mzshift("13C"))
+    base_mz = rng.uniform(80, 900, 150)
+    base_rt = rng.uniform(60, 600, 150)
+    nb_isotopologues = rng.integers(1, 8, 150)
+    mz = np.concatenate([m + np.arange(n) * mzshift + rng.normal(0, 1e-4, n) for m, n in zip(base_mz, nb_isotopologues)])
+    rt = np.concatenate([r + rng.normal(0, 1, n) for r, n in zip(base_rt, nb_isotopologues)])
+    # Noise features and exact RT ties
+    mz = np.concatenate([mz, rng.uniform(80, 900, 300)])
+    rt = np.concatenate([rt, np.round(rng.uniform(60, 600, 300))])
+    return pd.DataFrame({"id": [f"F{i}" for i in range(len(mz))], "mz": mz, "rt": rt, "Sample_1": rng.uniform(0, 1e6, len(mz))})
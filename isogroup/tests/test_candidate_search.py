@@ -0,0 +1,215 @@
+from isogroup.base.candidate_search import CandidateSearch
+from isogroup.base import parallel
+from isogroup.base.untargeted_experiment import UntargetedExperiment
+from isogroup.base.misc import Misc
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.mark.parametrize("rt_tol, ppm_tol, max_atoms", [(15, 5, None), (5, 10, None), (30, 20, 3), (0, 5, None)])
+
+def test_vectorized_pairs(dense_dataset_df, rt_tol, ppm_tol, max_atoms):
+    """
+    Test that the vectorized and ladder index candidate searches return exactly the pairs of the reference loop.
+
+    :param dense_dataset_df: DataFrame containing a dense random dataset.
+    """
+    sorted_df = dense_dataset_df.sort_values("rt", kind="stable")
+    search = CandidateSearch(mzshift_tracer=float(Misc.calculate_mzshift("13C")), tracer_element="C",
+                             rt_tol=rt_tol, ppm_tol=ppm_tol, max_atoms=max_atoms, chunk_size=64)
+    loop_bases, loop_candidates = search.pairs_loop(sorted_df["rt"].tolist(), sorted_df["mz"].tolist())
+    assert len(loop_bases) > 0 or rt_tol == 0
+    for bases, candidates in [search.window_pairs(sorted_df["rt"].to_numpy(), sorted_df["mz"].to_numpy()),
+                              search.ladder_pairs(sorted_df["rt"].to_numpy(), sorted_df["mz"].to_numpy())]:
+        assert np.array_equal(bases, loop_bases)
+        assert np.array_equal(candidates, loop_candidates)
+
+
+@pytest.mark.parametrize("ppm_tol", [5, 20000])
+
+def test_parallel_pairs(dense_dataset_df, ppm_tol):
+    """
+    Test that searching blocks of base features in parallel returns the same pairs, in the same order, as a serial run.
+
+    :param dense_dataset_df: DataFrame containing a dense random dataset.
+    """
+    sorted_df = dense_dataset_df.sort_values("rt", kind="stable")
+    rts, mzs = sorted_df["rt"].to_numpy(), sorted_df["mz"].to_numpy()
+    search = CandidateSearch(mzshift_tracer=float(Misc.calculate_mzshift("13C")), tracer_element="C",
+                             rt_tol=15, ppm_tol=ppm_tol, chunk_size=64)
+    expected_bases, expected_candidates = search.pairs(rts, mzs)
+
+    search.n_jobs = 2
+    search.parallel_block_size = 200
+    bases, candidates = search.pairs(rts, mzs)
+    assert np.array_equal(bases, expected_bases)
+    assert np.array_equal(candidates, expected_candidates)
+
+
+@pytest.mark.parametrize("partition_size", [1, 37, 1000])
+
+def test_partitioned_pairs(dense_dataset_df, partition_size):
+    """
+    Test that the RT-partitioned candidate search returns the same pairs, in the same order, as the global search,
+    from sorted arrays or from unsorted arrays and their sorting order.
+
+    :param dense_dataset_df: DataFrame containing a dense random dataset.
+    """
+    sorted_df = dense_dataset_df.sort_values("rt", kind="stable")
+    rts, mzs = sorted_df["rt"].to_numpy(), sorted_df["mz"].to_numpy()
+    search = CandidateSearch(mzshift_tracer=float(Misc.calculate_mzshift("13C")), tracer_element="C", rt_tol=15, ppm_tol=5)
+    expected_bases, expected_candidates = search.pairs(rts, mzs)
+
+    partitions = search.rt_partitions(rts, partition_size)
+    assert [core_start for core_start, _, _, _ in partitions] == list(range(0, len(rts), partition_size))
+    for core_start, core_stop, halo_start, halo_stop in partitions:
+        assert halo_start <= core_start < core_stop <= halo_stop
+    bases, candidates = search.partitioned_pairs(rts, mzs, partition_size)
+    assert np.array_equal(bases, expected_bases)
+    assert np.array_equal(candidates, expected_candidates)
+
+    # Unsorted arrays, each partition being gathered through the sorting order
+    unsorted_rts, unsorted_mzs = dense_dataset_df["rt"].to_numpy(), dense_dataset_df["mz"].to_numpy()
+    order = np.argsort(unsorted_rts, kind="stable")
+    assert search.rt_partitions(unsorted_rts, partition_size, order) == partitions
+    for size in (partition_size, None):
+        bases, candidates = search.partitioned_pairs(unsorted_rts, unsorted_mzs, size, order)
+        assert np.array_equal(bases, expected_bases)
+        assert np.array_equal(candidates, expected_candidates)
+
+
+def test_partitioned_parallel_pairs(dense_dataset_df, monkeypatch):
+    """
+    Test that the partitions of a parallel RT-partitioned search are searched by a single process pool, and return the
+    same pairs as the global serial search.
+
+    :param dense_dataset_df: DataFrame containing a dense random dataset.
+    """
+    sorted_df = dense_dataset_df.sort_values("rt", kind="stable")
+    rts, mzs = sorted_df["rt"].to_numpy(), sorted_df["mz"].to_numpy()
+    search = CandidateSearch(mzshift_tracer=float(Misc.calculate_mzshift("13C")), tracer_element="C", rt_tol=15, ppm_tol=5)
+    expected_bases, expected_candidates = search.pairs(rts, mzs)
+
+    pools = []
+    pool_class = parallel.ProcessPoolExecutor
+    monkeypatch.setattr(parallel, "ProcessPoolExecutor", lambda *args, **kwargs: pools.append(pool_class(*args, **kwargs)) or pools[-1])
+    search.n_jobs = 2
+    search.parallel_block_size = 50
+    bases, candidates = search.partitioned_pairs(rts, mzs, 300)
+    assert len(search.rt_partitions(rts, 300)) > 1
+    assert len(pools) == 1
+    assert np.array_equal(bases, expected_bases)
+    assert np.array_equal(candidates, expected_candidates)
+
+
+@pytest.mark.parametrize("engine", ["star", "graph"])
+
+def test_partitioned_clusters(dense_dataset_df, engine):
+    """
+    Test that clustering by RT partitions gives the same clusters as a global run, including clusters crossing a partition boundary.
+
+    :param dense_dataset_df: DataFrame containing a dense random dataset.
+    """
+    clusters = []
+    for partition_size in (None, 50):
+        experiment = UntargetedExperiment(dataset=dense_dataset_df, tracer="13C", ppm_tol=5, rt_tol=15, engine=engine,
+                                          partition_size=partition_size)
+        experiment.initialize_experimental_features()
+        experiment.build_clusters(rt_tol=15, ppm_tol=5)
+        clusters.append(experiment.cluster_rows)
+    assert clusters[0] == clusters[1]
+
+
+def test_build_clusters_matches_loop(dense_dataset_df):
+    """
+    Test that build_clusters produces the same clusters as the reference loop.
+
+    :param dense_dataset_df: DataFrame containing a dense random dataset.
+    """
+    experiment = UntargetedExperiment(dataset=dense_dataset_df, tracer="13C", ppm_tol=5, rt_tol=15)
+    experiment.initialize_experimental_features()
+    experiment.build_clusters(rt_tol=15, ppm_tol=5)
+
+    table = experiment.table
+    rt_order = np.argsort(table.rt, kind="stable")
+    search = CandidateSearch(mzshift_tracer=experiment.mzshift_tracer, tracer_element="C", rt_tol=15, ppm_tol=5)
+    bases, candidates = search.pairs_loop(table.rt[rt_order].tolist(), table.mz[rt_order].tolist())
+    expected = {}
+    for base, candidate in zip(rt_order[bases].tolist(), rt_order[candidates].tolist()):
+        expected.setdefault(base, {base}).add(candidate)
+
+    assert [set(rows) for rows in experiment.cluster_rows.values()] == list(expected.values())
+
+
+def test_connected_components():
+    """
+    Test the labelling of the connected components of a graph.
+    """
+    labels = CandidateSearch.connected_components(7, np.array([5, 1, 3, 4]), np.array([6, 2, 2, 3]))
+    assert labels.tolist() == [0, 1, 1, 1, 1, 5, 5]
+
+
+def test_ladder_components_edges():
+    """
+    Test that the isotopic-adjacency graph only links features exactly one tracer shift apart: co-eluting features at
+    the same m/z are not linked, while a ladder is chained beyond max_atoms and beyond the RT window.
+    """
+    mzshift = float(Misc.calculate_mzshift("13C"))
+    search = CandidateSearch(mzshift_tracer=mzshift, tracer_element="C", rt_tol=10, ppm_tol=5, max_atoms=2)
+    # Two co-eluting features at the same m/z
+    labels = search.ladder_components(np.array([100.0, 101.0]), np.array([150.0, 150.0]))
+    assert labels.tolist() == [0, 1]
+
+    # A ladder of 6 features, each 8 seconds after the previous one
+    rts = 100.0 + 8 * np.arange(6)
+    mzs = 150.0 + mzshift * np.arange(6)
+    labels = search.ladder_components(rts, mzs)
+    assert labels.tolist() == [0] * 6
+
+
+def test_graph_clusters_are_disjoint(dense_dataset_df):
+    """
+    Test that the graph engine produces each feature in at most one cluster, and that each
+    star cluster of two features is contained in a graph cluster.
+
+    :param dense_dataset_df: DataFrame containing a dense random dataset.
+    """
+    clusters = {}
+    for engine in ("star", "graph"):
+        experiment = UntargetedExperiment(dataset=dense_dataset_df, tracer="13C", ppm_tol=5, rt_tol=15, max_atoms=1, engine=engine)
+        experiment.initialize_experimental_features()
+        experiment.build_clusters(rt_tol=15, ppm_tol=5, max_atoms=1)
+        clusters[engine] = [set(rows) for rows in experiment.cluster_rows.values()]
+
+    rows = [row for cluster in clusters["graph"] for row in cluster]
+    assert len(rows) == len(set(rows))
+    for star_cluster in clusters["star"]:
+        assert any(star_cluster <= graph_cluster for graph_cluster in clusters["graph"])
+
+
+def test_keep_longest_cluster_matches_pairwise(dense_dataset_df):
+    """
+    Test that the indexed subset removal keeps the same clusters, and logs the same removals, as the pairwise comparison
+    of every cluster with every kept cluster.
+
+    :param dense_dataset_df: DataFrame containing a dense random dataset.
+    """
+    experiment = UntargetedExperiment(dataset=dense_dataset_df, tracer="13C", ppm_tol=5, rt_tol=15, max_atoms=3)
+    experiment.initialize_experimental_features()
+    experiment.build_clusters(rt_tol=15, ppm_tol=5, max_atoms=3)
+    clusters = {cid: list(rows) for cid, rows in experiment.cluster_rows.items()}
+
+    expected_removed = []
+    kept = []
+    for cid, sig in sorted(((cid, set(rows)) for cid, rows in clusters.items()), key=lambda x: len(x[1]), reverse=True):
+        superset = next((sig2 for sig2 in kept if sig < sig2), None)
+        if superset is None:
+            kept.append(sig)
+        else:
+            expected_removed.append((sig, superset))
+
+    experiment._keep_longest_cluster(clusters)
+    assert expected_removed
+    assert sorted(sorted(rows) for rows in clusters.values()) == sorted(sorted(sig) for sig in kept)
+    assert [(set(removed), set(superset)) for removed, superset in experiment.subsets_removed] == expected_removed
@@ -1,5 +1,6 @@
 from isogroup.base.cluster import Cluster
 from isogroup.base.feature import Feature
+from isocor.base import LabelledChemical
 import math
 
 def test_lowest_highest_rt():
@@ -38,3 +39,54 @@ def test_mean_rt_mz():
 
     assert math.isclose(cluster.mean_rt, (3.5 + 1.2 + 2.8) / 3)
     assert math.isclose(cluster.mean_mz, (119.02575 + 120.02913 + 191.01958) / 3)
+
+
+def _succinate_features(isotopologues:list) -> list:
+    """
+    Build succinate (C4H6O4) features annotated with the given isotopologues.
+
+    :param isotopologues: Isotopologue of each feature.
+    """
+    chemical = LabelledChemical(formula="C4H6O4", tracer="13C", derivative_formula="", tracer_purity=[1.0, 0.0],
+                                correct_NA_tracer=False, data_isotopes=None, charge=-1, label="Succinate")
+    features = []
+    for index, isotopologue in enumerate(isotopologues):
+        feature = Feature(feature_id=f"F{index}", mz=117.019 + isotopologue * 1.00335, rt=668, intensity=1000, tracer="13C",
+                          tracer_element="C", chemical=[chemical], formula=[chemical.formula])
+        feature.cluster_isotopologue["Succinate"] = isotopologue
+        features.append(feature)
+    return features
+
+
+def test_status():
+    """
+    Test the status, missing and duplicated isotopologues of complete, incomplete and duplicated clusters.
+    """
+    complete = Cluster(features=_succinate_features([0, 1, 2, 3, 4]), cluster_id="C0", name="Succinate")
+    assert complete.status == "Complete"
+    assert complete.missing_isotopologues is None
+    assert complete.duplicated_isotopologues is None
+
+    incomplete = Cluster(features=_succinate_features([0, 1, 1, 4]), cluster_id="C1", name="Succinate")
+    assert incomplete.status == "Incomplete, Duplicated isotopologues"
+    assert incomplete.isotopologues == [0, 1, 1, 4]
+    assert incomplete.missing_isotopologues == [2, 3]
+    assert incomplete.duplicated_isotopologues == [1]
+    assert incomplete.summary["Missing_isotopologues"] == [2, 3]
+
+
+def test_invalidation():
+    """
+    Test that the cached properties are updated when the features of the cluster change.
+    """
+    cluster = Cluster(features=_succinate_features([0, 1, 2, 3]), cluster_id="C0", name="Succinate")
+    assert cluster.missing_isotopologues == [4]
+
+    cluster.features = _succinate_features([0, 1, 2, 3, 4])
+    assert cluster.is_complete
+
+    cluster.features.pop()
+    assert cluster.is_complete
+    cluster.invalidate()
+    assert not cluster.is_complete
+    assert cluster.missing_isotopologues == [4]
@@ -0,0 +1,161 @@
+from isogroup.base.database import Database
+from unittest.mock import patch
+import os
+import stat
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def test_match(database_df):
+    """
+    Test that the indexed matching of Database returns the same matches, in the same order, as the comparison
+    of every experimental feature with every theoretical feature.
+
+    :param database_df: DataFrame containing the database of known metabolites.
+    """
+    database = Database(dataset=database_df, tracer="13C", tracer_element="C")
+    rng = np.random.default_rng(0)
+    theoretical_mz = np.array([feature.mz for feature in database.theoretical_features])
+    theoretical_rt = np.array([feature.rt for feature in database.theoretical_features])
+    mzs = rng.choice(theoretical_mz, 500) * (1 + rng.uniform(-10e-6, 10e-6, 500))
+    rts = rng.choice(theoretical_rt, 500) + rng.uniform(-20, 20, 500)
+
+    expected = []
+    for row, (mz, rt) in enumerate(zip(mzs.tolist(), rts.tolist())):
+        for position, db_feature in enumerate(database.theoretical_features):
+            mz_error = (db_feature.mz - mz) / mz * 1e6
+            rt_error = db_feature.rt - rt
+            if abs(mz_error) <= 5 and abs(rt_error) <= 10:
+                expected.append((row, position, mz_error, rt_error))
+
+    rows, positions, mz_errors, rt_errors = database.match(mzs, rts, ppm_tol=5, rt_tol=10)
+    assert expected
+    assert list(zip(rows.tolist(), positions.tolist(), mz_errors.tolist(), rt_errors.tolist())) == expected
+
+
+def test_parallel_match(database_df):
+    """
+    Test that matching blocks of experimental features in parallel returns the same matches as a serial run.
+
+    :param database_df: DataFrame containing the database of known metabolites.
+    """
+    database = Database(dataset=database_df, tracer="13C", tracer_element="C")
+    rng = np.random.default_rng(0)
+    theoretical_mz = database.compiled["mz"]
+    mzs = rng.choice(theoretical_mz, 500) * (1 + rng.uniform(-10e-6, 10e-6, 500))
+    rts = rng.choice(database.compiled["rt"], 500) + rng.uniform(-20, 20, 500)
+
+    expected = database.match(mzs, rts, ppm_tol=5, rt_tol=10)
+    database.parallel_block_size = 100
+    result = database.match(mzs, rts, ppm_tol=5, rt_tol=10, n_jobs=2)
+    for expected_column, column in zip(expected, result):
+        assert np.array_equal(column, expected_column)
+
+
+def test_match_empty(database_df):
+    """
+    Test the matching of an empty set of experimental features.
+
+    :param database_df: DataFrame containing the database of known metabolites.
+    """
+    database = Database(dataset=database_df, tracer="13C", tracer_element="C")
+    rows, positions, mz_errors, rt_errors = database.match(np.empty(0), np.empty(0), ppm_tol=5, rt_tol=10)
+    assert len(rows) == len(positions) == len(mz_errors) == len(rt_errors) == 0
+
+
+def test_compiled_cache(database_df, tmp_path):
+    """
+    Test that the compiled database is stored in the cache and loaded back without creating LabelledChemical objects.
+
+    :param database_df: DataFrame containing the database of known metabolites.
+    :param tmp_path: Temporary directory used as cache.
+    """
+    compiled = Database(dataset=database_df, tracer="13C", tracer_element="C", cache_dir=tmp_path)
+    assert compiled.cache_path.exists()
+
+    cached = Database(dataset=database_df, tracer="13C", tracer_element="C", cache_dir=tmp_path)
+    assert cached._chemicals == {}
+    for column in Database.COMPILED_COLUMNS:
+        assert np.array_equal(cached.compiled[column], compiled.compiled[column])
+    pd.testing.assert_frame_equal(cached.theoretical_database_df, compiled.theoretical_database_df)
+    assert [(f.mz, f.rt, f.metabolite, f.cluster_isotopologue) for f in cached.theoretical_features] == \
+           [(f.mz, f.rt, f.metabolite, f.cluster_isotopologue) for f in compiled.theoretical_features]
+
+
+def test_cache_key(database_df, tmp_path):
+    """
+    Test that the cache key changes with the database content, the tracer and the mass engine.
+
+    :param database_df: DataFrame containing the database of known metabolites.
+    :param tmp_path: Temporary directory used as cache.
+    """
+    database = Database(dataset=database_df, tracer="13C", tracer_element="C", cache_dir=tmp_path)
+    modified_df = database_df.copy()
+    modified_df.loc[0, "rt"] += 1
+    modified = Database(dataset=modified_df, tracer="13C", tracer_element="C", cache_dir=tmp_path)
+    other_tracer = Database(dataset=database_df, tracer="2H", tracer_element="H", cache_dir=tmp_path)
+    other_engine = Database(dataset=database_df, tracer="13C", tracer_element="C", cache_dir=tmp_path, engine="isocor")
+    assert len({database.cache_key, modified.cache_key, other_tracer.cache_key, other_engine.cache_key}) == 4
+    assert modified.compiled["rt"][0] == database.compiled["rt"][0] + 1
+    assert len(list(tmp_path.glob("*.npz"))) == 4
+    umask = os.umask(0)
+    os.umask(umask)
+    assert stat.S_IMODE(database.cache_path.stat().st_mode) == 0o666 & ~umask
+
+
+def test_cache_key_source(database_df, tmp_path):
+    """
+    Test that the cache key of a database read from a file depends on the file, and not on the content of the dataset.
+
+    :param database_df: DataFrame containing the database of known metabolites.
+    :param tmp_path: Temporary directory used as cache.
+    """
+    source = tmp_path / "database.csv"
+    database_df.to_csv(source, sep=";", index=False)
+    database = Database(dataset=database_df, tracer="13C", tracer_element="C", cache_dir=tmp_path, source=source)
+    with patch("pandas.util.hash_pandas_object", side_effect=AssertionError("dataset hashed")):
+        key = database.cache_key
+    os.utime(source, ns=(source.stat().st_atime_ns, source.stat().st_mtime_ns + 10**9))
+    assert database.cache_key != key
+
+
+def test_native_engine(database_df):
+    """
+    Test that the native mass engine compiles the same table as isocor, including compounds that fall back to isocor.
+
+    :param database_df: DataFrame containing the database of known metabolites.
+    """
+    # A formula with a trailing space cannot be parsed by the native engine and falls back to isocor
+    database_df = database_df.copy()
+    database_df.loc[1, "formula"] = database_df.loc[1, "formula"] + " "
+    native = Database(dataset=database_df, tracer="13C", tracer_element="C")
+    reference = Database(dataset=database_df, tracer="13C", tracer_element="C", engine="isocor")
+    for column in Database.COMPILED_COLUMNS:
+        assert np.array_equal(native.compiled[column], reference.compiled[column])
+    assert list(native._chemicals) == [1]
+
+
+def test_wrong_engine(database_df):
+    """
+    Test that an unknown mass engine raises an error.
+
+    :param database_df: DataFrame containing the database of known metabolites.
+    """
+    with pytest.raises(ValueError):
+        Database(dataset=database_df, tracer="13C", tracer_element="C", engine="other")
+
+
+@pytest.mark.parametrize("engine", ["native", "isocor"])
+@pytest.mark.parametrize("charge", [-1.5, np.nan])
+
+def test_invalid_charge(database_df, engine, charge):
+    """
+    Test that a missing or non-integer charge is rejected instead of being truncated in the compiled table.
+
+    :param database_df: DataFrame containing the database of known metabolites.
+    """
+    database_df = database_df.astype({"charge": float})
+    database_df.loc[2, "charge"] = charge
+    with pytest.raises(ValueError, match="Citrate"):
+        Database(dataset=database_df, tracer="13C", tracer_element="C", engine=engine)
@@ -0,0 +1,36 @@
+from isogroup.base.feature import Feature
+import pytest
+
+
+def test_lazy_annotation():
+    """
+    Test that the annotation of a feature is only created when it is used, and that annotation attributes can be set.
+    """
+    feature = Feature(feature_id="F1", mz=119.02575, rt=3.5, intensity=1000, tracer="13C")
+    assert feature._annotation is None
+    assert feature.metabolite == []
+    assert feature.in_cluster == []
+    assert feature.is_adduct == (False, "")
+    feature.in_cluster = ["C0"]
+    feature.cluster_isotopologue["C0"] = "Mx"
+    assert feature.in_cluster == ["C0"]
+    assert feature.cluster_isotopologue == {"C0": "Mx"}
+
+
+def test_extra_dims():
+    """
+    Test the extra dimensions of a feature, given at initialization or set as undeclared attributes, and the counter formula.
+    """
+    feature = Feature(feature_id="F1", mz=119.02575, rt=3.5, intensity=1000, tracer="13C",
+                      cluster_isotopologue={"Succinate": 0}, charge=-1)
+    assert feature.cluster_isotopologue == {"Succinate": 0}
+    assert feature.charge == -1
+    with pytest.raises(AttributeError):
+        feature.adduct
+    feature.adduct = "M+H"
+    assert feature.adduct == "M+H"
+    assert feature._extra_dims == {"charge": -1, "adduct": "M+H"}
+    assert feature.counter_formula == []
+    feature.counter_formula = [{"C": 4}]
+    assert feature.counter_formula == [{"C": 4}]
+    assert not hasattr(feature, "__dict__")
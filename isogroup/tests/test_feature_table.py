@@ -0,0 +1,68 @@
+from isogroup.base.feature_table import FeatureTable
+from isogroup.base.feature import Feature
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def test_from_dataframe(dataset_df):
+    """
+    Test that the feature table stores shared columns and a features x samples intensity matrix.
+
+    :param dataset_df: DataFrame containing the dataset for testing.
+    """
+    table = FeatureTable.from_dataframe(dataset_df, tracer="13C", tracer_element="C")
+    assert len(table) == 9
+    assert table.samples == ["Sample_1", "Sample_2"]
+    assert table.intensities.shape == (9, 2)
+    assert table.mz.dtype == np.float64
+    assert table.row_index["F3"] == 2
+    assert table.intensities[2, 1] == 5324316.124
+
+
+@pytest.mark.parametrize("wrong_input_dataframe", [
+    pd.DataFrame({"mz": [119.0257, 120.0291], "rt": [667.7790, 667.9255], "id": ["F1", "F2"]}),
+    pd.DataFrame({"mz": [119.0257, 120.0291], "rt": [667.7790, 667.9255], "Sample_1": [1571414706.0, 1059554882.0]})])
+
+def test_wrong_dataframe(wrong_input_dataframe):
+    """
+    Test that a dataset without id/mz/rt or sample columns is rejected.
+    """
+    with pytest.raises(ValueError):
+        FeatureTable.from_dataframe(wrong_input_dataframe)
+
+
+def test_feature_view(dataset_df):
+    """
+    Test that Feature views read the table and share their annotations between samples.
+
+    :param dataset_df: DataFrame containing the dataset for testing.
+    """
+    table = FeatureTable.from_dataframe(dataset_df, tracer="13C", tracer_element="C")
+    features = table.as_dict()
+    feature_1 = features["Sample_1"]["F2"]
+    feature_2 = features["Sample_2"]["F2"]
+    assert isinstance(feature_1, Feature)
+    assert feature_1.mz == 120.0291332
+    assert feature_1.intensity == 1059554882.0
+    assert feature_2.intensity == 129533534.2
+    assert feature_1.sample == "Sample_1"
+    assert feature_1 == features["Sample_1"]["F2"]
+    assert feature_1 != feature_2
+
+    assert table.get_annotation(1) is None
+    feature_1.metabolite.append("Succinate")
+    assert feature_2.metabolite == ["Succinate"]
+
+
+def test_from_features(features_dict):
+    """
+    Test the creation of a feature table from Feature objects organized by sample.
+
+    :param features_dict: Features organized by sample.
+    """
+    table = FeatureTable.from_features(features_dict)
+    assert len(table) == 9
+    assert table.samples == ["Sample_1", "Sample_2"]
+    assert table.tracer_element == "C"
+    assert table.intensities[0, 1] == 266171108.6
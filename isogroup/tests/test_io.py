@@ -0,0 +1,228 @@
+from isogroup.base.feature_table import FeatureTable
+from isogroup.base.io import IoHandler
+from isogroup.base.targeted_experiment import TargetedExperiment
+import numpy as np
+import os
+import stat
+import pandas as pd
+import pytest
+
+
+def test_clusters_summary(dataset_df, database_df, tmp_path):
+    """
+    Test the summary of the clusters, with a cluster present in only one sample.
+
+    :param dataset_df: DataFrame containing the dataset features.
+    :param database_df: DataFrame containing the database of known metabolites.
+    :param tmp_path: Temporary output directory.
+    """
+    targeted_experiment = TargetedExperiment(dataset=dataset_df,
+                                            tracer="13C",
+                                            ppm_tol=5,
+                                            rt_tol=15,
+                                            database=database_df)
+    targeted_experiment.initialize_experimental_features()
+    targeted_experiment.annotate_features()
+    targeted_experiment.clusterize()
+    del targeted_experiment.clusters["Sample_2"]["Citrate"]
+
+    io = IoHandler()
+    io.outputs_path = tmp_path
+    io.dataset_name = "test"
+    io.clusters_summary(targeted_experiment.clusters)
+    summary = pd.read_csv(tmp_path / "test.summary.tsv", sep="\t")
+    assert summary["Name"].tolist() == ["Succinate", "Citrate", "Isocitrate", "Malate"]
+    assert summary["number_of_samples"].tolist() == [2, 1, 2, 2]
+    assert summary["Number_of_features"].tolist() == [2, 1, 1, 5]
+
+
+def test_read_feature_table(dataset_df, tmp_path):
+    """
+    Test that the chunked reader loads the same feature table as the DataFrame reader, from plain and gzip-compressed files.
+
+    :param dataset_df: DataFrame containing the dataset features.
+    :param tmp_path: Temporary directory.
+    """
+    dataset_df.to_csv(tmp_path / "dataset.txt", sep="\t", index=False)
+    dataset_df.to_csv(tmp_path / "dataset.txt.gz", sep="\t", index=False)
+    expected = FeatureTable.from_dataframe(IoHandler().read_dataset(tmp_path / "dataset.txt"))
+
+    for filename in ("dataset.txt", "dataset.txt.gz"):
+        io = IoHandler()
+        table = io.read_feature_table(tmp_path / filename, chunksize=2)
+        assert io.dataset_name == "dataset"
+        assert table.samples == expected.samples
+        assert table.feature_id.tolist() == [str(feature_id) for feature_id in expected.feature_id]
+        assert np.array_equal(table.mz, expected.mz)
+        assert np.array_equal(table.rt, expected.rt)
+        assert table.intensities.dtype == np.float64
+        assert np.array_equal(table.intensities, expected.intensities)
+
+    table = IoHandler().read_feature_table(tmp_path / "dataset.txt", intensity_dtype="float32")
+    assert table.intensities.dtype == np.float32
+    assert np.allclose(table.intensities, expected.intensities, rtol=1e-6)
+
+
+def test_read_feature_table_missing_columns(dataset_df, tmp_path):
+    """
+    Test that the chunked reader rejects a dataset without the 'mz', 'rt' and 'id' columns.
+
+    :param dataset_df: DataFrame containing the dataset features.
+    :param tmp_path: Temporary directory.
+    """
+    dataset_df.drop(columns="rt").to_csv(tmp_path / "dataset.txt", sep="\t", index=False)
+    with pytest.raises(ValueError):
+        IoHandler().read_feature_table(tmp_path / "dataset.txt")
+
+
+@pytest.mark.parametrize("extension", ["parquet", "arrow"])
+
+def test_read_feature_table_columnar(dataset_df, tmp_path, extension):
+    """
+    Test that Parquet and Arrow datasets, spread over several row groups or record batches, are read batch by batch
+    into the same feature table as the text dataset.
+
+    :param dataset_df: DataFrame containing the dataset features.
+    :param tmp_path: Temporary directory.
+    """
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.feather
+    dataset_df.to_csv(tmp_path / "dataset.txt", sep="\t", index=False)
+    expected = IoHandler().read_feature_table(tmp_path / "dataset.txt", intensity_dtype="float32")
+    # Non-default index, stored as an extra column by pandas
+    indexed_df = dataset_df.set_index(dataset_df.index + 10)
+    if extension == "parquet":
+        indexed_df.to_parquet(tmp_path / "dataset.parquet", row_group_size=4)
+    else:
+        pyarrow.feather.write_feather(pyarrow.Table.from_pandas(indexed_df), tmp_path / "dataset.arrow", chunksize=4)
+
+    table = IoHandler().read_feature_table(tmp_path / f"dataset.{extension}", intensity_dtype="float32", chunksize=3)
+    assert table.samples == expected.samples
+    assert table.feature_id.tolist() == expected.feature_id.tolist()
+    assert np.array_equal(table.mz, expected.mz)
+    assert np.array_equal(table.rt, expected.rt)
+    assert table.intensities.dtype == np.float32
+    assert np.array_equal(table.intensities, expected.intensities)
+
+
+def test_typed_lists():
+    """
+    Test the conversion of the text representation of list-valued columns back to lists.
+    """
+    df = pd.DataFrame({"metabolite": pd.Categorical(["['Citrate', 'Isocitrate']", "[]", "['Citrate', 'Isocitrate']"]),
+                       "isotopologue": ["[0, 1]", None, ""],
+                       "Isotopologues": [[0, 1], np.array([2]), None],
+                       "mz": [1.0, 2.0, 3.0]})
+    typed = IoHandler.typed_lists(df, {"metabolite", "isotopologue", "Isotopologues", "AlsoIn"})
+    assert typed["metabolite"].tolist() == [["Citrate", "Isocitrate"], [], ["Citrate", "Isocitrate"]]
+    assert typed["isotopologue"].tolist() == [[0, 1], None, None]
+    assert typed["Isotopologues"].tolist() == [[0, 1], [2], None]
+    assert typed["mz"].tolist() == [1.0, 2.0, 3.0]
+    # The original DataFrame is left unchanged
+    assert df["metabolite"].tolist()[0] == "['Citrate', 'Isocitrate']"
+
+
+def test_output_format():
+    """
+    Test that an unknown output format is rejected.
+    """
+    with pytest.raises(ValueError):
+        IoHandler(output_format="xlsx")
+
+
+@pytest.mark.parametrize("output_format, extension", [("parquet", "parquet"), ("arrow", "arrow")])
+
+def test_arrow_outputs(dataset_df, database_df, tmp_path, output_format, extension):
+    """
+    Test the Parquet and Arrow readers and writers: datasets and databases are read as their text counterparts,
+    and results are written with typed list columns.
+
+    :param dataset_df: DataFrame containing the dataset features.
+    :param database_df: DataFrame containing the database of known metabolites.
+    :param tmp_path: Temporary directory.
+    """
+    pytest.importorskip("pyarrow")
+    write = {"parquet": pd.DataFrame.to_parquet, "arrow": pd.DataFrame.to_feather}[output_format]
+    write(dataset_df, tmp_path / f"dataset.{extension}")
+    write(database_df, tmp_path / f"database.{extension}")
+
+    io = IoHandler(output_format=output_format)
+    dataset = io.read_dataset(tmp_path / f"dataset.{extension}")
+    database = io.read_database(tmp_path / f"database.{extension}")
+    pd.testing.assert_frame_equal(dataset, dataset_df)
+    pd.testing.assert_frame_equal(database, database_df)
+    table = io.read_feature_table(tmp_path / f"dataset.{extension}")
+    assert np.array_equal(table.intensities, dataset_df[["Sample_1", "Sample_2"]].to_numpy())
+
+    targeted_experiment = TargetedExperiment(dataset=table, tracer="13C", ppm_tol=5, rt_tol=15, database=database)
+    targeted_experiment.run_targeted_pipeline()
+    io.outputs_path = tmp_path
+    io.export_features(targeted_experiment.all_features_df)
+    io.export_clusters(targeted_experiment.all_clusters_df)
+    io.clusters_summary(targeted_experiment.clusters)
+
+    read = {"parquet": pd.read_parquet, "arrow": pd.read_feather}[output_format]
+    features = read(tmp_path / f"dataset.features.{extension}")
+    assert len(features) == len(targeted_experiment.all_features_df)
+    assert list(features["metabolite"].iloc[0]) == ["Succinate"]
+    clusters = read(tmp_path / f"dataset.clusters.{extension}")
+    assert list(clusters["feature_potential_metabolite"].iloc[0]) == ["Succinate"]
+    summary = read(tmp_path / f"dataset.summary.{extension}")
+    assert list(summary["Isotopologues"].iloc[0]) == [2, 3]
+
+
+def test_dataset_cache(dataset_df, tmp_path):
+    """
+    Test that the dataset cache is written on first read, memory-mapped on later reads, and invalidated when the file changes.
+
+    :param dataset_df: DataFrame containing the dataset features.
+    :param tmp_path: Temporary directory.
+    """
+    dataset_path = tmp_path / "dataset.txt"
+    cache_dir = tmp_path / "cache"
+    dataset_df.to_csv(dataset_path, sep="\t", index=False)
+    expected = IoHandler().read_feature_table(dataset_path)
+
+    io = IoHandler()
+    io.read_feature_table(dataset_path, cache_dir=cache_dir)
+    cache_path = io.dataset_cache_path(cache_dir)
+    assert cache_path.exists()
+    assert [path.name for path in cache_dir.iterdir()] == [cache_path.name]
+    umask = os.umask(0)
+    os.umask(umask)
+    assert stat.S_IMODE(cache_path.stat().st_mode) == 0o777 & ~umask
+
+    table = IoHandler().read_feature_table(dataset_path, cache_dir=cache_dir)
+    assert isinstance(table.intensities, np.memmap) or isinstance(table.intensities.base, np.memmap)
+    assert table.feature_id.tolist() == expected.feature_id.tolist()
+    assert table.samples == expected.samples
+    assert np.array_equal(table.mz, expected.mz)
+    assert np.array_equal(table.rt, expected.rt)
+    assert np.array_equal(table.intensities, expected.intensities)
+
+    # Another intensity dtype, or a modified file, get their own cache entry
+    assert io.dataset_cache_path(cache_dir, "float32") != cache_path
+    dataset_df.iloc[:5].to_csv(dataset_path, sep="\t", index=False)
+    os.utime(dataset_path, ns=(0, 0))
+    table = IoHandler().read_feature_table(dataset_path, cache_dir=cache_dir)
+    assert len(table) == 5
+    assert len(list(cache_dir.iterdir())) == 2
+
+
+def test_cached_experiment(dataset_df, database_df, tmp_path):
+    """
+    Test that an experiment run on a memory-mapped dataset gives the same results as on the parsed dataset.
+
+    :param dataset_df: DataFrame containing the dataset features.
+    :param database_df: DataFrame containing the database of known metabolites.
+    :param tmp_path: Temporary directory.
+    """
+    dataset_path = tmp_path / "dataset.txt"
+    dataset_df.to_csv(dataset_path, sep="\t", index=False)
+    features = []
+    for _ in range(2):
+        table = IoHandler().read_feature_table(dataset_path, cache_dir=tmp_path / "cache")
+        targeted_experiment = TargetedExperiment(dataset=table, tracer="13C", ppm_tol=5, rt_tol=15, database=database_df)
+        targeted_experiment.run_targeted_pipeline()
+        features.append(targeted_experiment.all_features_df)
+    pd.testing.assert_frame_equal(features[0], features[1])
@@ -0,0 +1,55 @@
+from isogroup.base.mass_engine import MassEngine
+from isocor.base import LabelledChemical
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("formula", ["C4H6O4", "C6H13O9P", "C3H7NO2S", "H2O", "C10H16N5O13P3", "CHCl3"])
+def test_masses(formula):
+    """
+    Test that the monoisotopic masses are the same as the molecular weights computed by isocor.
+
+    :param formula: Elemental formula.
+    """
+    engine = MassEngine()
+    counts, valid = engine.parse_formulas([formula])
+    if "Cl" in formula:
+        # Cl is not in the isotopic data
+        assert not valid[0]
+        return
+    chemical = LabelledChemical(formula=formula, tracer="1H" if "C" not in formula else "13C", derivative_formula="",
+                                tracer_purity=[1.0, 0.0], correct_NA_tracer=False, data_isotopes=None)
+    assert valid[0]
+    assert engine.masses(counts)[0] == float(chemical.molecular_weight)
+
+
+def test_parse_formulas():
+    """
+    Test the bulk parsing of formulas, and the detection of the formulas that cannot be parsed.
+    """
+    engine = MassEngine()
+    counts, valid = engine.parse_formulas(["C6H12O6", "C6H12O6 ", "", None, "CH3COOH", "Xy2"])
+    assert valid.tolist() == [True, False, False, False, True, False]
+    assert counts[0, engine.element_index["C"]] == 6
+    assert counts[0, engine.element_index["H"]] == 12
+    assert counts[4, engine.element_index["C"]] == 2
+    assert counts[4, engine.element_index["O"]] == 2
+    assert counts[4, engine.element_index["H"]] == 4
+    assert not counts[[1, 2, 3, 5]].any()
+
+
+def test_isotopologues_mz():
+    """
+    Test the m/z of the isotopologues of a formula.
+    """
+    engine = MassEngine()
+    counts, _ = engine.parse_formulas(["C4H6O4", "C2H4O2"])
+    formula_pos, isotopologues, mzs = engine.isotopologues_mz(counts, [-1, 1], "C")
+    assert formula_pos.tolist() == [0, 0, 0, 0, 0, 1, 1, 1]
+    assert isotopologues.tolist() == [0, 1, 2, 3, 4, 0, 1, 2]
+    isodata = LabelledChemical.DEFAULT_ISODATA
+    mzshift = isodata["C"]["mass"][1] - isodata["C"]["mass"][0]
+    chemical = LabelledChemical(formula="C4H6O4", tracer="13C", derivative_formula="", tracer_purity=[1.0, 0.0],
+                                correct_NA_tracer=False, data_isotopes=None)
+    assert mzs[2] == float(chemical.molecular_weight + 2 * mzshift - isodata["H"]["mass"][0])
+    assert np.all(np.diff(mzs[:5]) > 0)
@@ -0,0 +1,133 @@
+from isogroup.base.metrics import PipelineMetrics
+from isogroup.base.targeted_experiment import TargetedExperiment
+from isogroup.base.untargeted_experiment import UntargetedExperiment
+import json
+import tracemalloc
+import pytest
+
+
+def test_stage_counters():
+    """
+    Test that counters are attached to the running stage, or to the pipeline outside of any stage.
+    """
+    metrics = PipelineMetrics()
+    metrics.count("runs")
+    with metrics.stage("outer"):
+        metrics.count("items", 2)
+        with metrics.stage("inner"):
+            metrics.count("items", 3)
+        metrics.count("items", 4)
+
+    assert [stage.name for stage in metrics.stages] == ["inner", "outer"]
+    assert metrics["outer"].counters == {"items": 6}
+    assert metrics["inner"].counters == {"items": 3}
+    assert metrics.counters == {"runs": 1}
+    assert metrics["outer"].wall_time >= metrics["inner"].wall_time >= 0
+    with pytest.raises(KeyError):
+        metrics["missing"]
+
+
+def test_stage_failure():
+    """
+    Test that a stage interrupted by an exception is still measured.
+    """
+    metrics = PipelineMetrics()
+    with pytest.raises(ValueError):
+        with metrics.stage("failing"):
+            raise ValueError
+    assert metrics["failing"].wall_time is not None
+    assert not metrics._running
+
+
+def test_peak_rss():
+    """
+    Test that the peak RSS is reported once for the pipeline, each stage recording by how much it raised it.
+    """
+    metrics = PipelineMetrics()
+    with metrics.stage("allocating"):
+        buffer = bytearray(64 * 2**20)
+        buffer[::4096] = b"x" * len(buffer[::4096])
+    del buffer
+    with metrics.stage("idle"):
+        pass
+    if metrics.peak_rss is None:
+        pytest.skip("Peak RSS is not available on this platform.")
+    assert metrics["allocating"].peak_rss_increase >= 32 * 2**20
+    assert metrics["idle"].peak_rss_increase < 2**20
+    assert metrics.as_dict()["peak_rss"] == metrics.peak_rss
+
+
+def test_traced_memory():
+    """
+    Test that the peak of traced memory is only measured when tracemalloc is tracing.
+    """
+    metrics = PipelineMetrics()
+    with metrics.stage("untraced"):
+        pass
+    tracemalloc.start()
+    try:
+        with metrics.stage("traced"):
+            buffer = bytearray(2**20)
+    finally:
+        tracemalloc.stop()
+    assert metrics["untraced"].peak_traced is None
+    assert metrics["traced"].peak_traced >= len(buffer)
+
+
+def test_nested_traced_memory():
+    """
+    Test that a nested stage does not hide the peak of traced memory reached by its outer stage before it started.
+    """
+    metrics = PipelineMetrics()
+    tracemalloc.start()
+    try:
+        with metrics.stage("outer"):
+            buffer = bytearray(2**22)
+            del buffer
+            with metrics.stage("inner"):
+                pass
+    finally:
+        tracemalloc.stop()
+    assert metrics["outer"].peak_traced >= 2**22
+    assert metrics["inner"].peak_traced < 2**22
+
+
+def test_targeted_metrics(dataset_df, database_df, tmp_path):
+    """
+    Test the metrics recorded by the targeted pipeline and their JSON export.
+
+    :param dataset_df: DataFrame containing the dataset features.
+    :param database_df: DataFrame containing the database features.
+    """
+    experiment = TargetedExperiment(dataset=dataset_df, tracer="13C", ppm_tol=5, rt_tol=10, database=database_df)
+    experiment.run_targeted_pipeline()
+    metrics = experiment.metrics
+
+    assert [stage.name for stage in metrics.stages] == ["compile_database", "initialize_features", "annotate_features",
+                                                        "clusterize", "create_dataframes"]
+    assert metrics["initialize_features"].counters == {"features": 9, "samples": 2}
+    assert metrics["clusterize"].counters["clusters_formed"] == len(experiment.clusters["Sample_1"])
+
+    metrics.save(tmp_path / "metrics.json")
+    with open(tmp_path / "metrics.json") as f:
+        saved = json.load(f)
+    assert saved == metrics.as_dict()
+    assert saved["stages"][0]["name"] == "compile_database"
+
+
+def test_untargeted_metrics(dataset_df_duplicates):
+    """
+    Test the item counts recorded by the untargeted pipeline.
+
+    :param dataset_df_duplicates: DataFrame containing duplicated clusters.
+    """
+    experiment = UntargetedExperiment(dataset=dataset_df_duplicates, tracer="13C", ppm_tol=5, rt_tol=10, keep="longest")
+    experiment.run_untargeted_pipeline()
+    metrics = experiment.metrics
+
+    build, deduplicate = metrics["build_clusters"].counters, metrics["deduplicate_clusters"].counters
+    assert 0 < build["clusters_formed"] <= len(experiment.table)
+    assert build["candidate_pairs"] >= build["clusters_formed"]
+    assert build["clusters_formed"] - deduplicate["clusters_merged"] - deduplicate.get("subsets_removed", 0) == deduplicate["final_clusters"]
+    assert deduplicate["final_clusters"] == len(experiment.cluster_rows)
+    assert deduplicate["unassigned_features"] == len(next(iter(experiment.unclustered_features.values())))
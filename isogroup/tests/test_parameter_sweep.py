@@ -0,0 +1,46 @@
+from isogroup.base.parameter_sweep import ParameterSweep
+from isogroup.base.untargeted_experiment import UntargetedExperiment
+import pytest
+
+
+@pytest.mark.parametrize("engine, keep, max_atoms", [("star", None, [None, 2]), ("star", "both", [None]), ("graph", "longest", None)])
+
+def test_sweep_matches_runs(dense_dataset_df, engine, keep, max_atoms):
+    """
+    Test that each setting of a sweep gives the same clusters as a separate untargeted run with this setting.
+
+    :param dense_dataset_df: DataFrame containing a dense random dataset.
+    """
+    sweep = ParameterSweep(dataset=dense_dataset_df, tracer="13C", ppm_tols=[2, 5, 20], rt_tols=[1, 15],
+                           max_atoms=max_atoms, keep=keep, engine=engine)
+    results = sweep.run()
+    assert len(results) == len(sweep.settings)
+
+    for (ppm_tol, rt_tol, setting_max_atoms), (_, row) in zip(sweep.settings, results.iterrows()):
+        experiment = UntargetedExperiment(dataset=dense_dataset_df, tracer="13C", ppm_tol=ppm_tol, rt_tol=rt_tol,
+                                          max_atoms=setting_max_atoms, keep=keep, engine=engine)
+        experiment.initialize_experimental_features()
+        experiment.build_clusters(rt_tol, ppm_tol, setting_max_atoms)
+        experiment.deduplicate_clusters(keep)
+
+        swept = sweep.run_setting(ppm_tol, rt_tol, setting_max_atoms)
+        assert swept.cluster_rows == experiment.cluster_rows
+        assert row["clusters"] == len(experiment.cluster_rows)
+        assert row["unassigned_features"] == len(experiment.unclustered_features["Sample_1"])
+        assert row["complete_clusters"] <= row["clusters"]
+
+
+def test_sweep_metrics(dataset_df):
+    """
+    Test the metrics of a sweep on a small dataset.
+
+    :param dataset_df: DataFrame containing the dataset features.
+    """
+    sweep = ParameterSweep(dataset=dataset_df, tracer="13C", ppm_tols=[5], rt_tols=[0, 10])
+    results = sweep.run()
+    assert results.columns.tolist() == ["ppm_tol", "rt_tol", "max_atoms", "clusters", "complete_clusters",
+                                        "unassigned_features", "runtime"]
+    assert results["clusters"].tolist()[0] == 0
+    assert results["unassigned_features"].tolist()[0] == len(dataset_df)
+    assert results["clusters"].tolist()[1] > 0
+    assert results["unassigned_features"].tolist()[1] < len(dataset_df)
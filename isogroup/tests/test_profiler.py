@@ -0,0 +1,33 @@
+from isogroup.base.profiler import Profiler
+import pstats
+import time
+
+
+def _busy(duration:float):
+    """
+    Keep the CPU busy for the given duration (in seconds).
+    """
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        pass
+
+
+def test_profile(tmp_path):
+    """
+    Test that a profiled block is recorded by cProfile and by the stack sampler, and that both profiles are saved.
+    """
+    profiler = Profiler(interval=0.001)
+    with profiler.run():
+        _busy(0.1)
+
+    assert "_busy" in profiler.top_functions(5, sort="cumulative")
+    assert any(stack[-1].endswith(":_busy") for stack in profiler.stacks)
+
+    pstats_path, collapsed_path = profiler.save(tmp_path / "run")
+    assert pstats_path.name == "run.pstats" and collapsed_path.name == "run.collapsed.txt"
+    functions = {function for _, _, function in pstats.Stats(str(pstats_path)).stats}
+    assert "_busy" in functions
+
+    lines = collapsed_path.read_text().splitlines()
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == sum(profiler.stacks.values())
+    assert any("test_profiler:_busy" in line for line in lines)
@@ -0,0 +1,86 @@
+from isogroup.base.synthetic import SyntheticDataset
+from isogroup.base.targeted_experiment import TargetedExperiment
+from isogroup.base.untargeted_experiment import UntargetedExperiment
+from isogroup.base.io import IoHandler
+import numpy as np
+import pandas as pd
+
+
+def test_generate():
+    """
+    Test the shape, reproducibility and ground truth of a synthetic dataset.
+    """
+    synthetic = SyntheticDataset(1000, n_samples=2, noise_fraction=0.25, missing_fraction=0.1, seed=3).generate()
+    dataset, truth = synthetic.dataset, synthetic.truth
+
+    assert list(dataset.columns) == ["id", "mz", "rt", "Sample_1", "Sample_2"]
+    assert len(dataset) == 1000 and dataset["id"].is_unique
+    assert truth["metabolite"].isna().sum() == 250
+    assert 0.05 < (dataset[["Sample_1", "Sample_2"]] == 0).to_numpy().mean() < 0.15
+    assert set(synthetic.database["metabolite"]) == set(truth["metabolite"].dropna())
+    pd.testing.assert_frame_equal(dataset, SyntheticDataset(1000, n_samples=2, noise_fraction=0.25, missing_fraction=0.1, seed=3).generate().dataset)
+
+    # Ladders go from M0 to the number of tracer atoms, except the last one which may be truncated
+    planted = truth.dropna()
+    sizes = planted.groupby("metabolite")["isotopologue"].agg(["min", "max", "count"])
+    assert (sizes["min"] == 0).all()
+    assert (sizes["count"] == sizes["max"] + 1).all()
+
+
+def test_atoms_and_database_size():
+    """
+    Test the distribution of the number of tracer atoms and the size of the database.
+    """
+    synthetic = SyntheticDataset(500, tracer="15N", atoms={1: 1, 3: 1}, noise_fraction=0, database_size=400).generate()
+    n_metabolites = synthetic.truth["metabolite"].nunique()
+    ladder_sizes = synthetic.truth.groupby("metabolite").size()
+    assert set(ladder_sizes.iloc[:-1]) <= {2, 4}
+    assert len(synthetic.database) == 400
+    assert synthetic.database["metabolite"].str.startswith("D").sum() == 400 - n_metabolites
+
+    subset = SyntheticDataset(500, database_size=10).generate()
+    assert len(subset.database) == 10
+    assert set(subset.database["metabolite"]) <= set(subset.truth["metabolite"].dropna())
+
+
+def test_planted_features_annotated():
+    """
+    Test that the targeted pipeline annotates every planted feature with its metabolite and isotopologue.
+    """
+    synthetic = SyntheticDataset(800, ppm_error=0.5, seed=1).generate()
+    experiment = TargetedExperiment(dataset=synthetic.dataset, tracer="13C", ppm_tol=5, rt_tol=10, database=synthetic.database)
+    experiment.initialize_experimental_features()
+    experiment.annotate_features()
+
+    for row, (metabolite, isotopologue) in enumerate(zip(synthetic.truth["metabolite"], synthetic.truth["isotopologue"])):
+        if pd.isna(metabolite):
+            continue
+        annotation = experiment.table.get_annotation(row)
+        assert annotation.cluster_isotopologue[metabolite] == isotopologue
+
+
+def test_planted_ladders_clustered():
+    """
+    Test that isolated planted ladders are found as clusters by the untargeted pipeline.
+    """
+    synthetic = SyntheticDataset(300, rt_density=0.5, noise_fraction=0, missing_fraction=0, seed=2).generate()
+    experiment = UntargetedExperiment(dataset=synthetic.dataset, tracer="13C", ppm_tol=5, rt_tol=5, engine="graph")
+    experiment.initialize_experimental_features()
+    experiment.build_clusters(experiment.rt_tol, experiment.ppm_tol)
+    clusters = {frozenset(rows) for rows in experiment.cluster_rows.values()}
+    ladders = synthetic.truth.groupby("metabolite").groups
+    found = sum(frozenset(np.asarray(rows)) in clusters for rows in ladders.values())
+    assert found >= 0.9 * len(ladders)
+
+
+def test_save(tmp_path):
+    """
+    Test that saved synthetic files are read back by IoHandler.
+    """
+    synthetic = SyntheticDataset(200, database_size=30)
+    dataset_path, database_path = synthetic.save(tmp_path)
+    io = IoHandler()
+    table = io.read_feature_table(dataset_path)
+    assert len(table) == 200 and table.samples == synthetic.samples
+    assert np.allclose(table.mz, synthetic.dataset["mz"])
+    pd.testing.assert_frame_equal(io.read_database(database_path), synthetic.database, check_dtype=False)
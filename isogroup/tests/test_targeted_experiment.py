@@ -1,5 +1,7 @@
 from isogroup.base.targeted_experiment import TargetedExperiment
+from isogroup.base.feature_table import FeatureTable
 import math
+import pandas as pd
 import pytest
 
 
@@ -82,4 +84,74 @@ def test_clusterize(dataset_df, database_df, cluster, features_nb):
     assert cluster in targeted_experiment.clusters["Sample_1"]
     assert cluster in targeted_experiment.clusters["Sample_2"]
     assert len(targeted_experiment.clusters["Sample_1"][cluster]) == features_nb
-    assert len(targeted_experiment.clusters["Sample_2"][cluster]) == features_nb
\ No newline at end of file
+    assert len(targeted_experiment.clusters["Sample_2"][cluster]) == features_nb
+
+
+def test_get_from_name(dataset_df, database_df):
+    """
+    Test the retrieval of features and clusters by metabolite name.
+
+    :param dataset_df: DataFrame containing the dataset features.
+    :param database_df: DataFrame containing the database of known metabolites.
+    """
+    targeted_experiment = TargetedExperiment(dataset=dataset_df,
+                                            tracer="13C",
+                                            ppm_tol=5,
+                                            rt_tol=15,
+                                            database=database_df)
+    targeted_experiment.initialize_experimental_features()
+    targeted_experiment.annotate_features()
+    targeted_experiment.clusterize()
+    assert list(targeted_experiment.metabolite_rows) == ["Succinate", "Citrate", "Isocitrate", "Malate"]
+    assert [f.feature_id for f in targeted_experiment.get_features_from_name("Citrate", "Sample_2")] == ["F3"]
+    assert [f.feature_id for f in targeted_experiment.get_features_from_name("Malate", "Sample_1")] == ["F5", "F6", "F7", "F8", "F9"]
+    assert targeted_experiment.get_features_from_name("Fumarate", "Sample_1") == []
+    assert targeted_experiment.get_clusters_from_name("Malate", "Sample_1") is targeted_experiment.clusters["Sample_1"]["Malate"]
+    assert targeted_experiment.get_clusters_from_name("Fumarate", "Sample_1") is None
+
+def test_create_clusters_df(dataset_df, database_df):
+    """
+    Test the dataframe of the clusters, and the clusters sharing a feature.
+
+    :param dataset_df: DataFrame containing the dataset features.
+    :param database_df: DataFrame containing the database of known metabolites.
+    """
+    targeted_experiment = TargetedExperiment(dataset=dataset_df,
+                                            tracer="13C",
+                                            ppm_tol=5,
+                                            rt_tol=15,
+                                            database=database_df)
+    targeted_experiment.initialize_experimental_features()
+    targeted_experiment.annotate_features()
+    targeted_experiment.clusterize()
+    targeted_experiment.create_clusters_df()
+    df = targeted_experiment.all_clusters_df
+    assert len(df) == 2 * 9
+    f3 = df[(df["feature_id"] == "F3") & (df["sample"] == "Sample_1")].set_index("metabolite")
+    assert f3.loc["Citrate", "in_another_cluster"] == [f3.loc["Isocitrate", "cluster_id"]]
+    assert f3.loc["Isocitrate", "in_another_cluster"] == [f3.loc["Citrate", "cluster_id"]]
+    assert f3.loc["Citrate", "feature_potential_metabolite"] == ["Citrate", "Isocitrate"]
+    assert math.isclose(f3.loc["Isocitrate", "rt_error"], 0.0069, rel_tol=0, abs_tol=1e-4)
+    assert df[df["feature_id"] == "F5"]["in_another_cluster"].tolist() == [[], []]
+    assert isinstance(df["sample"].dtype, pd.CategoricalDtype)
+    assert isinstance(df["cluster_id"].dtype, pd.CategoricalDtype)
+    assert df[df["sample"] == "Sample_2"]["intensity"].tolist() == \
+        [targeted_experiment.features["Sample_2"][feature_id].intensity for feature_id in df[df["sample"] == "Sample_2"]["feature_id"]]
+
+
+def test_shared_feature_table(dataset_df, database_df):
+    """
+    Test that experiments run on the same FeatureTable give the same results and leave the table unchanged.
+
+    :param dataset_df: DataFrame containing the dataset features.
+    :param database_df: DataFrame containing the database of known metabolites.
+    """
+    table = FeatureTable.from_dataframe(dataset_df)
+    clusters_dfs = []
+    for _ in range(2):
+        targeted_experiment = TargetedExperiment(dataset=table, tracer="13C", ppm_tol=5, rt_tol=15, database=database_df)
+        targeted_experiment.run_targeted_pipeline()
+        clusters_dfs.append(targeted_experiment.all_clusters_df)
+    pd.testing.assert_frame_equal(clusters_dfs[0], clusters_dfs[1])
+    assert not table._annotations
+    assert table.tracer is None
@@ -0,0 +1,85 @@
+from isogroup.base.trace import DecisionTrace
+from isogroup.base.targeted_experiment import TargetedExperiment
+from isogroup.base.untargeted_experiment import UntargetedExperiment
+from isogroup.base.synthetic import SyntheticDataset
+import numpy as np
+
+
+def test_disabled_trace():
+    """
+    Test that a trace without path is disabled and records nothing.
+    """
+    trace = DecisionTrace()
+    assert not trace
+    trace.record("event", value=1)
+    trace.close()
+
+
+def test_records(tmp_path):
+    """
+    Test that records are written as JSON Lines, with NumPy values and sets converted to JSON types.
+    """
+    path = tmp_path / "trace.jsonl"
+    with DecisionTrace(path) as trace:
+        assert trace
+        trace.record("cluster_formed", cluster="C0", features=np.array(["F1", "F2"], dtype=object),
+                     mz=np.array([100.0, 101.0]), size=np.int64(2), rows={2, 1})
+    assert not trace
+    assert DecisionTrace.read(path) == [{"event": "cluster_formed", "cluster": "C0", "features": ["F1", "F2"],
+                                         "mz": [100.0, 101.0], "size": 2, "rows": [1, 2]}]
+
+
+def test_targeted_trace(dataset_df, database_df, tmp_path):
+    """
+    Test the decisions traced by the targeted pipeline.
+
+    :param dataset_df: DataFrame containing the dataset features.
+    :param database_df: DataFrame containing the database features.
+    """
+    path = tmp_path / "trace.jsonl"
+    with DecisionTrace(path) as trace:
+        experiment = TargetedExperiment(dataset=dataset_df, tracer="13C", ppm_tol=5, rt_tol=10, database=database_df, trace=trace)
+        experiment.initialize_experimental_features()
+        experiment.annotate_features()
+        experiment.clusterize()
+    records = DecisionTrace.read(path)
+
+    annotated = [record for record in records if record["event"] == "feature_annotated"]
+    assert len(annotated) == experiment.metrics.counters["matches"]
+    assert {"feature": "F1", "metabolite": "Succinate", "isotopologue": 2}.items() <= annotated[0].items()
+
+    identified = {record["metabolite"]: record["features"] for record in records if record["event"] == "cluster_identified"}
+    assert identified == {name: [feature.feature_id for feature in cluster.features]
+                          for name, cluster in experiment.clusters["Sample_1"].items()}
+
+
+def test_untargeted_trace(tmp_path):
+    """
+    Test the decisions traced by the untargeted pipeline, on a synthetic dataset where subset clusters are removed.
+    """
+    dataset = SyntheticDataset(200, n_samples=2, seed=0).generate().dataset
+    path = tmp_path / "trace.jsonl"
+    with DecisionTrace(path) as trace:
+        experiment = UntargetedExperiment(dataset=dataset, tracer="13C", ppm_tol=5, rt_tol=10, trace=trace)
+        experiment.initialize_experimental_features()
+        experiment.build_clusters(experiment.rt_tol, experiment.ppm_tol)
+        formed = dict(experiment.cluster_rows)
+        experiment.deduplicate_clusters("longest")
+    records = DecisionTrace.read(path)
+    events = [record["event"] for record in records]
+
+    assert events.count("cluster_formed") == len(formed)
+    assert events.count("subset_removed") == len(experiment.subsets_removed) > 0
+    assert events.count("cluster_renamed") == len(experiment.cluster_rows)
+    removed = next(record for record in records if record["event"] == "subset_removed")
+    assert set(removed["features"]) < set(removed["superset"])
+
+
+def test_untraced_experiment(dataset_df):
+    """
+    Test that experiments are not traced by default.
+
+    :param dataset_df: DataFrame containing the dataset features.
+    """
+    experiment = UntargetedExperiment(dataset=dataset_df, tracer="13C", ppm_tol=5, rt_tol=10)
+    assert not experiment.trace
@@ -1,4 +1,6 @@
 from isogroup.base.untargeted_experiment import UntargetedExperiment
+from isogroup.base.candidate_search import CandidateSearch
+from isogroup.base.parallel import ParallelExecutor
 import pytest
 import pandas as pd
 import numpy as np
@@ -161,3 +163,148 @@ def test_fully_labeled_enhancer():
     
 
 
+
+@pytest.mark.parametrize("mask_missing, nb_features_sample_2", [(False, 5), (True, 4)])
+
+def test_clusters_projection(dataset_df, mask_missing, nb_features_sample_2):
+    """
+    Test that clusters are built once and projected onto every sample,
+    optionally leaving out features with a null intensity in a sample.
+
+    :param dataset_df: DataFrame containing the dataset for the experiment.
+    :param mask_missing: Whether features with a null intensity are masked.
+    :param nb_features_sample_2: Expected number of features of the Malate cluster in Sample_2.
+    """
+    dataset_df.loc[dataset_df["id"] == "F9", "Sample_2"] = 0.0
+    untargeted_experiment = UntargetedExperiment(dataset=dataset_df,
+                                                tracer="13C",
+                                                ppm_tol=5,
+                                                rt_tol=15,
+                                                max_atoms=None,
+                                                mask_missing=mask_missing)
+    untargeted_experiment.initialize_experimental_features()
+    untargeted_experiment.build_clusters(rt_tol=15, ppm_tol=5, max_atoms=None)
+    untargeted_experiment.deduplicate_clusters("longest")
+    assert len(untargeted_experiment.cluster_rows) == 2
+    assert len(untargeted_experiment.clusters["Sample_1"]["C1"]) == 5
+    assert len(untargeted_experiment.clusters["Sample_2"]["C1"]) == nb_features_sample_2
+    assert untargeted_experiment.clusters["Sample_1"]["C1"].features[0].intensity == untargeted_experiment.table.intensities[8, 0]
+
+def test_masked_memberships(dataset_df):
+    """
+    Test that, with masked features, the clusters listed in the features dataframe and in the AlsoIn column are
+    those of each sample, consistent with the clusters dataframe.
+
+    :param dataset_df: DataFrame containing the dataset for the experiment.
+    """
+    dataset_df.loc[dataset_df["id"] == "F9", "Sample_2"] = 0.0
+    untargeted_experiment = UntargetedExperiment(dataset=dataset_df, tracer="13C", ppm_tol=5, rt_tol=15, mask_missing=True)
+    untargeted_experiment.run_untargeted_pipeline()
+    features_df = untargeted_experiment.all_features_df.set_index(["FeatureID", "sample"])
+    clusters_df = untargeted_experiment.all_clusters_df
+
+    assert features_df.loc[("F9", "Sample_2"), "InClusters"] == ["None"]
+    assert features_df.loc[("F9", "Sample_1"), "InClusters"] != ["None"]
+    expected = {}
+    for feature_id, sample, cluster_id in zip(clusters_df["FeatureID"], clusters_df["sample"], clusters_df["ClusterID"]):
+        expected.setdefault((feature_id, sample), []).append(cluster_id)
+    expected = {key: sorted(ids, key=lambda c: int(c[1:])) for key, ids in expected.items()}
+    for (feature_id, sample), in_clusters in features_df["InClusters"].items():
+        assert in_clusters == expected.get((feature_id, sample), ["None"])
+    for _, line in clusters_df.iterrows():
+        others = [c for c in features_df.loc[(line["FeatureID"], line["sample"]), "InClusters"] if c != line["ClusterID"]]
+        assert line["AlsoIn"] == str(others)
+
+
+@pytest.mark.parametrize("deduplication_method, cluster_id, features_id",
+                         [(None, "C0", ["F1", "F2"]),
+                          (None, "C1", ['F11', 'F10', 'F9', 'F6', 'F5', 'F7', 'F8']),
+                          ("closest_mz", "C1", ['F11', 'F10', 'F9', 'F6', 'F5'])])
+
+def test_graph_engine(dataset_df_duplicates, deduplication_method, cluster_id, features_id):
+    """
+    Test that the graph engine extracts each isotopic ladder once, without overlapping clusters.
+
+    :param dataset_df_duplicates: DataFrame containing the dataset with duplicated features.
+    :param deduplication_method: Deduplication strategy applied after clustering.
+    :param cluster_id: Expected cluster ID to check.
+    :param features_id: List of expected feature IDs in the cluster.
+    """
+    untargeted_experiment = UntargetedExperiment(dataset=dataset_df_duplicates,
+                                                tracer="13C",
+                                                ppm_tol=5,
+                                                rt_tol=15,
+                                                engine="graph")
+    untargeted_experiment.initialize_experimental_features()
+    untargeted_experiment.build_clusters(rt_tol=15, ppm_tol=5)
+    assert len(untargeted_experiment.cluster_rows) == 2
+    untargeted_experiment.deduplicate_clusters(deduplication_method)
+    assert len(untargeted_experiment.clusters["Sample_1"]) == 2
+    assert sorted(f.feature_id for f in untargeted_experiment.clusters["Sample_2"][cluster_id]) == sorted(features_id)
+
+@pytest.mark.parametrize("engine", ["star", "graph"])
+
+def test_parallel_pipeline(dense_dataset_df, monkeypatch, engine):
+    """
+    Test that the untargeted pipeline exports the same features and clusters dataframes with several processes as
+    with one, and that the clusters of each feature are listed in cluster order.
+
+    :param dense_dataset_df: DataFrame containing a dense random dataset.
+    """
+    # Small blocks, so that the candidate search is split between worker processes
+    monkeypatch.setattr(CandidateSearch, "parallel_block_size", 200)
+    assert len(ParallelExecutor(2, CandidateSearch.parallel_block_size).blocks(len(dense_dataset_df))) > 1
+
+    experiments = []
+    for n_jobs in (1, 2):
+        experiment = UntargetedExperiment(dataset=dense_dataset_df, tracer="13C", ppm_tol=5, rt_tol=15, engine=engine, n_jobs=n_jobs)
+        experiment.run_untargeted_pipeline()
+        experiments.append(experiment)
+    pd.testing.assert_frame_equal(experiments[0].all_features_df, experiments[1].all_features_df)
+    pd.testing.assert_frame_equal(experiments[0].all_clusters_df, experiments[1].all_clusters_df)
+
+    table = experiments[1].table
+    in_clusters = [table.get_annotation(row).in_cluster for row in range(len(table)) if table.get_annotation(row) is not None]
+    assert any(len(clusters) > 1 for clusters in in_clusters) or engine == "graph"
+    for clusters in in_clusters:
+        assert clusters == sorted(clusters, key=lambda cluster_id: int(cluster_id[1:]))
+
+
+def test_wrong_engine():
+    """
+    Test that an unknown clustering engine is rejected.
+    """
+    with pytest.raises(ValueError):
+        UntargetedExperiment(dataset=pd.DataFrame(), tracer="13C", ppm_tol=5, rt_tol=15, engine="unknown")
+
+
+def test_create_dataframes(dataset_df):
+    """
+    Test the features and clusters dataframes of the UntargetedExperiment, with categorical and list columns,
+    and the unlabeled enhancer applied on the clusters dataframe.
+
+    :param dataset_df: DataFrame containing the dataset features.
+    """
+    untargeted_experiment = UntargetedExperiment(dataset=dataset_df, tracer="13C", ppm_tol=5, rt_tol=15, max_atoms=None)
+    untargeted_experiment.initialize_experimental_features()
+    untargeted_experiment.build_clusters(rt_tol=15, ppm_tol=5)
+    untargeted_experiment.deduplicate_clusters()
+    untargeted_experiment.create_features_df()
+    untargeted_experiment.create_clusters_df()
+
+    features_df = untargeted_experiment.all_features_df
+    assert len(features_df) == 2 * len(dataset_df)
+    assert features_df["sample"].tolist() == ["Sample_1"] * len(dataset_df) + ["Sample_2"] * len(dataset_df)
+    f1 = features_df[(features_df["FeatureID"] == "F1") & (features_df["sample"] == "Sample_2")].iloc[0]
+    assert f1["InClusters"] == untargeted_experiment.features["Sample_2"]["F1"].in_cluster
+
+    clusters_df = untargeted_experiment.all_clusters_df
+    assert isinstance(clusters_df["ClusterID"].dtype, pd.CategoricalDtype)
+    assert isinstance(clusters_df["Isotopologue"].dtype, pd.CategoricalDtype)
+    assert len(clusters_df) == sum(len(cluster) for clusters in untargeted_experiment.clusters.values() for cluster in clusters.values())
+    c1 = clusters_df[(clusters_df["ClusterID"] == "C1") & (clusters_df["sample"] == "Sample_1")]
+    assert c1["m/z"].is_monotonic_increasing
+    assert c1["Intensity"].tolist() == [untargeted_experiment.features["Sample_1"][feature_id].intensity for feature_id in c1["FeatureID"]]
+
+    untargeted_experiment.unlabeled_enhancer(clusters_df, sample_name="Sample_1")
+    assert len(untargeted_experiment.all_clusters_df) == len(clusters_df)
@@ -1,8 +1,13 @@
 import argparse
+from contextlib import contextmanager
 import isogroup
 from isogroup.base.targeted_experiment import TargetedExperiment
 from isogroup.base.untargeted_experiment import UntargetedExperiment
 from isogroup.base.io import IoHandler
+from isogroup.base.metrics import PipelineMetrics
+from isogroup.base.profiler import Profiler
+from isogroup.base.trace import DecisionTrace
+from isogroup.base.parameter_sweep import ParameterSweep
 import logging
 from pathlib import Path
 
@@ -30,6 +35,57 @@ def _build_logger(args, output_path):
     return _logger
 
 
+def _dataset_cache_dir(args):
+    """
+    Returns the directory of the dataset cache: the directory given with --dataset_cache, a directory next to the
+    dataset file if the option is given without value, or None if the option is not set.
+
+    :param args: arguments from the CLI
+    """
+    if args.dataset_cache is None:
+        return None
+    if args.dataset_cache:
+        return Path(args.dataset_cache)
+    return Path(args.inputdata).parent / IoHandler.DATASET_CACHE_DIR
+
+
+def _save_metrics(args, metrics, _logger):
+    """
+    Log the metrics of the export stage and write all the metrics to the JSON file given with --metrics, if any.
+
+    :param args: arguments from the CLI
+    :param metrics: PipelineMetrics of the run
+    :param _logger: logger of the run
+    """
+    _logger.info(f"  {metrics['export']}")
+    if args.metrics:
+        metrics.save(Path(args.metrics))
+        _logger.info(f"Metrics written to {args.metrics}")
+
+
+@contextmanager
+def _profiled(args, io, _logger):
+    """
+    Run the block under the profiler if --profile is set, and write the profile to the output directory, even if the
+    block fails: "<dataset>.pstats" (cProfile statistics) and "<dataset>.collapsed.txt" (sampled call stacks).
+    The table of the functions taking the most time is written to the log.
+
+    :param args: arguments from the CLI
+    :param io: IoHandler of the run, with the output directory created
+    :param _logger: logger of the run
+    """
+    if args.profile is None:
+        yield
+        return
+    profiler = Profiler()
+    try:
+        with profiler.run():
+            yield
+    finally:
+        pstats_path, collapsed_path = profiler.save(io.outputs_path / io.dataset_name)
+        _logger.info(f"Top {args.profile} functions by internal time:\n{profiler.top_functions(args.profile)}")
+        _logger.info(f"Profile written to {pstats_path} and {collapsed_path}")
+
 # -------------------
 # Targeted processing
 # -------------------
@@ -40,8 +96,12 @@ def targeted_process(args):
     """
     
     # load data file
-    io = IoHandler()
-    dataset = io.read_dataset(Path(args.inputdata))
+    io = IoHandler(output_format=args.output_format)
+    metrics = PipelineMetrics()
+    with metrics.stage("read_dataset"):
+        dataset = io.read_feature_table(Path(args.inputdata), 
+                                        intensity_dtype=args.intensity_dtype, 
+                                        cache_dir=_dataset_cache_dir(args))
     io.create_output_directory(Path(args.output))
 
     _logger = _build_logger(args, io.outputs_path)
@@ -58,27 +118,35 @@ def targeted_process(args):
     database = io.read_database(Path(args.database))
     _logger.info(f"  Database = {args.database}")
 
-    targeted_experiment= TargetedExperiment(
-        dataset=dataset,
-        tracer=args.tracer,
-        ppm_tol=args.ppm_tol,
-        rt_tol=args.rt_tol,
-        database=database)
+    with DecisionTrace(args.trace) as trace, _profiled(args, io, _logger):
+        targeted_experiment= TargetedExperiment(
+            dataset=dataset,
+            tracer=args.tracer,
+            ppm_tol=args.ppm_tol,
+            rt_tol=args.rt_tol,
+            database=database,
+            database_cache=args.database_cache,
+            database_source=Path(args.database),
+            n_jobs=args.jobs,
+            metrics=metrics,
+            trace=trace)
     
-    _logger.info(f"  Tracer = {args.tracer}")
-    _logger.info(f"  ppm tolerance (ppm) = {args.ppm_tol}")
-    _logger.info(f"  RT tolerance = {args.rt_tol}\n")
+        _logger.info(f"  Tracer = {args.tracer}")
+        _logger.info(f"  ppm tolerance (ppm) = {args.ppm_tol}")
+        _logger.info(f"  RT tolerance = {args.rt_tol}\n")
 
 
-    io.export_theoretical_database(targeted_experiment.database.theoretical_database_df)
+        io.export_theoretical_database(targeted_experiment.database.theoretical_database_df)
 
-    targeted_experiment.run_targeted_pipeline()
+        targeted_experiment.run_targeted_pipeline()
     
-    # io.targ_export_features(targeted_experiment.features)
-    # io.targ_export_clusters(targeted_experiment.features, targeted_experiment.clusters)
-    io.export_features(targeted_experiment.all_features_df)
-    io.export_clusters(targeted_experiment.all_clusters_df)
-    io.clusters_summary(targeted_experiment.clusters)
+        # io.targ_export_features(targeted_experiment.features)
+        # io.targ_export_clusters(targeted_experiment.features, targeted_experiment.clusters)
+        with metrics.stage("export"):
+            io.export_features(targeted_experiment.all_features_df)
+            io.export_clusters(targeted_experiment.all_clusters_df)
+            io.clusters_summary(targeted_experiment.clusters)
+        _save_metrics(args, metrics, _logger)
     _logger.info(f"Path to results files = {io.outputs_path}")
 
 # ---------------------
@@ -89,8 +157,12 @@ def untargeted_process(args):
     """
     Processing function for untargeted mode.
     """
-    io= IoHandler()
-    dataset = io.read_dataset(Path(args.inputdata))
+    io= IoHandler(output_format=args.output_format)
+    metrics = PipelineMetrics()
+    with metrics.stage("read_dataset"):
+        dataset = io.read_feature_table(Path(args.inputdata), 
+                                        intensity_dtype=args.intensity_dtype, 
+                                        cache_dir=_dataset_cache_dir(args))
     io.create_output_directory(Path(args.output))
 
     _logger=_build_logger(args, io.outputs_path)
@@ -105,36 +177,85 @@ def untargeted_process(args):
     _logger.info(f"  Version = {isogroup.__version__}")
     _logger.info(f"  Data file = {args.inputdata}")
 
-    untargeted_experiment= UntargetedExperiment(
-        dataset=dataset,
-        tracer=args.tracer,
-        ppm_tol=args.ppm_tol,
-        rt_tol=args.rt_tol,
-        max_atoms=args.max_atoms,
-        keep=args.keep)
+    with DecisionTrace(args.trace) as trace, _profiled(args, io, _logger):
+        untargeted_experiment= UntargetedExperiment(
+            dataset=dataset,
+            tracer=args.tracer,
+            ppm_tol=args.ppm_tol,
+            rt_tol=args.rt_tol,
+            max_atoms=args.max_atoms,
+            keep=args.keep,
+            mask_missing=args.mask_missing,
+            engine=args.engine,
+            n_jobs=args.jobs,
+            partition_size=args.partition_size,
+            metrics=metrics,
+            trace=trace)
     
+        _logger.info(f"  Tracer = {args.tracer}")
+        _logger.info(f"  ppm tolerance (ppm) = {args.ppm_tol}")
+        _logger.info(f"  RT tolerance = {args.rt_tol}")
+        _logger.info(f"  Max atoms = {args.max_atoms}\n")
+
+        # untargeted_experiment.build_final_clusters(
+        #     verbose=args.verbose,
+        #     keep_best_candidate=args.kbc,
+        #     keep_richest=args.kr,)
+
+        kwargs = {}
+        # if args.unlabeled:
+        #     kwargs = {"sample_name": args.unlabeled, "enhancing_mode": "unlabeled"}
+        # elif args.fully_labeled:
+        #     kwargs = {"sample_name": args.fully_labeled, "enhancing_mode": "fully_labeled"}
+        kwargs = {"unlabaled_sample": args.unlabeled, "fully_labeled_sample": args.fully_labeled}
+
+        untargeted_experiment.run_untargeted_pipeline(**kwargs)
+        # io.untarg_export_features(untargeted_experiment.features)
+        # io.untarg_export_clusters(untargeted_experiment.clusters)
+        with metrics.stage("export"):
+            io.export_features(untargeted_experiment.all_features_df)
+            io.export_clusters(untargeted_experiment.all_clusters_df)
+        _save_metrics(args, metrics, _logger)
+    _logger.info(f"Path to results files = {io.outputs_path}")
+
+# ----------------
+# Parameter sweep
+# ----------------
+
+def sweep_process(args):
+    """
+    Processing function for the parameter sweep of the untargeted mode.
+    """
+    io = IoHandler(output_format=args.output_format)
+    dataset = io.read_feature_table(Path(args.inputdata), 
+                                    intensity_dtype=args.intensity_dtype, 
+                                    cache_dir=_dataset_cache_dir(args))
+    io.create_output_directory(Path(args.output))
+
+    _logger = _build_logger(args, io.outputs_path)
+    _logger.info("====================")
+    _logger.info("Parameter sweep")
+    _logger.info("====================\n")
+    _logger.info(f"  Mode = Untargeted")
+    _logger.info(f"  Version = {isogroup.__version__}")
+    _logger.info(f"  Data file = {args.inputdata}")
     _logger.info(f"  Tracer = {args.tracer}")
-    _logger.info(f"  ppm tolerance (ppm) = {args.ppm_tol}")
-    _logger.info(f"  RT tolerance = {args.rt_tol}")
+    _logger.info(f"  ppm tolerances (ppm) = {args.ppm_tol}")
+    _logger.info(f"  RT tolerances = {args.rt_tol}")
     _logger.info(f"  Max atoms = {args.max_atoms}\n")
 
-    # untargeted_experiment.build_final_clusters(
-    #     verbose=args.verbose,
-    #     keep_best_candidate=args.kbc,
-    #     keep_richest=args.kr,)
-
-    kwargs = {}
-    # if args.unlabeled:
-    #     kwargs = {"sample_name": args.unlabeled, "enhancing_mode": "unlabeled"}
-    # elif args.fully_labeled:
-    #     kwargs = {"sample_name": args.fully_labeled, "enhancing_mode": "fully_labeled"}
-    kwargs = {"unlabaled_sample": args.unlabeled, "fully_labeled_sample": args.fully_labeled}
-
-    untargeted_experiment.run_untargeted_pipeline(**kwargs)
-    # io.untarg_export_features(untargeted_experiment.features)
-    # io.untarg_export_clusters(untargeted_experiment.clusters)
-    io.export_features(untargeted_experiment.all_features_df)
-    io.export_clusters(untargeted_experiment.all_clusters_df)
+    sweep = ParameterSweep(
+        dataset=dataset,
+        tracer=args.tracer,
+        ppm_tols=args.ppm_tol,
+        rt_tols=args.rt_tol,
+        max_atoms=[None if value == "auto" else int(value) for value in args.max_atoms],
+        keep=args.keep,
+        mask_missing=args.mask_missing,
+        engine=args.engine,
+        n_jobs=args.jobs)
+    results = sweep.run()
+    io.export_sweep(results)
     _logger.info(f"Path to results files = {io.outputs_path}")
 
 # -------------------
@@ -151,12 +272,28 @@ def build_parser_targeted():
                         help='the isotopic tracer (e.g. "13C")')
     parser.add_argument("-D", "--database", type=str, required=True,
                         help="path to database file (csv)")
+    parser.add_argument("--database_cache", type=str, default=None,
+                        help="directory where the compiled database is cached between runs. OPTIONAL")
+    parser.add_argument("--output_format", type=str, default="tsv", choices=["tsv", "parquet", "arrow"],
+                        help='format of the result files: "tsv", "parquet" or "arrow" (Arrow IPC), the last two requiring pyarrow (default: tsv). OPTIONAL')
+    parser.add_argument("--dataset_cache", type=str, nargs="?", const="", default=None,
+                        help=f'cache the parsed dataset as memory-mapped arrays, in the given directory or in "{IoHandler.DATASET_CACHE_DIR}" next to the dataset file. OPTIONAL')
+    parser.add_argument("--intensity_dtype", type=str, default="float64", choices=["float64", "float32"],
+                        help='precision of the intensities loaded in memory; "float32" halves the memory used by large datasets (default: float64). OPTIONAL')
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help='number of processes used to annotate the features, -1 to use all CPUs (default: 1). OPTIONAL')
     parser.add_argument("-ppm", "--ppm_tol", type=float, required=True,
                         help='m/z tolerance in ppm (e.g. "5")')
     parser.add_argument("-rt", "--rt_tol", type=float, required=True,
                         help='retention time tolerance (e.g. "10")')
     parser.add_argument("-o", "--output", type=str, required=True,
                         help='path to generate the output files')
+    parser.add_argument("--metrics", type=str, default=None,
+                        help='JSON file where the time, memory and item counts of each stage are written (e.g. "metrics.json"). OPTIONAL')
+    parser.add_argument("--profile", type=int, nargs="?", const=20, default=None, metavar="N",
+                        help='profile the run: write a .pstats file and a collapsed-stack file to the output directory, and the N functions taking the most time to the log (default N: 20). OPTIONAL')
+    parser.add_argument("--trace", type=str, default=None,
+                        help='JSON Lines file where the decisions taken on each feature and cluster are recorded (e.g. "trace.jsonl"). OPTIONAL')
     parser.add_argument("-v", "--verbose",
                         help='enable verbose logging', action="store_true")
     parser.set_defaults(func=targeted_process)
@@ -182,8 +319,28 @@ def build_parser_untargeted():
     #                     help='keep only the richest cluster among overlapping clusters during clustering (default: True)')
     parser.add_argument("-k","--keep", type=str, default="all",
                         help='strategy to deduplicate overlapping clusters: "longest", "closest_mz", "both", "all". OPTIONAL')
+    parser.add_argument("-e", "--engine", type=str, default="star", choices=["star", "graph"],
+                        help='clustering engine: "star" (one cluster per feature, then deduplication) or "graph" (one cluster per isotopic ladder). OPTIONAL')
+    parser.add_argument("--output_format", type=str, default="tsv", choices=["tsv", "parquet", "arrow"],
+                        help='format of the result files: "tsv", "parquet" or "arrow" (Arrow IPC), the last two requiring pyarrow (default: tsv). OPTIONAL')
+    parser.add_argument("--dataset_cache", type=str, nargs="?", const="", default=None,
+                        help=f'cache the parsed dataset as memory-mapped arrays, in the given directory or in "{IoHandler.DATASET_CACHE_DIR}" next to the dataset file. OPTIONAL')
+    parser.add_argument("--intensity_dtype", type=str, default="float64", choices=["float64", "float32"],
+                        help='precision of the intensities loaded in memory; "float32" halves the memory used by large datasets (default: float64). OPTIONAL')
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help='number of processes used to search isotopologue candidates, -1 to use all CPUs (default: 1). OPTIONAL')
+    parser.add_argument("--partition_size", type=int, default=None,
+                        help='number of features per retention time partition of the candidate search (default: no partitioning). OPTIONAL')
+    parser.add_argument("--mask_missing", action="store_true",
+                        help='leave features with a null intensity in a sample out of the clusters of this sample. OPTIONAL')
     parser.add_argument("-o", "--output", type=str, required=True,
                         help='path to generate the output files')
+    parser.add_argument("--metrics", type=str, default=None,
+                        help='JSON file where the time, memory and item counts of each stage are written (e.g. "metrics.json"). OPTIONAL')
+    parser.add_argument("--profile", type=int, nargs="?", const=20, default=None, metavar="N",
+                        help='profile the run: write a .pstats file and a collapsed-stack file to the output directory, and the N functions taking the most time to the log (default N: 20). OPTIONAL')
+    parser.add_argument("--trace", type=str, default=None,
+                        help='JSON Lines file where the decisions taken on each feature and cluster are recorded (e.g. "trace.jsonl"). OPTIONAL')
     parser.add_argument("-v", "--verbose", action="store_true",
                         help='enable verbose logging')
     
@@ -194,6 +351,41 @@ def build_parser_untargeted():
     parser.set_defaults(func=untargeted_process)
     return parser
 
+def build_parser_sweep():
+    parser = argparse.ArgumentParser(
+        prog='isogroup_sweep',
+        description='Grouping of isotopic datasets over a grid of tolerances',
+    )
+    parser.add_argument("inputdata", help="input dataset file")
+    parser.add_argument("-t", "--tracer", type=str, required=True,
+                        help='the isotopic tracer (e.g. "13C")')
+    parser.add_argument("-ppm", "--ppm_tol", type=float, nargs="+", required=True,
+                        help='m/z tolerances in ppm to test (e.g. "2 5 10")')
+    parser.add_argument("-rt","--rt_tol", type=float, nargs="+", required=True,
+                        help='rt tolerances to test (e.g. "5 10 20")')
+    parser.add_argument("--max_atoms", type=str, nargs="+", default=["auto"],
+                        help='maximum numbers of tracer atoms to test, "auto" for the automatic estimate (default: auto). OPTIONAL')
+    parser.add_argument("-k","--keep", type=str, default="all",
+                        help='strategy to deduplicate overlapping clusters: "longest", "closest_mz", "both", "all". OPTIONAL')
+    parser.add_argument("-e", "--engine", type=str, default="star", choices=["star", "graph"],
+                        help='clustering engine: "star" (one cluster per feature, then deduplication) or "graph" (one cluster per isotopic ladder). OPTIONAL')
+    parser.add_argument("--output_format", type=str, default="tsv", choices=["tsv", "parquet", "arrow"],
+                        help='format of the result file: "tsv", "parquet" or "arrow" (Arrow IPC), the last two requiring pyarrow (default: tsv). OPTIONAL')
+    parser.add_argument("--dataset_cache", type=str, nargs="?", const="", default=None,
+                        help=f'cache the parsed dataset as memory-mapped arrays, in the given directory or in "{IoHandler.DATASET_CACHE_DIR}" next to the dataset file. OPTIONAL')
+    parser.add_argument("--intensity_dtype", type=str, default="float64", choices=["float64", "float32"],
+                        help='precision of the intensities loaded in memory; "float32" halves the memory used by large datasets (default: float64). OPTIONAL')
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help='number of processes used to search isotopologue candidates, -1 to use all CPUs (default: 1). OPTIONAL')
+    parser.add_argument("--mask_missing", action="store_true",
+                        help='leave features with a null intensity in a sample out of the clusters of this sample. OPTIONAL')
+    parser.add_argument("-o", "--output", type=str, required=True,
+                        help='path to generate the output files')
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help='enable verbose logging')
+    parser.set_defaults(func=sweep_process)
+    return parser
+
 # ---------------------
 # CLI entry point
 # ---------------------
@@ -207,6 +399,11 @@ def main_untargeted():
     args = parser.parse_args()
     args.func(args)
 
+def main_sweep():
+    parser = build_parser_sweep()
+    args = parser.parse_args()
+    args.func(args)
+
 
 # -------------------
 # Old Targeted processing